@@ -26,12 +26,13 @@ Uses the built-in WSGI server.
 
 import argparse
 import contextlib
+import inspect
 import os
 import signal
 import socket
 import sys
 from types import FrameType
-from typing import List, Optional, cast
+from typing import Any, Dict, List, Optional, cast
 
 from radicale import (VERSION, config, item, log, server, sharing, storage,
                       types)
@@ -66,6 +67,27 @@ def run() -> None:
     parser.add_argument("--version", action="version", version=VERSION)
     parser.add_argument("--verify-storage", action="store_true",
                         help="check the storage for errors and exit")
+    parser.add_argument("--verify-storage-workers", type=int, default=0,
+                        metavar="NUMBER",
+                        help="number of processes used by --verify-storage "
+                        "(default: number of CPUs)")
+    parser.add_argument("--verify-storage-incremental", action="store_true",
+                        help="skip items that are unchanged since the last "
+                        "verification with --verify-storage")
+    parser.add_argument("--verify-storage-report", metavar="FILE",
+                        help="write the results of --verify-storage as JSON "
+                        "to the file")
+    parser.add_argument("--migrate-storage", action="store_true",
+                        help="copy the collections from the filesystem "
+                        "folder into the configured storage and exit")
+    parser.add_argument("--rebuild-cache", action="store_true",
+                        help="build the caches of all collections and exit")
+    parser.add_argument("--rebuild-cache-workers", type=int, default=0,
+                        metavar="NUMBER",
+                        help="number of processes used by --rebuild-cache "
+                        "(default: number of CPUs)")
+    parser.add_argument("--rebuild-cache-skip-unchanged", action="store_true",
+                        help="keep valid cache entries with --rebuild-cache")
     parser.add_argument("--verify-item", action="store", nargs=1,
                         help="check the provided item file for errors and exit")
     parser.add_argument("--verify-sharing", action="store_true",
@@ -188,8 +210,27 @@ def run() -> None:
         logger.info("Verifying storage")
         try:
             storage_ = storage.load(configuration)
+            # Options are only passed if set, they are not supported by all
+            # storage backends
+            verify_options: Dict[str, Any] = {}
+            if args_ns.verify_storage_workers:
+                verify_options["workers"] = args_ns.verify_storage_workers
+            if args_ns.verify_storage_incremental:
+                verify_options["incremental"] = True
+            if args_ns.verify_storage_report:
+                verify_options["report"] = args_ns.verify_storage_report
+            parameters = inspect.signature(storage_.verify).parameters
+            unsupported = [option for option in verify_options
+                           if option not in parameters]
+            if unsupported:
+                logger.critical(
+                    "Storage type %r doesn't support %s",
+                    configuration.get("storage", "type"), ", ".join(
+                        "--verify-storage-%s" % option
+                        for option in unsupported))
+                sys.exit(1)
             with storage_.acquire_lock("r"):
-                if not storage_.verify():
+                if not storage_.verify(**verify_options):
                     logger.critical("Storage verification failed")
                     sys.exit(1)
         except Exception as e:
@@ -198,6 +239,49 @@ def run() -> None:
             sys.exit(1)
         return
 
+    if args_ns.migrate_storage:
+        logger.info("Migrating storage")
+        try:
+            storage_ = storage.load(configuration)
+            migrate = getattr(storage_, "migrate", None)
+            if migrate is None:
+                logger.critical("Storage type %r doesn't support migration",
+                                configuration.get("storage", "type"))
+                sys.exit(1)
+            source_configuration = configuration.copy()
+            source_configuration.update(
+                {"storage": {"type": "multifilesystem"}}, "migration",
+                privileged=True)
+            source_storage = storage.load(source_configuration)
+            with source_storage.acquire_lock("r"), storage_.acquire_lock("w"):
+                if not migrate(source_storage):
+                    logger.critical("Storage migration failed")
+                    sys.exit(1)
+        except Exception as e:
+            logger.critical("An exception occurred during storage "
+                            "migration: %s", e, exc_info=True)
+            sys.exit(1)
+        return
+
+    if args_ns.rebuild_cache:
+        logger.info("Rebuilding storage cache")
+        try:
+            storage_ = storage.load(configuration)
+            rebuild_cache = getattr(storage_, "rebuild_cache", None)
+            if rebuild_cache is None:
+                logger.critical("Storage type %r doesn't support cache "
+                                "rebuild", configuration.get("storage", "type"))
+                sys.exit(1)
+            if not rebuild_cache(args_ns.rebuild_cache_workers,
+                                 args_ns.rebuild_cache_skip_unchanged):
+                logger.critical("Storage cache rebuild finished with errors")
+                sys.exit(1)
+        except Exception as e:
+            logger.critical("An exception occurred during storage cache "
+                            "rebuild: %s", e, exc_info=True)
+            sys.exit(1)
+        return
+
     if args_ns.verify_item:
         encoding = configuration.get("encoding", "stock")
         logger.info("Item verification start using 'stock' encoding: %s", encoding)
@@ -267,6 +267,8 @@ class Application(ApplicationPartDelete, ApplicationPartHead,
                 answers = [answer]
             start_response(status_text, headers)
         if environ.get("REQUEST_METHOD") == "HEAD":
+            if isinstance(answers, httputils.StreamingAnswer):
+                answers.close()
             return []
         return answers
 
@@ -284,14 +286,28 @@ class Application(ApplicationPartDelete, ApplicationPartHead,
 
         """Manage a request."""
         def response(status: int, headers: types.WSGIResponseHeaders,
-                     answer: Union[None, str, bytes],
+                     answer: Union[None, str, bytes, httputils.StreamingAnswer],
                      xml_request: Union[None, str] = None, request_info: dict = {}) -> _IntermediateResponse:
             """Helper to create response from internal types.WSGIResponse"""
             headers = dict(headers)
             content_encoding = "plain"
+            accept_encoding = [
+                encoding.strip() for encoding in
+                environ.get("HTTP_ACCEPT_ENCODING", "").split(",")
+                if encoding.strip()]
             # Set content length
-            answers = []
-            if answer is not None:
+            answers: Iterable[bytes] = []
+            if isinstance(answer, httputils.StreamingAnswer):
+                # The content is generated and compressed while it's sent,
+                # the length is unknown.
+                headers["Content-Type"] += "; charset=%s" % self._encoding
+                answer.encoding = self._encoding
+                if "gzip" in accept_encoding:
+                    answer.compress = True
+                    headers["Content-Encoding"] = "gzip"
+                    content_encoding = "gzip"
+                answers = answer
+            elif answer is not None:
                 if isinstance(answer, str):
                     if self._response_content_on_debug:
                         if logger.isEnabledFor(logging.DEBUG):
@@ -309,10 +325,6 @@ class Application(ApplicationPartDelete, ApplicationPartHead,
                                 logger.debug("Response content: suppressed by config/option [logging] response_content_on_debug")
                     headers["Content-Type"] += "; charset=%s" % self._encoding
                     answer = answer.encode(self._encoding)
-                accept_encoding = [
-                    encoding.strip() for encoding in
-                    environ.get("HTTP_ACCEPT_ENCODING", "").split(",")
-                    if encoding.strip()]
 
                 if "gzip" in accept_encoding:
                     zcomp = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)
@@ -321,7 +333,7 @@ class Application(ApplicationPartDelete, ApplicationPartHead,
                     content_encoding = "gzip"
 
                 headers["Content-Length"] = str(len(answer))
-                answers.append(answer)
+                answers = [answer]
 
             # Add extra headers set in configuration
             headers.update(self._extra_headers)
@@ -382,7 +394,12 @@ class Application(ApplicationPartDelete, ApplicationPartHead,
                 flags_text = " (" + " ".join(flags) + ")"
             else:
                 flags_text = ""
-            if answer is not None:
+            if isinstance(answer, httputils.StreamingAnswer):
+                message = "%s response status for %r%s in %.3f seconds %s streamed%s: %s" % (
+                            request_method, unsafe_path, depthinfo,
+                            time_delta_seconds, content_encoding, flags_text,
+                            status_text)
+            elif answer is not None:
                 message = "%s response status for %r%s in %.3f seconds %s %s bytes%s: %s" % (
                             request_method, unsafe_path, depthinfo,
                             time_delta_seconds, content_encoding, str(len(answer)),
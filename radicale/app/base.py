@@ -29,6 +29,7 @@ from radicale import (auth, config, hook, httputils, log, pathutils, privacy,
                       rights, sharing, storage, types, utils, web, xmlutils)
 from radicale.log import logger
 from radicale.privacy.core import PrivacyCore
+from radicale.privacy.scanner import PrivacyScanner
 from radicale.rights import intersect
 
 # HACK: https://github.com/tiran/defusedxml/issues/54
@@ -160,6 +161,9 @@ class ApplicationBase:
         self._hook = hook.load(configuration)
         self._privacy = privacy.load(configuration)
         self._privacy_core = PrivacyCore(configuration)
+        # Requests change the storage of the application, not the one of
+        # the scanner
+        PrivacyScanner.subscribe(self._storage)
 
     def _read_xml_request_body(self,
                                environ: types.WSGIEnviron,
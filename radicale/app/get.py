@@ -119,7 +119,7 @@ class ApplicationPartGet(ApplicationBase):
         access = Access(self._rights, user, path, permissions_filter)
         if not access.check("r") and "i" not in access.permissions:
             return httputils.NOT_ALLOWED
-        with self._storage.acquire_lock("r", user):
+        with self._storage.acquire_lock("r", user, path=path, request="GET"):
             item = next(iter(self._storage.discover(path)), None)
             if not item:
                 return httputils.NOT_FOUND
@@ -159,16 +159,23 @@ class ApplicationPartGet(ApplicationBase):
             }
             if content_disposition:
                 headers["Content-Disposition"] = content_disposition
-            if share and share['Conversion'] == "bday":
-                if isinstance(item, storage.BaseCollection):
+            answer: Union[str, httputils.StreamingAnswer]
+            if isinstance(item, storage.BaseCollection):
+                # The collection is exported to a temporary file, the
+                # storage isn't locked while it's sent to the client.
+                if share and share['Conversion'] == "bday":
                     # convert VCF to ICS
-                    answer = item.serialize(vcf_to_ics=True, ShareActions=share['Actions'])
+                    chunks = item.serialize_stream(
+                        vcf_to_ics=True, ShareActions=share['Actions'])
+                else:
+                    chunks = item.serialize_stream()
+                answer = httputils.StreamingAnswer.spooled(chunks)
+            elif share and share['Conversion'] == "bday":
+                item_converted = item.convert_vcf_to_ics(ShareActions=share['Actions'])
+                if item_converted is not None:
+                    answer = item_converted.serialize()
                 else:
-                    item_converted = item.convert_vcf_to_ics(ShareActions=share['Actions'])
-                    if item_converted is not None:
-                        answer = item_converted.serialize()
-                    else:
-                        return httputils.NOT_FOUND
+                    return httputils.NOT_FOUND
             else:
                 answer = item.serialize()
             return client.OK, headers, answer, None
@@ -608,7 +608,7 @@ class ApplicationPartPropfind(ApplicationBase):
         except socket.timeout:
             logger.debug("Client timed out", exc_info=True)
             return httputils.REQUEST_TIMEOUT
-        with self._storage.acquire_lock("r", user):
+        with self._storage.acquire_lock("r", user, path=path, request="PROPFIND"):
             logger.trace("PROPFIND: discover path=%r depth=%s", path, http_depth)
             items_iter = iter(self._storage.discover(
                 path, http_depth,
@@ -652,7 +652,7 @@ class ApplicationPartPropfind(ApplicationBase):
                             logger.trace("PROPFIND: skip shared collection: PathOrToken=%r PathMapped=%r Owner=%r Permissions=%r (permissions not matching)", c_share, c_path, c_user, c_permissions_filter)
                             continue
                         logger.trace("PROPFIND: append shared collection: PathOrToken=%r PathMapped=%r Owner=%r Permissions=%r", c_share, c_path, c_user, c_permissions_filter)
-                        with self._storage.acquire_lock("r", c_user):
+                        with self._storage.acquire_lock("r", c_user, path=c_path, request="PROPFIND"):
                             c_items_iter = iter(self._storage.discover(c_path, "0"))
                             c_allowed_items = list(self._collect_allowed_items(c_items_iter, c_user))
                         for item, permission, raw_permissions in c_allowed_items:
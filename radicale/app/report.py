@@ -883,7 +883,8 @@ class ApplicationPartReport(ApplicationBase):
             logger.debug("Client timed out", exc_info=True)
             return httputils.REQUEST_TIMEOUT
         with contextlib.ExitStack() as lock_stack:
-            lock_stack.enter_context(self._storage.acquire_lock("r", user))
+            lock_stack.enter_context(self._storage.acquire_lock(
+                "r", user, path=path, request="REPORT"))
             item = next(iter(self._storage.discover(path)), None)
             if not item:
                 return httputils.NOT_FOUND
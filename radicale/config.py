@@ -514,6 +514,10 @@ DEFAULT_CONFIG_SCHEMA: types.CONFIG_SCHEMA = OrderedDict([
             "value": "",
             "help": "path where cache of collections is stored in case of use_cache_subfolder_* options are active",
             "type": filepath}),
+        ("sqlite_database", {
+            "value": "",
+            "help": "path of the database of the sqlite storage backend",
+            "type": filepath}),
         ("use_cache_subfolder_for_item", {
             "value": "False",
             "help": "use subfolder 'collection-cache' for 'item' cache file structure instead of inside collection folder",
@@ -530,6 +534,46 @@ DEFAULT_CONFIG_SCHEMA: types.CONFIG_SCHEMA = OrderedDict([
             "value": "False",
             "help": "use mtime and file size instead of SHA256 for 'item' cache (improves speed)",
             "type": bool}),
+        ("use_packed_item_cache", {
+            "value": "False",
+            "help": "store the 'item' cache of a collection in one packed file instead of one file per item",
+            "type": bool}),
+        ("use_history_store", {
+            "value": "False",
+            "help": "store the 'history' cache of a collection in one file instead of one file per item",
+            "type": bool}),
+        ("use_collection_manifest", {
+            "value": "False",
+            "help": "keep etag and last modification time of a collection in a manifest instead of reading all items",
+            "type": bool}),
+        ("use_sync_change_log", {
+            "value": "False",
+            "help": "answer sync-collection requests from an append-only change log of the collection",
+            "type": bool}),
+        ("use_sync_token_deltas", {
+            "value": "False",
+            "help": "store the state of a sync token as difference to a complete base state instead of the complete state",
+            "type": bool}),
+        ("use_item_index", {
+            "value": "False",
+            "help": "prefilter reports and check UID conflicts with an index of time range, component and UID of the items of a collection",
+            "type": bool}),
+        ("use_binary_cache", {
+            "value": "False",
+            "help": "store item, history and sync-token caches in a compact binary format instead of pickle",
+            "type": bool}),
+        ("use_principal_locks", {
+            "value": "False",
+            "help": "lock only the principal collection accessed by a request instead of the whole storage",
+            "type": bool}),
+        ("item_memory_cache_size", {
+            "value": "0",
+            "help": "size of the in-memory cache of loaded items shared by all requests (bytes, 0: disabled)",
+            "type": positive_int}),
+        ("item_prefetch_workers", {
+            "value": "0",
+            "help": "number of threads reading item files in advance when loading many items (0: disabled)",
+            "type": positive_int}),
         ("folder_umask", {
             "value": "",
             "help": "umask for folder creation (empty: system default)",
@@ -546,6 +590,22 @@ DEFAULT_CONFIG_SCHEMA: types.CONFIG_SCHEMA = OrderedDict([
             "value": "",
             "help": "command that is run after changes to storage",
             "type": str}),
+        ("hook_async", {
+            "value": "False",
+            "help": "run the hook in the background after the storage lock is released",
+            "type": bool}),
+        ("hook_async_workers", {
+            "value": "1",
+            "help": "number of hook commands run at the same time in the background",
+            "type": positive_int}),
+        ("hook_async_queue_size", {
+            "value": "64",
+            "help": "maximum number of hook commands waiting in the background (writes block while full)",
+            "type": positive_int}),
+        ("hook_async_flush_on_shutdown", {
+            "value": "True",
+            "help": "run the waiting hook commands before shutdown",
+            "type": bool}),
         ("strict_preconditions", {
             "value": "False",
             "help": "strict preconditions check on PUT",
@@ -635,6 +695,14 @@ DEFAULT_CONFIG_SCHEMA: types.CONFIG_SCHEMA = OrderedDict([
             "value": "False",
             "help": "disable logging privacy events to the database",
             "type": bool}),
+        ("index_hashing", {
+            "value": "False",
+            "help": "keep only keyed hashes (HMAC) of identities in the in-memory identity index",
+            "type": bool}),
+        ("photo_thumbnail_size", {
+            "value": "128",
+            "help": "edge length in pixels of photo thumbnails served to the disclosure UI",
+            "type": positive_int}),
         ("default_disallow_name", {
             "value": "False",
             "help": "default value for disallowing name in privacy settings",
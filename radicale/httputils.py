@@ -28,9 +28,12 @@ import logging
 import os
 import pathlib
 import sys
+import tempfile
 import time
+import zlib
 from http import client
-from typing import List, Mapping, Union, cast
+from typing import (Callable, Iterable, Iterator, List, Mapping, Optional,
+                    Union, cast)
 
 from radicale import config, log, pathutils, types, utils
 from radicale.log import logger
@@ -105,6 +108,100 @@ MIMETYPES: Mapping[str, str] = {
     ".xml": "text/xml"}
 FALLBACK_MIMETYPE: str = "application/octet-stream"
 
+# Minimal size of the blocks of streamed responses
+STREAMING_BLOCK_SIZE: int = 64 * 1024
+
+# Maximal size of spooled responses that is kept in memory
+SPOOL_MAX_MEMORY_SIZE: int = 1024 * 1024
+
+
+class StreamingAnswer:
+    """Response content that is generated while it's sent to the client.
+
+    The unicode ``chunks`` are encoded with ``encoding`` and compressed
+    incrementally with gzip if ``compress`` is set. Both attributes are set
+    by the application.
+
+    ``close`` is called once, when the response is sent or aborted. It
+    releases the resources that are required to generate the content (e.g.
+    the lock of the storage).
+
+    """
+
+    encoding: str
+    compress: bool
+
+    def __init__(self, chunks: Iterable[str],
+                 close: Optional[Callable[[], object]] = None) -> None:
+        self._chunks = chunks
+        self._close = close
+        self.encoding = "utf-8"
+        self.compress = False
+
+    @classmethod
+    def spooled(cls, chunks: Iterable[str]) -> "StreamingAnswer":
+        """Generate the content from ``chunks`` immediately into a
+        temporary file and send it from there.
+
+        The file is kept in memory up to ``SPOOL_MAX_MEMORY_SIZE``. The
+        resources that are required to generate the content (e.g. the lock
+        of the storage) can be released before the response is sent to a
+        (possibly slow) client.
+
+        """
+        spool = tempfile.SpooledTemporaryFile(
+            max_size=SPOOL_MAX_MEMORY_SIZE, mode="w+", encoding="utf-8",
+            newline="")
+        try:
+            for chunk in chunks:
+                spool.write(chunk)
+            spool.seek(0)
+        except BaseException:
+            spool.close()
+            raise
+        return cls(iter(lambda: spool.read(STREAMING_BLOCK_SIZE), ""),
+                   spool.close)
+
+    def __iter__(self) -> Iterator[bytes]:
+        zcomp = None
+        if self.compress:
+            zcomp = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)
+        blocks: List[bytes] = []
+        size = 0
+        try:
+            for chunk in self._chunks:
+                block = chunk.encode(self.encoding)
+                if zcomp is not None:
+                    block = zcomp.compress(block)
+                blocks.append(block)
+                size += len(block)
+                if size >= STREAMING_BLOCK_SIZE:
+                    yield b"".join(blocks)
+                    blocks.clear()
+                    size = 0
+            if zcomp is not None:
+                blocks.append(zcomp.flush())
+            if blocks:
+                yield b"".join(blocks)
+        finally:
+            self.close()
+
+    def close(self) -> None:
+        """Stop the generation of the content and release the resources.
+
+        Called by the WSGI server, it's safe to call this more than once.
+
+        """
+        close, self._close = self._close, None
+        if close is None:
+            return
+        try:
+            chunks_close = getattr(self._chunks, "close", None)
+            if chunks_close is not None:
+                chunks_close()
+        finally:
+            close()
+
 
 def bad_request(additional_details: str) -> types.WSGIResponse:
     return (client.BAD_REQUEST, (("Content-Type", "text/plain"),), f"Bad Request: {additional_details}", None)
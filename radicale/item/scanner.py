@@ -0,0 +1,267 @@
+# This file is part of Radicale - CalDAV and CardDAV server
+#
+# This library is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Radicale.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Lightweight scanner for calendar items.
+
+Parsing an item with vobject is expensive. On a miss of the item cache, the
+metadata of simple events (UID, component name and time range) is extracted
+from the content lines instead.
+
+Only a single non-recurring VEVENT with dates in UTC, floating time or
+all-day is handled. The text must be in the form serialized by vobject
+(which is how Radicale stores items), so that the text and the ETag of the
+item don't change. Everything else is left to vobject (``None``).
+
+"""
+
+import math
+import re
+from datetime import date, datetime
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple, Union
+
+import vobject
+
+from radicale import item as radicale_item
+from radicale.item import filter as radicale_filter
+
+if TYPE_CHECKING:
+    from radicale import storage
+
+# Workarounds of ``read_components`` that would change the text
+_CONTROL_RE = re.compile(r"[\x00-\x08\x0B\x0C\x0E-\x1F]")
+_LINE_RE = re.compile(r'([A-Z0-9-]+)((?:;[^";:]+=(?:"[^"]*"|[^";:,]*)'
+                      r'(?:,(?:"[^"]*"|[^";:,]*))*)*):(.*)')
+_PARAM_RE = re.compile(r';([^";:]+)=((?:"[^"]*"|[^";:,]*)'
+                       r'(?:,(?:"[^"]*"|[^";:,]*))*)')
+_DATE_RE = re.compile(r"\d{8}")
+_DATE_TIME_RE = re.compile(r"\d{8}T\d{6}Z?")
+
+# Maximum length of a line in octets before it's folded by vobject
+_LINE_LENGTH = 75
+
+# Properties that are generated by vobject if they are missing
+_REQUIRED = {"VCALENDAR": ("VERSION", "PRODID"),
+             "VEVENT": ("UID", "DTSTAMP"),
+             "VALARM": ("ACTION", "TRIGGER")}
+
+# Properties that need vobject (recurrences)
+_UNSUPPORTED = ("RRULE", "RDATE", "EXDATE", "EXRULE", "RECURRENCE-ID")
+
+# Properties of VEVENT that are used by the scanner
+_SCANNED = ("UID", "DTSTART", "DTEND", "DURATION")
+
+_Component = Tuple[str, List[Tuple[str, Dict[str, str], str]], List[str]]
+
+
+def _fold(line: str) -> List[str]:
+    """Fold ``line`` like ``vobject.base.foldOneLine``."""
+    if len(line) < _LINE_LENGTH:
+        return [line]
+    parts = [""]
+    size = 0
+    for c in line:
+        c_size = len(c.encode())
+        if size + c_size > _LINE_LENGTH:
+            parts.append(" ")
+            size = 1
+        parts[-1] += c
+        size += c_size
+    return parts
+
+
+def _parse_line(line: str) -> Optional[Tuple[str, Dict[str, str], str]]:
+    """Name, parameters and value of a content line in the form serialized
+    by vobject."""
+    match = _LINE_RE.fullmatch(line)
+    if not match:
+        return None
+    name, params_text, value = match.groups()
+    params: Dict[str, str] = {}
+    for param_match in _PARAM_RE.finditer(params_text):
+        key, param_value = param_match.groups()
+        if key != key.upper() or (params and key <= list(params)[-1]):
+            # vobject sorts the parameters
+            return None
+        for part in param_value.split(","):
+            if part.startswith('"') and not any(c in part for c in ";:,"):
+                # vobject quotes only where necessary
+                return None
+        params[key] = param_value
+    return name, params, value
+
+
+def _components(text: str) -> Optional[List[_Component]]:
+    """Flat list of the components with their content lines and the names
+    of their children in order."""
+    if not text.endswith("\r\n") or _CONTROL_RE.search(text):
+        return None
+    lines = text[:-2].split("\r\n")
+    components: List[_Component] = []
+    stack: List[_Component] = []
+    folded: List[str] = []
+    for i, physical_line in enumerate(lines):
+        if "\r" in physical_line or "\n" in physical_line:
+            return None
+        folded.append(physical_line)
+        if i + 1 < len(lines) and lines[i + 1].startswith(" "):
+            continue
+        line = folded[0] + "".join(part[1:] for part in folded[1:])
+        if _fold(line) != folded:
+            return None
+        folded = []
+        parsed = _parse_line(line)
+        if parsed is None:
+            return None
+        name, params, value = parsed
+        if name in ("BEGIN", "END") and (params or value != value.upper()):
+            return None
+        if name == "BEGIN":
+            if stack:
+                stack[-1][2].append(value)
+            elif components:
+                return None
+            stack.append((value, [], []))
+            components.append(stack[-1])
+        elif not stack:
+            return None
+        elif name == "END":
+            if stack.pop()[0] != value:
+                return None
+        else:
+            stack[-1][1].append(parsed)
+            stack[-1][2].append(name)
+    if stack or not components:
+        return None
+    for component_name, _, children in components:
+        # vobject groups the children by name and sorts them
+        sort_first = [name.upper() for name in getattr(
+            vobject.base.getBehavior(component_name), "sortFirst", ())]
+        grouped = [name for i, name in enumerate(children)
+                   if i == 0 or children[i - 1] != name]
+        first = [name for name in sort_first if name in grouped]
+        if grouped != first + sorted(set(grouped).difference(first)):
+            return None
+        if not all(name in children
+                   for name in _REQUIRED.get(component_name, ())):
+            return None
+    return components
+
+
+def _parse_date(params: Dict[str, str], value: str
+                ) -> Optional[Tuple[Union[date, datetime], bool]]:
+    """Date or datetime and whether it's in UTC."""
+    if params == {"VALUE": "DATE"}:
+        if _DATE_RE.fullmatch(value):
+            return datetime.strptime(value, "%Y%m%d").date(), False
+    elif not params:
+        if _DATE_TIME_RE.fullmatch(value):
+            return (datetime.strptime(value[:15], "%Y%m%dT%H%M%S"),
+                    value.endswith("Z"))
+    # TZID, ...
+    return None
+
+
+def _scan_time_range(properties: Dict[str, Tuple[Dict[str, str], str]]
+                     ) -> Optional[Tuple[int, int]]:
+    """Time range of a non-recurring VEVENT like ``find_time_range``."""
+    if "DTSTART" not in properties:
+        return None
+    dtstart = _parse_date(*properties["DTSTART"])
+    if dtstart is None:
+        return None
+    dtstart_value, dtstart_utc = dtstart
+    start = radicale_filter.date_to_datetime(dtstart_value)
+    if "DTEND" in properties:
+        if "DURATION" in properties:
+            return None
+        dtend = _parse_date(*properties["DTEND"])
+        # Mixed values are converted with the local timezone or fail
+        if (dtend is None or dtend[1] != dtstart_utc or
+                type(dtend[0]) is not type(dtstart_value)):
+            return None
+        end = start + (dtend[0] - dtstart_value)
+    elif "DURATION" in properties:
+        params, value = properties["DURATION"]
+        if params:
+            return None
+        durations = vobject.icalendar.stringToDurations(value)
+        if len(durations) != 1:
+            return None
+        duration, = durations
+        if duration.total_seconds() > 0:
+            end = start + duration
+        else:
+            end = start + radicale_filter.SECOND
+    elif isinstance(dtstart_value, datetime):
+        end = start + radicale_filter.SECOND
+    else:
+        end = start + radicale_filter.DAY
+    return math.floor(start.timestamp()), math.ceil(end.timestamp())
+
+
+def scan_calendar_item(text: str, tag: str) -> Optional[
+        Tuple[str, str, Tuple[int, int]]]:
+    """UID, component name and time range of the item with ``text`` in a
+    collection with ``tag``, or ``None`` if it must be parsed with vobject.
+
+    """
+    if tag != "VCALENDAR" or not text.startswith("BEGIN:VCALENDAR\r\n"):
+        return None
+    components = _components(text)
+    if components is None:
+        return None
+    (_, _, calendar_children), *other_components = components
+    if calendar_children.count("VEVENT") != 1:
+        return None
+    properties: Dict[str, Tuple[Dict[str, str], str]] = {}
+    for component_name, lines, _ in other_components:
+        if component_name == "VALARM":
+            continue
+        if component_name != "VEVENT":
+            # VTIMEZONE, VTODO, ...
+            return None
+        for name, params, value in lines:
+            if name in _UNSUPPORTED:
+                return None
+            if name in _SCANNED:
+                if name in properties:
+                    return None
+                properties[name] = (params, value)
+    uid = properties["UID"][1]
+    if not uid or "\\" in uid:
+        # Empty or escaped
+        return None
+    try:
+        time_range = _scan_time_range(properties)
+    except (ValueError, OverflowError):
+        return None
+    if time_range is None:
+        return None
+    return uid, "VEVENT", time_range
+
+
+def scan_item(text: str, tag: str, collection_path: Optional[str] = None,
+              collection: Optional["storage.BaseCollection"] = None
+              ) -> Optional[radicale_item.Item]:
+    """Item with the metadata from ``scan_calendar_item`` or ``None``."""
+    scanned = scan_calendar_item(text, tag)
+    if scanned is None:
+        return None
+    uid, component_name, time_range = scanned
+    return radicale_item.Item(
+        collection_path=collection_path, collection=collection, text=text,
+        uid=uid, name="VCALENDAR", component_name=component_name,
+        time_range=time_range)
@@ -5,14 +5,19 @@ This module provides the core business logic for managing user privacy
 settings and processing vCards according to those settings.
 """
 
-import base64
+import json
 import logging
 import re
+from hashlib import sha256
 from typing import Any, Dict, List, Optional, Tuple, Union
 
 from radicale import config, storage
 from radicale.item import Item
 from radicale.privacy.database import PrivacyDatabase
+from radicale.privacy.photos import (MAX_THUMBNAIL_SIZE, MIN_THUMBNAIL_SIZE,
+                                     Photo, PhotoCache, decode_photo,
+                                     is_inline_photo, photo_id,
+                                     photo_reference)
 from radicale.privacy.reprocessor import PrivacyReprocessor
 from radicale.privacy.scanner import PrivacyScanner
 from radicale.privacy.templates import shape_cards
@@ -25,27 +30,6 @@ from radicale.utils import normalize_phone_e164
 logger = logging.getLogger(__name__)
 
 
-def _photo_to_data_uri(photo) -> str:
-    """Convert a binary (vCard 3.0 ENCODING=b) PHOTO value to a data URI.
-
-    vobject decodes base64-encoded photos to bytes; the web UI needs a
-    data URI to render them in <img src>. The image format is detected
-    from magic bytes, falling back to the TYPE parameter (default png).
-    """
-    value = photo.value
-    if value.startswith(b'\xff\xd8'):
-        mime = 'jpeg'
-    elif value.startswith(b'\x89PNG'):
-        mime = 'png'
-    elif value.startswith(b'GIF8'):
-        mime = 'gif'
-    else:
-        mime = (photo.params.get('TYPE', ['png'])[0]).lower()
-        if mime == 'jpg':
-            mime = 'jpeg'
-    return f"data:image/{mime};base64,{base64.b64encode(value).decode('ascii')}"
-
-
 class PrivacyCore:
     """Core business logic for privacy management."""
 
@@ -59,6 +43,8 @@ class PrivacyCore:
         self._privacy_db = PrivacyDatabase(configuration)
         storage_instance = storage.load(configuration)
         self._scanner = PrivacyScanner(storage_instance)
+        self._photo_cache = PhotoCache()
+        self._photo_thumbnail_size = configuration.get("privacy", "photo_thumbnail_size")
 
     def _validate_user_identifier(self, user: str) -> Tuple[bool, str]:
         """Validate user identifier format.
@@ -86,6 +72,54 @@ class PrivacyCore:
         except Exception as e:
             return False, f"Invalid identifier format. Must be a valid email or phone number in E.164 format (e.g., +1234567890): {e}"
 
+    def get_version_token(self, user: str, resource: str = "") -> Optional[str]:
+        """Get a version token for the privacy data of a user.
+
+        The token is derived from the user's settings row, the generation
+        of the identity index entries of the user and the modification times
+        of the folders of the collections holding vCards of the user, so no
+        items are loaded. It changes whenever the settings or vCards
+        containing the identity change, including changes made by other
+        processes to collections with earlier matches.
+
+        Args:
+            user: The user identifier (email or phone)
+            resource: Distinguishes representations of the data (e.g. the
+                endpoint and disclosure template)
+
+        Returns:
+            The token as quoted strong ETag, or None if the identifier is
+            invalid or the settings cannot be read
+        """
+        is_valid, _ = self._validate_user_identifier(user)
+        if not is_valid:
+            return None
+
+        if '@' in user:
+            lookup_id = user
+        else:
+            try:
+                lookup_id = normalize_phone_e164(user)
+            except Exception:
+                return None
+
+        try:
+            settings = self._privacy_db.get_user_settings(lookup_id)
+            collection_state = self._scanner.collection_state(lookup_id)
+        except Exception as e:
+            logger.warning("PRIVACY: Could not compute version token for %s: %s", lookup_id, e)
+            return None
+        if settings:
+            settings_state = json.dumps([settings.id] + [
+                getattr(settings, setting) for setting in PRIVACY_TO_VCARD_MAP.keys()])
+        else:
+            settings_state = ""
+        token = sha256()
+        for part in (resource, lookup_id, settings_state, collection_state,
+                     self._scanner.generation(lookup_id)):
+            token.update(part.encode() + b"\0")
+        return '"%s"' % token.hexdigest()
+
     def get_settings(self, user: str) -> Tuple[bool, Union[Dict[str, bool], str]]:
         """Get privacy settings for a user.
 
@@ -382,8 +416,10 @@ class PrivacyCore:
                         # Handle single value properties
                         if hasattr(vcard, prop_name):
                             value = getattr(vcard, prop_name).value
-                            if prop_name == 'photo' and isinstance(value, bytes):
-                                vcard_match["fields"][prop_name] = _photo_to_data_uri(getattr(vcard, prop_name))
+                            if prop_name == 'photo' and is_inline_photo(getattr(vcard, prop_name)):
+                                # Served lazily by get_card_photo()
+                                vcard_match["fields"][prop_name] = photo_reference(
+                                    lookup_id, match["collection_path"], match["vcard_uid"])
                             else:
                                 vcard_match["fields"][prop_name] = make_json_safe(value)
 
@@ -496,3 +532,144 @@ class PrivacyCore:
         except Exception as e:
             logger.error("PRIVACY: Error downloading cards: %s", str(e), exc_info=True)
             return False, f"Error downloading cards: {str(e)}"
+
+    def _find_card_item(self, collection_path: str, vcard_uid: str,
+                        href: Optional[str] = None) -> Optional[Item]:
+        """Load the vCard item with the given UID from a collection.
+
+        Args:
+            collection_path: Path of the collection holding the card
+            vcard_uid: UID of the card
+            href: Name of the card in the collection, if known from the
+                identity index (avoids loading all items)
+
+        Returns:
+            The item, or None if the collection or card no longer exists
+        """
+        try:
+            discover_path = "/" + collection_path.lstrip("/")
+            collection = next(iter(self._scanner._storage.discover(discover_path)), None)
+        except Exception as e:
+            logger.warning("PRIVACY: Error discovering collection: %r", e)
+            return None
+        if not collection:
+            return None
+        if href is not None:
+            for _, item in collection.get_multi([href]):
+                if item is not None and item.uid == vcard_uid:
+                    return item
+        for item in collection.get_all():
+            if (isinstance(item, Item) and
+                    (item.component_name == "VCARD" or item.name == "VCARD") and
+                    item.uid == vcard_uid):
+                return item
+        return None
+
+    def _find_photo_match(self, user: str, requested_photo_id: str) -> Tuple[bool, Union[Optional[Dict[str, Any]], str]]:
+        """Find the identity index entry of the card with a photo identifier.
+
+        Args:
+            user: The user identifier (email or phone)
+            requested_photo_id: Photo identifier as referenced by
+                get_matching_cards()
+
+        Returns:
+            Tuple of (success, result)
+            If success is True, result contains the index entry or None if
+            no card containing the user's identity has this identifier
+            If success is False, result contains the error message
+        """
+        is_valid, error_msg = self._validate_user_identifier(user)
+        if not is_valid:
+            return False, error_msg
+
+        if '@' in user:
+            lookup_id = user
+        else:
+            try:
+                lookup_id = normalize_phone_e164(user)
+            except Exception as e:
+                return False, str(e)
+
+        for match in self._scanner.find_identity_occurrences(lookup_id):
+            if photo_id(match["collection_path"], match["vcard_uid"]) == requested_photo_id:
+                return True, match
+        return True, None
+
+    def _thumbnail_size(self, size: Optional[int]) -> int:
+        if size is None:
+            size = self._photo_thumbnail_size
+        return max(MIN_THUMBNAIL_SIZE, min(MAX_THUMBNAIL_SIZE, size))
+
+    def get_card_photo_etag(self, user: str, requested_photo_id: str,
+                            size: Optional[int] = None) -> Optional[str]:
+        """Get the ETag of the thumbnail of a card photo without loading it.
+
+        The ETag is derived from the etag of the card in the identity index,
+        so revalidations are answered without touching the collection.
+
+        Args:
+            user: The user identifier (email or phone)
+            requested_photo_id: Photo identifier as referenced by
+                get_matching_cards()
+            size: Optional thumbnail edge length in pixels
+
+        Returns:
+            The ETag, or None if it is not known
+        """
+        try:
+            success, match = self._find_photo_match(user, requested_photo_id)
+        except Exception as e:
+            logger.warning("PRIVACY: Could not compute photo ETag: %s", e)
+            return None
+        if not success or not isinstance(match, dict) or not match.get("etag"):
+            return None
+        return PhotoCache.etag(match["etag"], requested_photo_id, self._thumbnail_size(size))
+
+    def get_card_photo(self, user: str, requested_photo_id: str,
+                       size: Optional[int] = None) -> Tuple[bool, Union[Optional[Photo], str]]:
+        """Get the thumbnail of the photo of a card matching a user's identity.
+
+        Only photos of cards that contain the user's identity can be
+        retrieved. Thumbnails are cached by card etag, so the image is only
+        decoded and resized again after the card changed.
+
+        Args:
+            user: The user identifier (email or phone)
+            requested_photo_id: Photo identifier as referenced by
+                get_matching_cards()
+            size: Optional thumbnail edge length in pixels (defaults to
+                [privacy] photo_thumbnail_size)
+
+        Returns:
+            Tuple of (success, result)
+            If success is True, result contains the photo or None if there
+            is no such photo
+            If success is False, result contains the error message
+        """
+        size = self._thumbnail_size(size)
+
+        try:
+            success, match = self._find_photo_match(user, requested_photo_id)
+            if isinstance(match, str):
+                return False, match
+            if match is None:
+                return True, None
+            item = self._find_card_item(match["collection_path"], match["vcard_uid"], match.get("href"))
+            if item is None:
+                return True, None
+            photo = self._photo_cache.get(item.etag, requested_photo_id, size)
+            if photo is not None:
+                return True, photo
+            vcard = item.vobject_item
+            if not hasattr(vcard, "photo"):
+                return True, None
+            decoded = decode_photo(vcard.photo)
+            if decoded is None:
+                return True, None
+            data, content_type = decoded
+            return True, self._photo_cache.get_or_create(
+                item.etag, requested_photo_id, size, data, content_type)
+        except Exception as e:
+            logger.error("PRIVACY: Error getting card photo: %s", str(e), exc_info=True)
+            return False, f"Error getting card photo: {str(e)}"
@@ -7,7 +7,7 @@ This module provides the database interface for storing and retrieving privacy s
 import json
 import os
 from datetime import datetime, timezone
-from typing import Any, Dict, Optional
+from typing import Any, Dict, Iterable, Optional
 
 from sqlalchemy import (Boolean, Column, DateTime, Integer, String, Text,
                         create_engine)
@@ -16,6 +16,10 @@ from sqlalchemy.pool import NullPool
 
 from radicale import config
 
+# Maximum number of identifiers per query of get_user_settings_bulk()
+# (SQLite limits the number of bound parameters)
+BULK_QUERY_SIZE = 500
+
 
 class Base(DeclarativeBase):
     pass
@@ -94,6 +98,26 @@ class PrivacyDatabase:
         finally:
             session.close()
 
+    def get_user_settings_bulk(self, identifiers: Iterable[str]) -> Dict[str, UserSettings]:
+        """Retrieve the settings of many identifiers at once.
+
+        Returns:
+            Dictionary mapping identifiers to their settings (identifiers
+            without settings are omitted)
+        """
+        identifiers = list(identifiers)
+        session = self.Session()
+        try:
+            result: Dict[str, UserSettings] = {}
+            for i in range(0, len(identifiers), BULK_QUERY_SIZE):
+                chunk = identifiers[i:i + BULK_QUERY_SIZE]
+                for settings in session.query(UserSettings).filter(
+                        UserSettings.identifier.in_(chunk)):
+                    result[settings.identifier] = settings
+            return result
+        finally:
+            session.close()
+
     def create_user_settings(self, identifier: str, settings: Dict[str, bool]) -> UserSettings:
         """Create new user settings."""
         session = self.Session()
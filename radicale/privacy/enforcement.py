@@ -4,7 +4,7 @@ This module handles the enforcement of privacy settings on vCard items.
 """
 
 import logging
-from typing import Dict, List, Tuple
+from typing import Any, Dict, Iterable, List, Sequence, Set, Tuple
 
 import radicale.item as radicale_item
 from radicale.privacy.database import PrivacyDatabase
@@ -76,14 +76,62 @@ class PrivacyEnforcement:
         """Check if a property name is a valid vCard property."""
         return property_name.lower() in VCARD_NAME_TO_ENUM
 
+    @staticmethod
+    def _is_vcard(item: radicale_item.Item) -> bool:
+        return item.component_name == "VCARD" or item.name == "VCARD"
+
+    def _disallowed_properties(self, settings_list: Sequence[Any]) -> Set[str]:
+        """Get the (lowercase) vCard properties disallowed by the settings.
+
+        The most restrictive settings are applied when multiple settings
+        match.
+        """
+        properties_to_remove: Set[str] = set()
+        for privacy_property, vcard_properties in PRIVACY_TO_VCARD_MAP.items():
+            if any(getattr(settings, privacy_property, False) for settings in settings_list):
+                logger.debug("PRIVACY: Privacy property %s is enabled, will remove properties: %s",
+                             privacy_property, vcard_properties)
+                properties_to_remove.update(prop.lower() for prop in vcard_properties)
+        return properties_to_remove
+
+    def _remove_properties(self, item: radicale_item.Item, properties_to_remove: Set[str]) -> bool:
+        """Remove disallowed properties from the vCard of an item.
+
+        Returns:
+            Whether the vCard was modified
+        """
+        vcard = item.vobject_item
+        modified = False
+        for property_name in list(vcard.contents.keys()):
+            # Skip if property is public
+            if property_name.lower() in PUBLIC_VCARD_PROPERTIES:
+                continue
+
+            # Skip if not a valid vCard property
+            if not self._is_valid_vcard_property(property_name.lower()):
+                logger.debug("PRIVACY: Skipping unhandled property: %s", property_name)
+                continue
+
+            # Remove if property is in the disallowed list (case-insensitive comparison)
+            if property_name.lower() in properties_to_remove:
+                logger.debug("PRIVACY: Removing disallowed property: %s", property_name)
+                del vcard.contents[property_name]
+                modified = True
+
+        if modified:
+            # Invalidate the item's text cache since we modified the vCard
+            item._text = None
+        return modified
+
     def enforce_privacy(self, item: radicale_item.Item) -> radicale_item.Item:
         """Enforce privacy settings on a vCard item by filtering disallowed properties."""
-        if not item.component_name == "VCARD" and not item.name == "VCARD":
+        if not self._is_vcard(item):
             logger.debug("PRIVACY: Not a VCF file")
             return item
 
         logger.info("PRIVACY: Intercepted vCard for privacy enforcement")
-        logger.debug("PRIVACY: vCard content:\n%s", item.serialize())
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("PRIVACY: vCard content:\n%s", item.serialize())
 
         # Get identifiers from vCard
         identifiers = self._extract_identifiers(item.vobject_item)
@@ -95,7 +143,7 @@ class PrivacyEnforcement:
         self._ensure_db_connection()
 
         # Get privacy settings for each identifier
-        privacy_settings = None
+        settings_list = []
         for id_type, id_value in identifiers:
             settings = self._privacy_db.get_user_settings(id_value)
             if settings:
@@ -105,54 +153,60 @@ class PrivacyEnforcement:
                     for property in PRIVACY_TO_VCARD_MAP.keys()
                 }
                 logger.info("PRIVACY: Found privacy settings for %s %r: %s", id_type, id_value, settings_dict)
-                if privacy_settings is None:
-                    privacy_settings = settings
-                else:
-                    # Apply most restrictive settings when multiple matches found
-                    for property in PRIVACY_TO_VCARD_MAP.keys():
-                        current_value = getattr(privacy_settings, property)
-                        new_value = getattr(settings, property)
-                        setattr(privacy_settings, property, current_value or new_value)
-
-        if not privacy_settings:
+                settings_list.append(settings)
+
+        if not settings_list:
             logger.debug("PRIVACY: No privacy settings found for any identifier")
             return item
 
         # Process the vCard
         logger.info("PRIVACY: Processing vCard for privacy enforcement")
-        vcard = item.vobject_item
-
-        # Get all properties to remove based on privacy settings
-        properties_to_remove: set[str] = set()
-        for privacy_property, vcard_properties in PRIVACY_TO_VCARD_MAP.items():
-            logger.debug("PRIVACY: Checking privacy property %s with value %s", privacy_property, getattr(privacy_settings, privacy_property, None))
-            if getattr(privacy_settings, privacy_property, False):
-                logger.debug("PRIVACY: Privacy property %s is enabled, will remove properties: %s", privacy_property, vcard_properties)
-                properties_to_remove.update(prop.lower() for prop in vcard_properties)
-
-        logger.debug("PRIVACY: Properties to remove: %s", properties_to_remove)
-        logger.debug("PRIVACY: Current vCard properties: %s", list(vcard.contents.keys()))
-
-        # Remove disallowed properties
-        for property_name in list(vcard.contents.keys()):
-            # Skip if property is public
-            if property_name.lower() in PUBLIC_VCARD_PROPERTIES:
-                logger.debug("PRIVACY: Skipping public property: %s", property_name)
-                continue
+        self._remove_properties(item, self._disallowed_properties(settings_list))
+        return item
 
-            # Skip if not a valid vCard property
-            if not self._is_valid_vcard_property(property_name.lower()):
-                logger.debug("PRIVACY: Skipping unhandled property: %s", property_name)
+    def enforce_privacy_bulk(self, items: Iterable[radicale_item.Item]) -> List[radicale_item.Item]:
+        """Enforce privacy settings on many items at once (e.g. a whole collection).
+
+        Equivalent to calling enforce_privacy() on each item, but the
+        settings of all identifiers are resolved with a single pass over the
+        database, items are not logged individually and only modified items
+        have to be serialized again.
+
+        Args:
+            items: The items to process (non-vCard items are passed through)
+
+        Returns:
+            The list of items, in the same order
+        """
+        items = list(items)
+        item_identifiers: List[List[str]] = []
+        all_identifiers: Set[str] = set()
+        for item in items:
+            if not self._is_vcard(item):
+                item_identifiers.append([])
                 continue
+            identifiers = [id_value for _, id_value in self._extract_identifiers(item.vobject_item)]
+            item_identifiers.append(identifiers)
+            all_identifiers.update(identifiers)
 
-            # Remove if property is in the disallowed list (case-insensitive comparison)
-            if property_name.lower() in properties_to_remove:
-                logger.debug("PRIVACY: Removing disallowed property: %s", property_name)
-                del vcard.contents[property_name]
+        if not all_identifiers:
+            logger.debug("PRIVACY: No email or phone found in %d items", len(items))
+            return items
 
-        # Invalidate the item's text cache since we modified the vCard
-        item._text = None
-        return item
+        # Ensure database connection is established
+        self._ensure_db_connection()
+        settings_by_identifier = self._privacy_db.get_user_settings_bulk(all_identifiers)
+
+        modified = 0
+        for item, identifiers in zip(items, item_identifiers):
+            settings_list = [settings_by_identifier[id_value] for id_value in identifiers
+                             if id_value in settings_by_identifier]
+            if settings_list and self._remove_properties(
+                    item, self._disallowed_properties(settings_list)):
+                modified += 1
+        logger.info("PRIVACY: Enforced privacy settings of %d identities on %d items, "
+                    "%d modified", len(settings_by_identifier), len(items), modified)
+        return items
 
     def close(self):
         """Close the privacy database connection."""
@@ -9,7 +9,7 @@ import json
 import logging
 import os
 from http import client
-from typing import Any, Dict, List, Union
+from typing import Any, Dict, List, Optional, Union
 
 from werkzeug.exceptions import MethodNotAllowed, NotFound
 from werkzeug.routing import Map, Rule
@@ -45,6 +45,7 @@ class PrivacyHTTP:
             Rule('/privacy/settings/<user>', endpoint='get_settings', methods=['GET']),
             Rule('/privacy/cards/<user>', endpoint='get_cards', methods=['GET']),
             Rule('/privacy/cards/<user>/download', endpoint='download_cards', methods=['GET']),
+            Rule('/privacy/cards/<user>/photo/<photo_id>', endpoint='get_card_photo', methods=['GET']),
             Rule('/privacy/settings/<user>', endpoint='create_settings', methods=['POST']),
             Rule('/privacy/cards/<user>/reprocess', endpoint='reprocess_cards', methods=['POST']),
             Rule('/privacy/settings/<user>', endpoint='update_settings', methods=['PUT']),
@@ -56,6 +57,7 @@ class PrivacyHTTP:
             "get_settings": self._handle_get_settings,
             "get_cards": self._handle_get_cards,
             "download_cards": self._handle_download_cards,
+            "get_card_photo": self._handle_get_card_photo,
             "create_settings": self._handle_create_settings,
             "update_settings": self._handle_update_settings,
             "delete_settings": self._handle_delete_settings,
@@ -189,16 +191,58 @@ class PrivacyHTTP:
             return client.BAD_REQUEST, headers, json.dumps({"error": result}).encode(), None
         return client.OK, headers, json.dumps(result).encode(), None
 
+    def _is_not_modified(self, environ: types.WSGIEnviron, etag: str) -> bool:
+        """Check whether the client's If-None-Match header matches ``etag``.
+
+        Args:
+            environ: WSGI environment
+            etag: The current strong ETag (quoted) of the resource
+
+        Returns:
+            True if the client already has the current representation
+        """
+        if_none_match = environ.get("HTTP_IF_NONE_MATCH", "")
+        if not if_none_match:
+            return False
+        if if_none_match.strip() == "*":
+            return True
+        return etag in (tag.strip() for tag in if_none_match.split(","))
+
+    def _with_etag(self, response: types.WSGIResponse,
+                   etag: Optional[str]) -> types.WSGIResponse:
+        """Add the version token to a successful response.
+
+        The token is computed before the response, so a client never stores
+        a token that is newer than its data. Changes made while the response
+        is computed (e.g. by auto-creating settings or a concurrent write)
+        only cause one more full response.
+
+        Args:
+            response: The WSGI response tuple
+            etag: The version token computed before the response
+
+        Returns:
+            The WSGI response tuple, with an ETag header if applicable
+        """
+        status, headers, body, xml_request = response
+        if status != client.OK or not etag:
+            return response
+        return status, {**dict(headers), "ETag": etag}, body, xml_request
+
     # Route handler methods
     def _handle_get_settings(
         self, environ: types.WSGIEnviron, url_params: Dict[str, str]
     ) -> types.WSGIResponse:
         """Handle GET /privacy/settings/<user>"""
         user_identifier = url_params["user"]
+        etag = self._privacy_core.get_version_token(user_identifier, "settings")
+        if etag and self._is_not_modified(environ, etag):
+            logger.info("GET settings for user: %s (not modified)", user_identifier)
+            return client.NOT_MODIFIED, {"ETag": etag}, None, None
         logger.info("GET settings for user: %s", user_identifier)
 
         success, result = self._privacy_core.get_settings(user_identifier)
-        return self._to_wsgi_response(success, result)
+        return self._with_etag(self._to_wsgi_response(success, result), etag)
 
     def _handle_get_cards(
         self, environ: types.WSGIEnviron, url_params: Dict[str, str]
@@ -215,10 +259,15 @@ class PrivacyHTTP:
                     json.dumps({"error": f"Invalid template: {template}"}).encode(),
                     None,
                 )
+        resource = "cards/%s" % (template or "")
+        etag = self._privacy_core.get_version_token(user_identifier, resource)
+        if etag and self._is_not_modified(environ, etag):
+            logger.info("GET cards for user: %s (template: %s, not modified)", user_identifier, template or "full")
+            return client.NOT_MODIFIED, {"ETag": etag}, None, None
         logger.info("GET cards for user: %s (template: %s)", user_identifier, template or "full")
 
         success, result = self._privacy_core.get_matching_cards(user_identifier, template)
-        return self._to_wsgi_response(success, result)
+        return self._with_etag(self._to_wsgi_response(success, result), etag)
 
     def _handle_download_cards(
         self, environ: types.WSGIEnviron, url_params: Dict[str, str]
@@ -242,6 +291,53 @@ class PrivacyHTTP:
                 )
         return self._to_wsgi_response(success, result)
 
+    def _handle_get_card_photo(
+        self, environ: types.WSGIEnviron, url_params: Dict[str, str]
+    ) -> types.WSGIResponse:
+        """Handle GET /privacy/cards/<user>/photo/<photo_id>"""
+        user_identifier = url_params["user"]
+        size_arg = Request(dict(environ)).args.get("size")
+        size = None
+        if size_arg is not None:
+            try:
+                size = int(size_arg)
+            except ValueError:
+                return (
+                    client.BAD_REQUEST,
+                    {"Content-Type": "application/json"},
+                    json.dumps({"error": f"Invalid size: {size_arg}"}).encode(),
+                    None,
+                )
+        # The photo URL stays the same when the card changes, so clients
+        # must revalidate; unchanged photos are answered with 304, without
+        # loading the card if its etag is known from the identity index.
+        etag = self._privacy_core.get_card_photo_etag(
+            user_identifier, url_params["photo_id"], size)
+        if etag and self._is_not_modified(environ, etag):
+            logger.info("GET photo %s for user: %s (not modified)", url_params["photo_id"], user_identifier)
+            return client.NOT_MODIFIED, {"ETag": etag, "Cache-Control": "private, no-cache"}, None, None
+        logger.info("GET photo %s for user: %s", url_params["photo_id"], user_identifier)
+
+        success, result = self._privacy_core.get_card_photo(
+            user_identifier, url_params["photo_id"], size)
+        if isinstance(result, str):
+            return self._to_wsgi_response(False, result)
+        if result is None:
+            return (
+                client.NOT_FOUND,
+                {"Content-Type": "application/json"},
+                json.dumps({"error": "Photo not found"}).encode(),
+                None,
+            )
+        headers = {"ETag": result.etag, "Cache-Control": "private, no-cache",
+                   # The photo must never be interpreted as a document
+                   "X-Content-Type-Options": "nosniff",
+                   "Content-Security-Policy": "default-src 'none'"}
+        if self._is_not_modified(environ, result.etag):
+            return client.NOT_MODIFIED, headers, None, None
+        headers["Content-Type"] = result.content_type
+        return client.OK, headers, result.data, None
+
     def _handle_create_settings(
         self, environ: types.WSGIEnviron, url_params: Dict[str, str]
     ) -> types.WSGIResponse:
@@ -0,0 +1,179 @@
+"""Photo references and thumbnails for the privacy disclosure UI.
+
+Inlining every PHOTO of every matching card as a full-size data URI makes
+photos dominate the size of the card listing. Instead, the listing carries a
+short reference (see photo_reference()) and the image is served separately by
+GET /privacy/cards/<user>/photo/<id>, resized to a thumbnail and cached by the
+etag of the card it was taken from.
+
+Resizing requires Pillow (installed with the ``thumbnails`` extra). Without it
+the original image is served unchanged.
+
+The served content type is detected from the image data, the type claimed by
+the card is ignored. Only formats that can't carry scripts are served as
+images, anything else (e.g. SVG) as application/octet-stream.
+"""
+
+import base64
+import binascii
+import io
+import logging
+import threading
+from collections import OrderedDict
+from hashlib import sha256
+from typing import NamedTuple, Optional, Tuple
+from urllib.parse import quote
+
+logger = logging.getLogger(__name__)
+
+# Thumbnail edge lengths accepted from clients (pixels)
+MIN_THUMBNAIL_SIZE = 16
+MAX_THUMBNAIL_SIZE = 1024
+
+# Default number of thumbnails kept in memory
+DEFAULT_CACHE_ENTRIES = 256
+
+# Content type of photos that are not in one of the allowed image formats
+UNKNOWN_CONTENT_TYPE = "application/octet-stream"
+
+# Whether the missing Pillow package was reported
+_pillow_missing_logged = False
+
+
+class Photo(NamedTuple):
+    """A (possibly resized) image ready to be served."""
+    data: bytes
+    content_type: str
+    etag: str
+
+
+def photo_id(collection_path: str, vcard_uid: str) -> str:
+    """Return the stable identifier of the photo of a card.
+
+    The identifier does not disclose the collection path, which is only part
+    of the detail template F.
+    """
+    return sha256(("%s/%s" % (collection_path.strip("/"), vcard_uid)).encode()).hexdigest()[:32]
+
+
+def photo_reference(user: str, collection_path: str, vcard_uid: str) -> str:
+    """Return the URL path under which the photo of a card is served."""
+    return "/privacy/cards/%s/photo/%s" % (
+        quote(user, safe="@+"), photo_id(collection_path, vcard_uid))
+
+
+def _detect_mime(data: bytes) -> str:
+    """Detect the image format from magic bytes.
+
+    Returns UNKNOWN_CONTENT_TYPE unless the data is a JPEG, PNG, GIF or WebP
+    image.
+    """
+    if data.startswith(b'\xff\xd8\xff'):
+        return "image/jpeg"
+    if data.startswith(b'\x89PNG\r\n\x1a\n'):
+        return "image/png"
+    if data.startswith((b'GIF87a', b'GIF89a')):
+        return "image/gif"
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return "image/webp"
+    return UNKNOWN_CONTENT_TYPE
+
+
+def decode_photo(photo) -> Optional[Tuple[bytes, str]]:
+    """Extract the image bytes and MIME type from a vobject PHOTO property.
+
+    Handles vCard 3.0 ENCODING=b photos (decoded to bytes by vobject) and
+    vCard 4.0 data URIs. Returns None for external references (e.g. http
+    URLs) and undecodable values. The MIME type is detected from the data
+    (see _detect_mime()), the TYPE parameter and the type of data URIs are
+    not trusted.
+    """
+    value = photo.value
+    if isinstance(value, bytes):
+        return value, _detect_mime(value)
+    if not isinstance(value, str) or not value.startswith("data:"):
+        return None
+    header, _, payload = value.partition(",")
+    if not header.endswith(";base64"):
+        return None
+    try:
+        data = base64.b64decode(payload, validate=False)
+    except (binascii.Error, ValueError):
+        return None
+    return data, _detect_mime(data)
+
+
+def is_inline_photo(photo) -> bool:
+    """Whether the PHOTO property carries the image data itself."""
+    value = photo.value
+    return isinstance(value, bytes) or (isinstance(value, str) and value.startswith("data:"))
+
+
+def make_thumbnail(data: bytes, content_type: str, size: int) -> Tuple[bytes, str]:
+    """Scale an image down to fit into ``size`` x ``size`` pixels.
+
+    Returns the original image if Pillow is not installed, the image is
+    already small enough or cannot be decoded.
+    """
+    global _pillow_missing_logged
+    try:
+        from PIL import Image
+    except ImportError:
+        if not _pillow_missing_logged:
+            _pillow_missing_logged = True
+            logger.warning("PRIVACY: Pillow is not installed, photos are served "
+                           "without resizing (install Radicale[thumbnails])")
+        return data, content_type
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            if image.width <= size and image.height <= size:
+                return data, content_type
+            image.thumbnail((size, size))
+            out = io.BytesIO()
+            if image.mode in ("RGBA", "LA", "P"):
+                image.save(out, format="PNG", optimize=True)
+                return out.getvalue(), "image/png"
+            image.convert("RGB").save(out, format="JPEG", quality=85)
+            return out.getvalue(), "image/jpeg"
+    except Exception as e:
+        logger.debug("PRIVACY: Could not create thumbnail, serving original: %s", e)
+        return data, content_type
+
+
+class PhotoCache:
+    """Bounded LRU cache of thumbnails keyed by card etag and size."""
+
+    def __init__(self, max_entries: int = DEFAULT_CACHE_ENTRIES) -> None:
+        self._max_entries = max_entries
+        self._entries: "OrderedDict[Tuple[str, str, int], Photo]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def etag(card_etag: str, photo_id: str, size: int) -> str:
+        """Strong ETag of a thumbnail, derived without decoding the image."""
+        return '"%s"' % sha256(("%s/%s/%d" % (card_etag, photo_id, size)).encode()).hexdigest()
+
+    def get(self, card_etag: str, photo_id: str, size: int) -> Optional[Photo]:
+        key = (card_etag, photo_id, size)
+        with self._lock:
+            photo = self._entries.get(key)
+            if photo is not None:
+                self._entries.move_to_end(key)
+            return photo
+
+    def get_or_create(self, card_etag: str, photo_id: str, size: int,
+                      data: bytes, content_type: str) -> Photo:
+        photo = self.get(card_etag, photo_id, size)
+        if photo is not None:
+            return photo
+        thumbnail, thumbnail_type = make_thumbnail(data, content_type, size)
+        photo = Photo(thumbnail, thumbnail_type, self.etag(card_etag, photo_id, size))
+        with self._lock:
+            self._entries[(card_etag, photo_id, size)] = photo
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+        return photo
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
@@ -37,13 +37,13 @@ class PrivacyReprocessor:
         Returns:
             List of vCard UIDs that were successfully reprocessed
         """
-        logger.info("PRIVACY: Starting vCard reprocessing for identity: %r", identity)
+        logger.info("PRIVACY: Starting vCard reprocessing for identity: %r", self._scanner._log_identity(identity))
         reprocessed_cards = []
 
         try:
             # Find all vCards containing this identity
             matches = self._scanner.find_identity_occurrences(identity)
-            logger.info("PRIVACY: Found %d vCards containing identity %r", len(matches), identity)
+            logger.info("PRIVACY: Found %d vCards containing identity %r", len(matches), self._scanner._log_identity(identity))
 
             # Log to database for statistics
             try:
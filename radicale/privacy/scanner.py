@@ -4,22 +4,32 @@ This module provides functionality to scan vCards across all collections
 to find occurrences of specific identities (email/phone).
 """
 
+import binascii
+import hashlib
+import hmac
 import logging
-from typing import Any, Dict, List, Optional, Tuple
+import os
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple, Union, cast
 
 import vobject
 
+from radicale import config, pathutils, storage
 from radicale.item import Item
-from radicale.storage.multifilesystem.get import CollectionPartGet
+from radicale.storage import events, multifilesystem
 from radicale.utils import normalize_phone_e164
 
 logger = logging.getLogger(__name__)
 
+# Size in bytes of the (truncated) HMAC-SHA256 keys of the hashed index
+INDEX_KEY_SIZE = 16
+
+IndexKey = Union[str, bytes]
+
 
 class PrivacyScanner:
     """Scanner for finding identity occurrences in vCards."""
 
-    _instance = None
+    _instance: Optional["PrivacyScanner"] = None
     _initialized = False
 
     def __new__(cls, storage=None):
@@ -32,9 +42,23 @@ class PrivacyScanner:
     def __init__(self, storage=None):
         """Initialize the scanner if not already initialized."""
         if not self._initialized:
-            self._index = {}  # Maps identity to list of matches
+            self._index: Dict[IndexKey, List[Dict[str, Any]]] = {}  # Maps identity key to list of matches
             self._index_initialized = False
+            # With index_hashing, the index only holds keyed hashes of the
+            # identities. The key is random, as the index is not persisted.
+            configuration = getattr(storage, "configuration", None)
+            self._hash_key: Optional[bytes] = None
+            if (isinstance(configuration, config.Configuration) and
+                    configuration.get("privacy", "index_hashing")):
+                self._hash_key = os.urandom(32)
+            # Generations identify versions of the index (see generation()).
+            # The epoch makes them unique across restarts of the process.
+            self._epoch = binascii.hexlify(os.urandom(8)).decode("ascii")
+            self._generation = 0
+            self._identity_generations: Dict[IndexKey, int] = {}
             self._initialized = True
+            if storage is not None:
+                self.subscribe(storage)
             logger.info("Privacy scanner initialized")
 
     @property
@@ -58,7 +82,7 @@ class PrivacyScanner:
             for email_prop in vcard.email_list:
                 if email_prop.value:
                     identifiers.append(("email", email_prop.value))
-                    logger.debug("PRIVACY: Found id (email) in vCard: %r", email_prop.value)
+                    logger.debug("PRIVACY: Found id (email) in vCard: %r", self._log_identity(email_prop.value))
 
         # Extract phones
         if hasattr(vcard, "tel_list"):
@@ -72,10 +96,35 @@ class PrivacyScanner:
                         # all phone numbers present in the vCard are captured, even if not valid E.164.
                         # This preserves visibility of malformed or non-normalizable numbers for diagnostics.
                         identifiers.append(("phone", tel_prop.value))
-                    logger.debug("PRIVACY: Found id (phone) in vCard: %r", tel_prop.value)
+                    logger.debug("PRIVACY: Found id (phone) in vCard: %r", self._log_identity(tel_prop.value))
 
         return identifiers
 
+    def _index_key(self, identity: str) -> IndexKey:
+        """Get the key of an identity in the index.
+
+        Phone numbers are normalized to E.164 if possible. With
+        index_hashing, the key is a fixed-width HMAC of the identity.
+        """
+        if "@" not in identity:
+            try:
+                identity = normalize_phone_e164(identity)
+            except Exception:
+                pass
+        if self._hash_key is None:
+            return identity
+        return hmac.new(self._hash_key, identity.encode("utf-8"),
+                        hashlib.sha256).digest()[:INDEX_KEY_SIZE]
+
+    def _log_identity(self, identity: str) -> str:
+        """Representation of an identity for the log.
+
+        With index_hashing, identities are not logged, only their keys.
+        """
+        if self._hash_key is None:
+            return identity
+        return cast(bytes, self._index_key(identity)).hex()
+
     def _build_index(self) -> None:
         """Build an index of all identities across all collections."""
         if self._index_initialized:
@@ -86,7 +135,7 @@ class PrivacyScanner:
             # Get all collections
             collections = self._storage.discover("/")
             for collection in collections:
-                if not isinstance(collection, CollectionPartGet):
+                if not isinstance(collection, storage.BaseCollection):
                     continue
 
                 # Scan each collection
@@ -95,9 +144,10 @@ class PrivacyScanner:
                     for field in match["matching_fields"]:
                         identity = match.get(field)
                         if identity:
-                            if identity not in self._index:
-                                self._index[identity] = []
-                            self._index[identity].append(match)
+                            if self._hash_key is not None:
+                                # Do not keep the identity in clear text
+                                match = {key: value for key, value in match.items() if key != field}
+                            self._index.setdefault(self._index_key(identity), []).append(match)
 
             self._index_initialized = True
             logger.info("PRIVACY: Identity index built successfully")
@@ -105,7 +155,7 @@ class PrivacyScanner:
             logger.error("PRIVACY: Error building identity index: %s", e)
             raise
 
-    def _scan_collection(self, collection: CollectionPartGet, identity: Optional[str] = None) -> List[Dict[str, Any]]:
+    def _scan_collection(self, collection: storage.BaseCollection, identity: Optional[str] = None) -> List[Dict[str, Any]]:
         """Scan a single collection for identity occurrences.
 
         Args:
@@ -120,6 +170,9 @@ class PrivacyScanner:
         logger.info("PRIVACY: Scanning collection %r for user %r", collection.path, user_id)
 
         try:
+            # The stamp is read before the items, so that concurrent changes
+            # are detected by collection_state()
+            collection_stamp = self._collection_stamp(collection.path)
             # Get all items in the collection
             items = list(collection.get_all())
             logger.debug("PRIVACY: Found %d items in collection %r", len(items), collection.path)
@@ -135,7 +188,9 @@ class PrivacyScanner:
                 logger.info("PRIVACY: Processing vCard in %r", collection.path)
                 # Extract identifiers from the vCard
                 identifiers = self._extract_identifiers(item.vobject_item)
-                logger.debug("PRIVACY: Found identifiers: %r", identifiers)
+                logger.debug("PRIVACY: Found identifiers: %r", [
+                    (id_type, self._log_identity(id_value))
+                    for id_type, id_value in identifiers])
                 matching_fields: List[str] = []
 
                 # Check each identifier against the search identity
@@ -155,7 +210,10 @@ class PrivacyScanner:
                         'user_id': user_id,
                         'vcard_uid': item.vobject_item.uid.value if hasattr(item.vobject_item, 'uid') else None,
                         'matching_fields': matching_fields,
-                        'collection_path': collection.path
+                        'collection_path': collection.path,
+                        'href': item.href,
+                        'etag': item.etag,
+                        'collection_stamp': collection_stamp
                     })
                     logger.debug("PRIVACY: Found match in collection %r: %r", collection.path, matching_fields)
                 elif identity is None and matching_fields:
@@ -165,6 +223,9 @@ class PrivacyScanner:
                             'vcard_uid': item.vobject_item.uid.value if hasattr(item.vobject_item, 'uid') else None,
                             'matching_fields': [id_type],
                             'collection_path': collection.path,
+                            'href': item.href,
+                            'etag': item.etag,
+                            'collection_stamp': collection_stamp,
                             id_type: id_value
                         })
 
@@ -186,10 +247,13 @@ class PrivacyScanner:
                 'user_id': str,    # The user who owns the collection
                 'vcard_uid': str,  # The UID of the matching vCard
                 'matching_fields': List[str],  # Which fields matched (email/phone)
-                'collection_path': str  # Path to the collection
+                'collection_path': str,  # Path to the collection
+                'href': str,  # Name of the vCard in the collection
+                'etag': str,  # ETag of the vCard when it was scanned
+                'collection_stamp': str  # See _collection_stamp(), when it was scanned
             }
         """
-        logger.info("PRIVACY: Starting scan for identity: %r", identity)
+        logger.info("PRIVACY: Starting scan for identity: %r", self._log_identity(identity))
 
         # Build index if not initialized
         if not self._index_initialized:
@@ -197,9 +261,10 @@ class PrivacyScanner:
             self._build_index()
 
         # Try to use the index first
-        if identity in self._index:
+        index_key = self._index_key(identity)
+        if index_key in self._index:
             logger.debug("PRIVACY: Found identity in index")
-            return self._index[identity]
+            return self._index[index_key]
 
         # If not in index, do a full scan
         logger.debug("PRIVACY: Identity not found in index, performing full scan")
@@ -226,8 +291,8 @@ class PrivacyScanner:
             logger.debug("PRIVACY: Found root collections: %r", root_paths)
 
             for collection in root_collections:
-                if not isinstance(collection, CollectionPartGet):
-                    logger.debug("PRIVACY: Skipping non-CollectionPartGet: %r", collection)
+                if not isinstance(collection, storage.BaseCollection):
+                    logger.debug("PRIVACY: Skipping non-collection: %r", collection)
                     continue
 
                 # Get collection path from path attribute
@@ -274,8 +339,8 @@ class PrivacyScanner:
                 logger.debug("PRIVACY: Found sub-collections: %r", sub_paths)
 
                 for sub_collection in sub_collections:
-                    if not isinstance(sub_collection, CollectionPartGet):
-                        logger.debug("PRIVACY: Skipping non-CollectionPartGet sub-collection: %r", sub_collection)
+                    if not isinstance(sub_collection, storage.BaseCollection):
+                        logger.debug("PRIVACY: Skipping non-collection sub-collection: %r", sub_collection)
                         continue
 
                     # Get sub-collection path from href or path attribute
@@ -297,7 +362,7 @@ class PrivacyScanner:
             # Update the index with the new matches
             if all_matches:
                 logger.debug("PRIVACY: Updating index with %d new matches", len(all_matches))
-                self._index[identity] = all_matches
+                self._index[index_key] = all_matches
 
         except Exception as e:
             logger.error("PRIVACY: Error during identity scan: %s", str(e), exc_info=True)
@@ -310,8 +375,166 @@ class PrivacyScanner:
         """Force a refresh of the identity index."""
         self._index.clear()
         self._index_initialized = False
+        self._generation += 1
         self._build_index()
 
+    def generation(self, identity: str) -> str:
+        """Get the generation of the index entries of an identity.
+
+        The generation changes whenever vCards containing the identity are
+        written, moved or deleted through the storage, or the whole index is
+        invalidated.
+
+        Args:
+            identity: The email or phone number (normalized to E.164)
+
+        Returns:
+            An opaque token identifying the current generation
+        """
+        return "%s-%d-%d" % (self._epoch, self._generation,
+                             self._identity_generations.get(self._index_key(identity), 0))
+
+    def _collection_stamp(self, collection_path: str) -> str:
+        """Get the modification time of the folder of a collection.
+
+        Items are written by renaming files into the folder, so the time
+        changes whenever an item is created, replaced or deleted, also by
+        other processes. Empty for storages without folders.
+        """
+        if not isinstance(self._storage, multifilesystem.Storage):
+            return ""
+        try:
+            filesystem_path = pathutils.path_to_filesystem(
+                self._storage._get_collection_root_folder(), collection_path,
+                self._storage._is_collision_free)
+            return str(os.stat(filesystem_path).st_mtime_ns)
+        except (OSError, ValueError):
+            return ""
+
+    def collection_state(self, identity: str) -> str:
+        """Get the state of the collections holding vCards of an identity.
+
+        Unlike the generation, the state also follows changes made by other
+        processes, it only costs a stat() of each collection folder (see
+        _collection_stamp()). Index entries of collections that changed
+        since they were scanned are invalidated.
+
+        vCards edited in place outside of Radicale, and vCards added to
+        collections without earlier matches of the identity are not
+        detected, until the index entry of the identity is invalidated.
+
+        Args:
+            identity: The email or phone number (normalized to E.164)
+
+        Returns:
+            An opaque token identifying the current state (empty if the
+            identity is not in the index)
+        """
+        matches = self._index.get(self._index_key(identity))
+        if not matches:
+            return ""
+        collection_stamps: Dict[str, str] = {}
+        changed = False
+        for match in matches:
+            path = match["collection_path"]
+            if path not in collection_stamps:
+                collection_stamps[path] = self._collection_stamp(path)
+            if collection_stamps[path] != match.get("collection_stamp"):
+                changed = True
+        if changed:
+            logger.debug("PRIVACY: Collections changed since they were scanned, invalidating identity")
+            self.invalidate([identity])
+        return " ".join("%s=%s" % item for item in sorted(collection_stamps.items()))
+
+    def invalidate(self, identities: Optional[Iterable[str]] = None) -> None:
+        """Drop index entries so they are rescanned on the next lookup.
+
+        Args:
+            identities: The identities to invalidate. If None, the whole
+                index is invalidated.
+        """
+        if identities is None:
+            self._index.clear()
+            self._index_initialized = False
+            self._generation += 1
+            return
+        for identity in identities:
+            index_key = self._index_key(identity)
+            self._index.pop(index_key, None)
+            self._identity_generations[index_key] = self._identity_generations.get(index_key, 0) + 1
+
+    @classmethod
+    def is_active(cls) -> bool:
+        """Whether the scanner was instantiated in this process."""
+        return cls._instance is not None and cls._instance._initialized
+
+    @classmethod
+    def invalidate_items(cls, items: Iterable[Optional[Item]]) -> None:
+        """Invalidate the identities contained in written or deleted items.
+
+        Does nothing (and avoids parsing the items) if the scanner is not
+        in use in this process.
+
+        Args:
+            items: The old and new versions of changed items (None entries
+                and non-vCard items are skipped)
+        """
+        if not cls.is_active():
+            return
+        instance = cls._instance
+        assert instance is not None
+        identities: Set[str] = set()
+        for item in items:
+            if item is None or (item.component_name != "VCARD" and item.name != "VCARD"):
+                continue
+            try:
+                identities.update(value for _, value in instance._extract_identifiers(item.vobject_item))
+            except Exception as e:
+                logger.warning("PRIVACY: Failed to extract identities, invalidating index: %s", e)
+                instance.invalidate()
+                return
+        if identities:
+            instance.invalidate(identities)
+
+    @classmethod
+    def subscribe(cls, storage_: storage.BaseStorage) -> None:
+        """Keep the index in sync with the changes made through a storage.
+
+        The index is invalidated synchronously, while the storage is still
+        locked. Subscribing the same storage again has no effect.
+
+        Args:
+            storage_: A storage of this process (usually the storage of the
+                application besides the storage of the scanner)
+        """
+        storage_.events.unsubscribe(cls._on_storage_event)
+        storage_.events.subscribe(cls._on_storage_event, (
+            events.UpsertEvent, events.DeleteEvent, events.MoveEvent,
+            events.CollectionEvent))
+
+    @classmethod
+    def _on_storage_event(cls, event: events.Event) -> None:
+        """Invalidate the identities affected by a storage change event."""
+        if isinstance(event, events.UpsertEvent):
+            cls.invalidate_items((event.old_item, event.item))
+        elif isinstance(event, events.DeleteEvent):
+            if event.href is None:
+                cls.invalidate_all()
+            else:
+                cls.invalidate_items((event.old_item,))
+        elif isinstance(event, events.MoveEvent):
+            cls.invalidate_items((event.item, event.replaced_item))
+        elif isinstance(event, events.CollectionEvent):
+            # Cheaper than loading and parsing all items of the collection
+            cls.invalidate_all()
+
+    @classmethod
+    def invalidate_all(cls) -> None:
+        """Invalidate the whole index if the scanner is in use."""
+        if cls.is_active():
+            assert cls._instance is not None
+            cls._instance.invalidate()
+
     @classmethod
     def reset(cls):
         """Reset the singleton instance for testing."""
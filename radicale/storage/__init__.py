@@ -25,6 +25,7 @@ Take a look at the class ``BaseCollection`` if you want to implement your own.
 """
 
 import json
+import tempfile
 import xml.etree.ElementTree as ET
 from hashlib import sha256
 from typing import (Callable, ContextManager, Dict, Iterable, Iterator, List,
@@ -32,14 +33,16 @@ from typing import (Callable, ContextManager, Dict, Iterable, Iterator, List,
 
 import vobject
 
-from radicale import config
+from radicale import config, httputils
 from radicale import item as radicale_item
 from radicale import types, utils
 from radicale.item import filter as radicale_filter
 from radicale.log import logger
+from radicale.storage.events import EventBus
 from radicale.utils import format_ut
 
-INTERNAL_TYPES: Sequence[str] = ("multifilesystem", "multifilesystem_nolock",)
+INTERNAL_TYPES: Sequence[str] = ("multifilesystem", "multifilesystem_nolock",
+                                 "sqlite",)
 
 # NOTE: change only if cache structure is modified to avoid cache invalidation on update
 CACHE_VERSION_RADICALE = "3.3.1"
@@ -225,79 +228,116 @@ class BaseCollection:
 
     def serialize(self, vcf_to_ics: bool = False, ShareActions: dict = {}) -> str:
         """Get the unicode string representing the whole collection."""
+        return "".join(self.serialize_stream(vcf_to_ics=vcf_to_ics,
+                                             ShareActions=ShareActions))
+
+    def serialize_stream(self, vcf_to_ics: bool = False,
+                         ShareActions: dict = {}) -> Iterator[str]:
+        """Get the unicode string representing the whole collection in
+        chunks.
+
+        The items are loaded while the chunks are consumed, the storage
+        must stay locked until the iterator is exhausted.
+
+        """
         if self.tag == "VCALENDAR":
-            in_vcalendar = False
-            vtimezones = ""
-            included_tzids: Set[str] = set()
-            vtimezone = []
-            tzid = None
-            components = ""
+            template_head, template_tail = self._vcalendar_template()
+            yield template_head
             # Concatenate all child elements of VCALENDAR from all items
             # together, while preventing duplicated VTIMEZONE entries.
             # VTIMEZONEs are only distinguished by their TZID, if different
             # timezones share the same TZID this produces erroneous output.
             # VObject fails at this too.
-            for item in self.get_all():
-                depth = 0
-                for line in item.serialize().split("\r\n"):
-                    if line.startswith("BEGIN:"):
-                        depth += 1
-                    if depth == 1 and line == "BEGIN:VCALENDAR":
-                        in_vcalendar = True
-                    elif in_vcalendar:
-                        if depth == 1 and line.startswith("END:"):
-                            in_vcalendar = False
-                        if depth == 2 and line == "BEGIN:VTIMEZONE":
-                            vtimezone.append(line + "\r\n")
-                        elif vtimezone:
-                            vtimezone.append(line + "\r\n")
-                            if depth == 2 and line.startswith("TZID:"):
-                                tzid = line[len("TZID:"):]
-                            elif depth == 2 and line.startswith("END:"):
-                                if tzid is None or tzid not in included_tzids:
-                                    vtimezones += "".join(vtimezone)
-                                if tzid is not None:
-                                    included_tzids.add(tzid)
-                                vtimezone.clear()
-                                tzid = None
-                        elif depth >= 2:
-                            components += line + "\r\n"
-                    if line.startswith("END:"):
-                        depth -= 1
-            template = vobject.iCalendar()
-            displayname = self.get_meta("D:displayname")
-            if displayname:
-                template.add("X-WR-CALNAME")
-                template.x_wr_calname.value_param = "TEXT"
-                template.x_wr_calname.value = displayname
-            description = self.get_meta("C:calendar-description")
-            if description:
-                template.add("X-WR-CALDESC")
-                template.x_wr_caldesc.value_param = "TEXT"
-                template.x_wr_caldesc.value = description
-            template = template.serialize()
-            template_insert_pos = template.find("\r\nEND:VCALENDAR\r\n") + 2
-            assert template_insert_pos != -1
-            return (template[:template_insert_pos] +
-                    vtimezones + components +
-                    template[template_insert_pos:])
-        if self.tag == "VADDRESSBOOK":
+            # The VTIMEZONEs precede all other components, the other
+            # components are kept in a temporary file until all items are
+            # read.
+            included_tzids: Set[str] = set()
+            timezones: List[str] = []
+            with tempfile.SpooledTemporaryFile(
+                    max_size=httputils.SPOOL_MAX_MEMORY_SIZE, mode="w+",
+                    encoding="utf-8", newline="") as spool:
+                for item in self.get_all():
+                    for name, tzid, component in _vcalendar_components(
+                            item.serialize()):
+                        if name != "VTIMEZONE":
+                            spool.write(component)
+                            continue
+                        if tzid is None or tzid not in included_tzids:
+                            timezones.append(component)
+                        if tzid is not None:
+                            included_tzids.add(tzid)
+                yield from timezones
+                spool.seek(0)
+                yield from iter(
+                    lambda: spool.read(httputils.STREAMING_BLOCK_SIZE), "")
+            yield template_tail
+        elif self.tag == "VADDRESSBOOK":
             if vcf_to_ics:
                 logger.trace("storage: convert VCF to ICS")
-
-                items = []
                 for item in self.get_all():
                     logger.trace("storage/convert VCF to ICS: %r:", item)
                     item_ics = item.convert_vcf_to_ics(ShareActions=ShareActions)
                     if item_ics is None:
                         continue
-                    else:
-                        pass
-                    items.append(item_ics.vobject_item)
-                return "".join((item.serialize() for item in items))
+                    yield item_ics.vobject_item.serialize()
             else:
-                return "".join((item.serialize() for item in self.get_all()))
-        return ""
+                for item in self.get_all():
+                    yield item.serialize()
+
+    def _vcalendar_template(self) -> Tuple[str, str]:
+        """The VCALENDAR around the components of the collection, split at
+        the position of the components."""
+        template = vobject.iCalendar()
+        displayname = self.get_meta("D:displayname")
+        if displayname:
+            template.add("X-WR-CALNAME")
+            template.x_wr_calname.value_param = "TEXT"
+            template.x_wr_calname.value = displayname
+        description = self.get_meta("C:calendar-description")
+        if description:
+            template.add("X-WR-CALDESC")
+            template.x_wr_caldesc.value_param = "TEXT"
+            template.x_wr_caldesc.value = description
+        template = template.serialize()
+        template_insert_pos = template.find("\r\nEND:VCALENDAR\r\n") + 2
+        assert template_insert_pos != -1
+        return template[:template_insert_pos], template[template_insert_pos:]
+
+
+def _vcalendar_components(text: str
+                          ) -> Iterator[Tuple[str, Optional[str], str]]:
+    """Split the child components of VCALENDAR in the serialized ``text``.
+
+    Yields the name, the TZID (only for VTIMEZONE) and the text of every
+    component.
+
+    """
+    depth = 0
+    in_vcalendar = False
+    name = ""
+    tzid: Optional[str] = None
+    lines: List[str] = []
+    for line in text.split("\r\n"):
+        if line.startswith("BEGIN:"):
+            depth += 1
+        if depth == 1 and line == "BEGIN:VCALENDAR":
+            in_vcalendar = True
+        elif in_vcalendar:
+            if depth == 1 and line.startswith("END:"):
+                in_vcalendar = False
+            elif depth >= 2:
+                if depth == 2 and line.startswith("BEGIN:"):
+                    name = line[len("BEGIN:"):]
+                elif (depth == 2 and name == "VTIMEZONE" and
+                      line.startswith("TZID:")):
+                    tzid = line[len("TZID:"):]
+                lines.append(line + "\r\n")
+                if depth == 2 and line.startswith("END:"):
+                    yield name, tzid, "".join(lines)
+                    lines.clear()
+                    tzid = None
+        if line.startswith("END:"):
+            depth -= 1
 
 
 class BaseStorage:
@@ -307,6 +347,8 @@ class BaseStorage:
     _supports_trailing_whitespace: bool = False
     _supports_problematic_chars: bool = False
 
+    events: EventBus
+
     def __init__(self, configuration: "config.Configuration") -> None:
         """Initialize BaseStorage.
 
@@ -314,8 +356,12 @@ class BaseStorage:
         The ``configuration`` must not change during the lifetime of
         this object, it is kept as an internal reference.
 
+        ``events`` receives the changes of the storage, see
+        ``radicale.storage.events`` module.
+
         """
         self.configuration = configuration
+        self.events = EventBus()
 
     def discover(
             self, path: str, depth: str = "0",
@@ -382,6 +428,10 @@ class BaseStorage:
 
         ``user`` is the name of the logged in user or empty.
 
+        Requests pass their sanitized ``path`` (and ``to_path`` for MOVE)
+        and the ``request`` method as keyword arguments. The storage may
+        use them to lock only the part of the storage that is accessed.
+
         """
         raise NotImplementedError
 
@@ -0,0 +1,211 @@
+# This file is part of Radicale - CalDAV and CardDAV server
+#
+# This library is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Radicale.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Change events of the storage.
+
+The storage emits an event for every change of an item or of the
+properties of a collection while the storage is locked. Collections that are
+created or replaced as a whole emit a single ``CollectionEvent``, the items
+aren't loaded for it. Subscribers maintain
+derived data (indexes, caches, ...) incrementally instead of scanning the
+storage.
+
+Synchronous subscribers are called immediately, while the storage is still
+locked. Asynchronous subscribers are called by a background thread in the
+order of the events. Errors of subscribers are logged and never affect the
+change itself.
+
+"""
+
+import atexit
+import threading
+import weakref
+from collections import deque
+from typing import (TYPE_CHECKING, Callable, Deque, List, Mapping, NamedTuple,
+                    Optional, Tuple, Type, Union)
+
+from radicale.log import logger
+
+if TYPE_CHECKING:
+    from radicale import item as radicale_item
+
+
+class UpsertEvent(NamedTuple):
+    """An item was created or replaced."""
+
+    path: str
+    href: str
+    item: "radicale_item.Item"
+    # ``None`` if the item was created
+    old_item: Optional["radicale_item.Item"]
+
+
+class DeleteEvent(NamedTuple):
+    """An item or a whole collection (``href`` is ``None``) was deleted."""
+
+    path: str
+    href: Optional[str]
+    # ``None`` for collections or if the item couldn't be loaded
+    old_item: Optional["radicale_item.Item"]
+
+
+class MoveEvent(NamedTuple):
+    """An item was moved, within a collection or between collections."""
+
+    from_path: str
+    from_href: str
+    to_path: str
+    to_href: str
+    item: "radicale_item.Item"
+    # The item that was overwritten at the destination, ``None`` if there
+    # was none or it couldn't be loaded
+    replaced_item: Optional["radicale_item.Item"]
+
+
+class MetaEvent(NamedTuple):
+    """The properties of a collection were set."""
+
+    path: str
+    props: Mapping[str, str]
+
+
+class CollectionEvent(NamedTuple):
+    """A collection was created with ``props`` and its items.
+
+    The items are not part of the event, subscribers load the collection
+    if they need them.
+
+    """
+
+    path: str
+    props: Mapping[str, str]
+    # An existing collection (and everything below it) was replaced
+    replaced: bool
+
+
+Event = Union[UpsertEvent, DeleteEvent, MoveEvent, MetaEvent,
+              CollectionEvent]
+Subscriber = Callable[[Event], object]
+
+EVENT_TYPES: Tuple[Type[Event], ...] = (UpsertEvent, DeleteEvent, MoveEvent,
+                                        MetaEvent, CollectionEvent)
+
+
+class _Subscription(NamedTuple):
+    callback: Subscriber
+    event_types: Tuple[Type[Event], ...]
+    asynchronous: bool
+
+
+class EventBus:
+    """Dispatch the change events of a storage to the subscribers."""
+
+    def __init__(self) -> None:
+        self._subscriptions: List[_Subscription] = []
+        self._lock = threading.Lock()
+        self._cond = threading.Condition()
+        self._pending: Deque[Tuple[_Subscription, Event]] = deque()
+        self._running = False
+        self._thread: Optional[threading.Thread] = None
+        _buses.add(self)
+
+    @property
+    def active(self) -> bool:
+        """Whether there are subscribers.
+
+        Emitters skip the preparation of events (e.g. loading the old
+        version of an item) if nobody is listening.
+
+        """
+        return bool(self._subscriptions)
+
+    def subscribe(self, callback: Subscriber,
+                  event_types: Tuple[Type[Event], ...] = EVENT_TYPES,
+                  asynchronous: bool = False) -> None:
+        """Call ``callback`` for every event of ``event_types``.
+
+        ``asynchronous`` subscribers are called in a background thread,
+        after the change (the storage might be unlocked already).
+
+        """
+        with self._lock:
+            # Copy on write, ``emit`` iterates without the lock
+            self._subscriptions = [*self._subscriptions, _Subscription(
+                callback, tuple(event_types), asynchronous)]
+
+    def unsubscribe(self, callback: Subscriber) -> None:
+        with self._lock:
+            self._subscriptions = [subscription for subscription in
+                                   self._subscriptions
+                                   if subscription.callback != callback]
+
+    def emit(self, event: Event) -> None:
+        for subscription in self._subscriptions:
+            if not isinstance(event, subscription.event_types):
+                continue
+            if subscription.asynchronous:
+                self._queue(subscription, event)
+            else:
+                self._call(subscription, event)
+
+    @staticmethod
+    def _call(subscription: _Subscription, event: Event) -> None:
+        try:
+            subscription.callback(event)
+        except Exception as e:
+            logger.error("Storage event subscriber %r failed for %s: %s",
+                         subscription.callback, type(event).__name__, e,
+                         exc_info=True)
+
+    def _queue(self, subscription: _Subscription, event: Event) -> None:
+        with self._cond:
+            self._pending.append((subscription, event))
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._work, daemon=True, name="storage-events")
+                self._thread.start()
+            self._cond.notify_all()
+
+    def _work(self) -> None:
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                subscription, event = self._pending.popleft()
+                self._running = True
+            try:
+                self._call(subscription, event)
+            finally:
+                with self._cond:
+                    self._running = False
+                    self._cond.notify_all()
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Wait until all asynchronous subscribers got the queued events,
+        ``False`` on timeout."""
+        with self._cond:
+            return self._cond.wait_for(
+                lambda: not self._pending and not self._running, timeout)
+
+
+_buses: "weakref.WeakSet[EventBus]" = weakref.WeakSet()
+
+
+@atexit.register
+def _flush_buses() -> None:
+    for bus in list(_buses):
+        if not bus.flush(10):
+            logger.warning("Storage events not delivered before shutdown")
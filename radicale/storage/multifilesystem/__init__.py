@@ -24,9 +24,11 @@ Uses one folder per collection and one file per collection entry.
 
 """
 
+import json
 import os
 import sys
 import time
+from hashlib import sha256
 from typing import ClassVar, Iterator, Optional, Type
 
 from radicale import config, pathutils, utils
@@ -41,8 +43,11 @@ from radicale.storage.multifilesystem.get import CollectionPartGet
 from radicale.storage.multifilesystem.history import CollectionPartHistory
 from radicale.storage.multifilesystem.lock import (CollectionPartLock,
                                                    StoragePartLock)
+from radicale.storage.multifilesystem.manifest import CollectionPartManifest
 from radicale.storage.multifilesystem.meta import CollectionPartMeta
 from radicale.storage.multifilesystem.move import StoragePartMove
+from radicale.storage.multifilesystem.rebuild_cache import \
+    StoragePartRebuildCache
 from radicale.storage.multifilesystem.sync import CollectionPartSync
 from radicale.storage.multifilesystem.upload import CollectionPartUpload
 from radicale.storage.multifilesystem.verify import StoragePartVerify
@@ -52,9 +57,10 @@ MTIME_NS_TEST: int = 999999999999
 
 
 class Collection(
-        CollectionPartDelete, CollectionPartMeta, CollectionPartSync,
-        CollectionPartUpload, CollectionPartGet, CollectionPartCache,
-        CollectionPartLock, CollectionPartHistory, CollectionBase):
+        CollectionPartDelete, CollectionPartUpload, CollectionPartManifest,
+        CollectionPartMeta, CollectionPartSync, CollectionPartGet,
+        CollectionPartCache, CollectionPartHistory, CollectionPartLock,
+        CollectionBase):
 
     _etag_cache: Optional[str]
 
@@ -69,6 +75,11 @@ class Collection(
 
     @property
     def last_modified(self) -> str:
+        if self._storage._use_collection_manifest is True:
+            last = self._manifest().last_modified
+            return time.strftime("%a, %d %b %Y %H:%M:%S GMT",
+                                 time.gmtime(last))
+
         def relevant_files_iter() -> Iterator[str]:
             yield self._filesystem_path
             if os.path.exists(self._props_path):
@@ -81,14 +92,23 @@ class Collection(
     @property
     def etag(self) -> str:
         # reuse cached value if the storage is read-only
-        if self._storage._lock.locked == "w" or self._etag_cache is None:
-            self._etag_cache = super().etag
+        if self._storage._write_locked or self._etag_cache is None:
+            if self._storage._use_collection_manifest is True:
+                manifest = self._manifest()
+                etag = sha256(("%064x/%d/" % (manifest.digest, manifest.item_count)
+                               ).encode())
+                etag.update(json.dumps(self.get_meta(), sort_keys=True
+                                       ).encode())
+                self._etag_cache = '"%s"' % etag.hexdigest()
+            else:
+                self._etag_cache = super().etag
         return self._etag_cache
 
 
 class Storage(
         StoragePartCreateCollection, StoragePartLock, StoragePartMove,
-        StoragePartVerify, StoragePartDiscover, StorageBase):
+        StoragePartVerify, StoragePartRebuildCache, StoragePartDiscover,
+        StorageBase):
 
     _collection_class: ClassVar[Type[Collection]] = Collection
 
@@ -190,6 +210,18 @@ class Storage(
         logger.info("Storage cache subfolder usage for 'history': %s", self._use_cache_subfolder_for_history)
         logger.info("Storage cache subfolder usage for 'sync-token': %s", self._use_cache_subfolder_for_synctoken)
         logger.info("Storage cache use mtime and size for 'item': %s", self._use_mtime_and_size_for_item_cache)
+        logger.info("Storage cache packed for 'item': %s", self._use_packed_item_cache)
+        logger.info("Storage cache store for 'history': %s", self._use_history_store)
+        logger.info("Storage collection manifest: %s", self._use_collection_manifest)
+        logger.info("Storage sync change log: %s", self._use_sync_change_log)
+        logger.info("Storage sync token deltas: %s", self._use_sync_token_deltas)
+        logger.info("Storage item index: %s", self._use_item_index)
+        logger.info("Storage cache binary format: %s", self._use_binary_cache)
+        logger.info("Storage principal locks: %s", self._use_principal_locks)
+        logger.info("Storage item memory cache size: %d bytes", configuration.get("storage", "item_memory_cache_size"))
+        logger.info("Storage item prefetch workers: %d", self._item_prefetch_workers)
+        if self._hook:
+            logger.info("Storage hook asynchronous: %s", self._hook_executor is not None)
         try:
             (precision, precision_unit, unit) = self._analyse_mtime()
             if precision >= 100000000:
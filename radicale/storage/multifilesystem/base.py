@@ -19,12 +19,18 @@
 
 import os
 import sys
+from concurrent.futures import Future, ThreadPoolExecutor
 from tempfile import TemporaryDirectory
-from typing import IO, AnyStr, ClassVar, Iterator, Optional, Type
+from typing import (IO, AnyStr, Callable, ClassVar, Iterator, List, Optional,
+                    Type)
 
 from radicale import config, pathutils, storage, types, utils
 from radicale.log import logger
 from radicale.storage import multifilesystem  # noqa:F401
+from radicale.storage.multifilesystem.memory_cache import ItemMemoryCache
+
+# Number of threads syncing files of a group commit
+GROUP_FSYNC_WORKERS = 8
 
 
 class CollectionBase(storage.BaseCollection):
@@ -80,6 +86,16 @@ class StorageBase(storage.BaseStorage):
     _use_cache_subfolder_for_history: bool
     _use_cache_subfolder_for_synctoken: bool
     _use_mtime_and_size_for_item_cache: bool
+    _use_packed_item_cache: bool
+    _use_history_store: bool
+    _use_collection_manifest: bool
+    _use_sync_change_log: bool
+    _use_sync_token_deltas: bool
+    _use_item_index: bool
+    _use_binary_cache: bool
+    _item_memory_cache: Optional[ItemMemoryCache]
+    _item_prefetch_workers: int
+    _item_prefetch_executor: Optional[ThreadPoolExecutor]
     _debug_cache_actions: bool
     _folder_umask: str
     _config_umask: int
@@ -101,6 +117,30 @@ class StorageBase(storage.BaseStorage):
             "storage", "use_cache_subfolder_for_synctoken")
         self._use_mtime_and_size_for_item_cache = configuration.get(
             "storage", "use_mtime_and_size_for_item_cache")
+        self._use_packed_item_cache = configuration.get(
+            "storage", "use_packed_item_cache")
+        self._use_history_store = configuration.get(
+            "storage", "use_history_store")
+        self._use_collection_manifest = configuration.get(
+            "storage", "use_collection_manifest")
+        self._use_sync_change_log = configuration.get(
+            "storage", "use_sync_change_log")
+        self._use_sync_token_deltas = configuration.get(
+            "storage", "use_sync_token_deltas")
+        self._use_item_index = configuration.get(
+            "storage", "use_item_index")
+        self._use_binary_cache = configuration.get(
+            "storage", "use_binary_cache")
+        item_memory_cache_size = configuration.get(
+            "storage", "item_memory_cache_size")
+        self._item_memory_cache = (ItemMemoryCache(item_memory_cache_size)
+                                   if item_memory_cache_size else None)
+        self._item_prefetch_workers = configuration.get(
+            "storage", "item_prefetch_workers")
+        self._item_prefetch_executor = (
+            ThreadPoolExecutor(max_workers=self._item_prefetch_workers,
+                               thread_name_prefix="item-prefetch")
+            if self._item_prefetch_workers else None)
         self._folder_umask = configuration.get(
             "storage", "folder_umask")
         self._debug_cache_actions = configuration.get(
@@ -134,6 +174,37 @@ class StorageBase(storage.BaseStorage):
                 raise RuntimeError("Fsync'ing file %r failed: %s" %
                                    (f.name, e)) from e
 
+    def _fsync_path(self, path: str) -> None:
+        try:
+            fd = os.open(path, os.O_RDWR | getattr(os, "O_BINARY", 0))
+            try:
+                pathutils.fsync(fd)
+            finally:
+                os.close(fd)
+        except OSError as e:
+            raise RuntimeError("Fsync'ing file %r failed: %s" %
+                               (path, e)) from e
+
+    @types.contextmanager
+    def _group_fsync(self) -> Iterator[Callable[[str], None]]:
+        """Sync many written files to disk together.
+
+        Yields a function that takes the path of a closed file. The files
+        are synced in parallel while more files are written, the context
+        exits after all of them are on disk. The parent directories must
+        still be synced afterwards.
+
+        """
+        if not self._filesystem_fsync:
+            yield lambda path: None
+            return
+        futures: List[Future] = []
+        with ThreadPoolExecutor(max_workers=GROUP_FSYNC_WORKERS) as executor:
+            yield lambda path: futures.append(
+                executor.submit(self._fsync_path, path))
+        for future in futures:
+            future.result()
+
     def _sync_directory(self, path: str) -> None:
         """Sync directory to disk.
 
@@ -22,20 +22,54 @@ import os
 import pickle
 import time
 from hashlib import sha256
-from typing import BinaryIO, Iterable, NamedTuple, Optional, cast
+from typing import BinaryIO, Iterable, NamedTuple, Optional, Tuple, cast
 
 import radicale.item as radicale_item
 from radicale import pathutils, storage
+from radicale.item import scanner as radicale_scanner
 from radicale.log import logger
+from radicale.storage.multifilesystem import cache_format
 from radicale.storage.multifilesystem.base import CollectionBase
+from radicale.storage.multifilesystem.cache_pack import ItemCachePack
 
 CacheContent = NamedTuple("CacheContent", [
     ("uid", str), ("etag", str), ("text", str), ("name", str), ("tag", str),
     ("start", int), ("end", int)])
 
 
+def parse_item_cache_content(job: Tuple[str, str, bytes, str, bool]
+                             ) -> Tuple[Optional[CacheContent], str]:
+    """Cache content of an item file, or ``None`` and the error message.
+
+    ``job`` is the path and tag of the collection, the content of the file,
+    its encoding and whether simple items are scanned instead of being parsed
+    with vobject (see ``radicale.item.scanner``). Runs in worker processes,
+    which don't have a collection.
+
+    """
+    collection_path, tag, raw_text, encoding, scan = job
+    try:
+        text = raw_text.decode(encoding)
+        item = None
+        if scan:
+            item = radicale_scanner.scan_item(
+                text, tag, collection_path=collection_path)
+        if item is None:
+            vobject_items = radicale_item.read_components(text)
+            radicale_item.check_and_sanitize_items(vobject_items, tag=tag)
+            vobject_item, = vobject_items
+            item = radicale_item.Item(collection_path=collection_path,
+                                      vobject_item=vobject_item)
+        return CacheContent(item.uid, item.etag, item.serialize(), item.name,
+                            item.component_name, *item.time_range), ""
+    except Exception as e:
+        return None, str(e)
+
+
 class CollectionPartCache(CollectionBase):
 
+    _packed_item_cache: Optional[ItemCachePack] = None
+
     def _clean_cache(self, folder: str, names: Iterable[str],
                      max_age: int = 0) -> None:
         """Delete all ``names`` in ``folder`` that are older than ``max_age``.
@@ -77,6 +111,27 @@ class CollectionPartCache(CollectionBase):
     def _item_cache_mtime_and_size(size: int, raw_text: int) -> str:
         return str(storage.CACHE_VERSION.decode()) + "size=" + str(size) + ";mtime=" + str(raw_text)
 
+    def _item_file_cache_hash(self, raw_text: bytes, st: os.stat_result
+                              ) -> str:
+        if self._storage._use_mtime_and_size_for_item_cache is True:
+            return self._item_cache_mtime_and_size(st.st_size, st.st_mtime_ns)
+        return self._item_cache_hash(raw_text)
+
+    def _item_cache_pack(self) -> ItemCachePack:
+        if self._packed_item_cache is None:
+            cache_folder = self._storage._get_collection_cache_subfolder(self._filesystem_path, ".Radicale.cache", "item")
+            # Remove the files of the unpacked item cache once
+            self._packed_item_cache = ItemCachePack(
+                self._storage, cache_folder, on_create=lambda: self._clean_cache(
+                    cache_folder, os.listdir(cache_folder)))
+        return self._packed_item_cache
+
+    def _dump_item_cache(self, cache_hash: str, content: CacheContent
+                         ) -> bytes:
+        if self._storage._use_binary_cache is True:
+            return cache_format.dump_item(cache_hash, content)
+        return pickle.dumps((cache_hash, *content))
+
     def _item_cache_content(self, item: radicale_item.Item) -> CacheContent:
         return CacheContent(item.uid, item.etag, item.serialize(), item.name,
                             item.component_name, *item.time_range)
@@ -89,31 +144,62 @@ class CollectionPartCache(CollectionBase):
             else:
                 cache_hash = self._item_cache_hash(
                     item.serialize().encode(self._encoding))
-        cache_folder = self._storage._get_collection_cache_subfolder(self._filesystem_path, ".Radicale.cache", "item")
         content = self._item_cache_content(item)
+        self._store_item_cache_content(href, cache_hash, content)
+        return content
+
+    def _store_item_cache_content(self, href: str, cache_hash: str,
+                                  content: CacheContent) -> None:
+        if self._storage._use_packed_item_cache is True:
+            self._item_cache_pack().store([(href, cache_hash, content)])
+            return
+        cache_folder = self._storage._get_collection_cache_subfolder(self._filesystem_path, ".Radicale.cache", "item")
         self._storage._makedirs_synced(cache_folder)
         # Race: Other processes might have created and locked the file.
         # TODO: better fix for "mypy"
         with contextlib.suppress(PermissionError), self._atomic_write(  # type: ignore
                 os.path.join(cache_folder, href), "wb") as fo:
             fb = cast(BinaryIO, fo)
-            pickle.dump((cache_hash, *content), fb)
-        return content
+            fb.write(self._dump_item_cache(cache_hash, content))
+
+    def _read_item_cache(self, href: str) -> Optional[bytes]:
+        """Content of the item cache file, ``None`` if it doesn't exist.
 
-    def _load_item_cache(self, href: str, cache_hash: str
+        Not supported for the packed item cache.
+
+        """
+        cache_folder = self._storage._get_collection_cache_subfolder(self._filesystem_path, ".Radicale.cache", "item")
+        try:
+            with open(os.path.join(cache_folder, href), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def _load_item_cache(self, href: str, cache_hash: str,
+                         data: Optional[bytes] = None
                          ) -> Optional[CacheContent]:
+        """``data`` is the content of the item cache file, if it was read
+        in advance."""
+        if self._storage._use_packed_item_cache is True:
+            return self._load_packed_item_cache(href, cache_hash)
         cache_folder = self._storage._get_collection_cache_subfolder(self._filesystem_path, ".Radicale.cache", "item")
         path = os.path.join(cache_folder, href)
         try:
-            with open(path, "rb") as f:
-                hash_, *remainder = pickle.load(f)
-                if hash_ and hash_ == cache_hash:
-                    if self._storage._debug_cache_actions is True:
-                        logger.debug("Item cache match     : %r with hash %r", path, cache_hash)
-                    return CacheContent(*remainder)
-                else:
-                    if self._storage._debug_cache_actions is True:
-                        logger.debug("Item cache no match  : %r with hash %r", path, cache_hash)
+            if data is None:
+                with open(path, "rb") as f:
+                    data = f.read()
+            remainder = cache_format.load_item(data, cache_hash)
+            if remainder is not None:
+                if self._storage._debug_cache_actions is True:
+                    logger.debug("Item cache match     : %r with hash %r", path, cache_hash)
+                content = CacheContent(*remainder)
+                if (self._storage._use_binary_cache is True and
+                        not cache_format.is_binary(data)):
+                    self._migrate_item_cache(path, cache_hash, content)
+                return content
+            else:
+                if self._storage._debug_cache_actions is True:
+                    logger.debug("Item cache no match  : %r with hash %r", path, cache_hash)
         except FileNotFoundError:
             if self._storage._debug_cache_actions is True:
                 logger.debug("Item cache not found : %r with hash %r", path, cache_hash)
@@ -123,8 +209,44 @@ class CollectionPartCache(CollectionBase):
                            href, self.path, e, exc_info=True)
         return None
 
+    def _migrate_item_cache(self, path: str, cache_hash: str,
+                            content: CacheContent) -> None:
+        """Rewrite an item cache file of the pickle format."""
+        if self._storage._debug_cache_actions is True:
+            logger.debug("Item cache migrate   : %r to binary format", path)
+        # Race: Other processes might have replaced and locked the file.
+        try:
+            # TODO: better fix for "mypy"
+            with self._atomic_write(path, "wb") as fo:  # type: ignore
+                fb = cast(BinaryIO, fo)
+                fb.write(cache_format.dump_item(cache_hash, content))
+        except OSError as e:
+            logger.debug("Failed to migrate item cache entry %r: %s", path, e)
+
+    def _load_packed_item_cache(self, href: str, cache_hash: str
+                                ) -> Optional[CacheContent]:
+        try:
+            entry = self._item_cache_pack().load(href, cache_hash)
+        except (pickle.UnpicklingError, ValueError, EOFError, TypeError) as e:
+            logger.warning("Failed to load packed item cache entry %r in %r: %s",
+                           href, self.path, e, exc_info=True)
+            return None
+        if entry is not None and entry[0] == cache_hash:
+            if self._storage._debug_cache_actions is True:
+                logger.debug("Item cache match     : %r with hash %r (packed)", href, cache_hash)
+            return CacheContent(*entry[1])
+        if self._storage._debug_cache_actions is True:
+            logger.debug("Item cache no match  : %r with hash %r (packed)", href, cache_hash)
+        return None
+
     def _clean_item_cache(self) -> None:
         cache_folder = self._storage._get_collection_cache_subfolder(self._filesystem_path, ".Radicale.cache", "item")
+        if self._storage._use_packed_item_cache is True:
+            # One directory listing instead of checking every entry
+            hrefs = {entry.name for entry in os.scandir(self._filesystem_path)
+                     if entry.is_file()}
+            self._item_cache_pack().clean(keep=lambda href: href in hrefs)
+            return
         self._clean_cache(cache_folder, (
             e.name for e in os.scandir(cache_folder) if not
             os.path.isfile(os.path.join(self._filesystem_path, e.name))))
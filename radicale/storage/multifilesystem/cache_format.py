@@ -0,0 +1,214 @@
+# This file is part of Radicale - CalDAV and CardDAV server
+#
+# This library is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Radicale.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Compact binary format of the cache files.
+
+Every file starts with a header of the magic ``RdCf``, the format version and
+the kind of the file (one byte each). Integers are little-endian, strings
+are UTF-8 prefixed with their length (unsigned 32 bit).
+
+Item cache (kind 1)
+    cache hash, start and end of the time range (signed 64 bit), uid, etag,
+    text, name and tag. The cache hash comes first, so a stale entry is
+    detected without decoding the rest.
+History cache (kind 2)
+    etag, history etag.
+Sync-token state (kind 3)
+    number of items (unsigned 32 bit), followed by href and history etag of
+    every item.
+Sync-token state delta (kind 4)
+    name of the sync token with the complete base state, the changed items
+    like a sync-token state, the number of removed items followed by their
+    hrefs.
+
+Files without the magic are read as the pickle files of earlier versions.
+
+"""
+
+import pickle
+import struct
+from typing import Dict, List, Mapping, Optional, Sequence, Tuple, cast
+
+MAGIC = b"RdCf"
+FORMAT_VERSION = 1
+
+KIND_ITEM = 1
+KIND_HISTORY = 2
+KIND_SYNC_STATE = 3
+KIND_SYNC_DELTA = 4
+
+_HEADER = struct.Struct("<4sBB")
+_LENGTH = struct.Struct("<I")
+_TIME_RANGE = struct.Struct("<qq")
+
+ItemCacheContent = Tuple[str, str, str, str, str, int, int]
+
+# Name of the base sync token (empty for complete states), the (changed)
+# items and the removed hrefs
+SyncTokenState = Tuple[str, Dict[str, str], List[str]]
+
+
+def is_binary(data: bytes) -> bool:
+    return data[:len(MAGIC)] == MAGIC
+
+
+class _Writer:
+
+    def __init__(self, kind: int) -> None:
+        self._parts: List[bytes] = [_HEADER.pack(MAGIC, FORMAT_VERSION, kind)]
+
+    def string(self, value: str) -> None:
+        raw = value.encode("utf-8", "surrogatepass")
+        self._parts.append(_LENGTH.pack(len(raw)))
+        self._parts.append(raw)
+
+    def pack(self, fmt: struct.Struct, *values: int) -> None:
+        self._parts.append(fmt.pack(*values))
+
+    def getvalue(self) -> bytes:
+        return b"".join(self._parts)
+
+
+class _Reader:
+
+    def __init__(self, data: bytes, kind: int) -> None:
+        self._view = memoryview(data)
+        self._pos = 0
+        magic, version, kind_ = self.unpack(_HEADER)
+        if magic != MAGIC:
+            raise ValueError("Not a binary cache file")
+        if version != FORMAT_VERSION:
+            raise ValueError("Unsupported cache format version %d" % version)
+        if kind_ != kind:
+            raise ValueError("Unexpected cache file kind %d" % kind_)
+
+    def unpack(self, fmt: struct.Struct) -> tuple:
+        try:
+            values = fmt.unpack_from(self._view, self._pos)
+        except struct.error as e:
+            raise ValueError("Truncated cache file: %s" % e) from e
+        self._pos += fmt.size
+        return values
+
+    def raw_string(self) -> memoryview:
+        length, = self.unpack(_LENGTH)
+        if self._pos + length > len(self._view):
+            raise ValueError("Truncated cache file")
+        raw = self._view[self._pos:self._pos + length]
+        self._pos += length
+        return raw
+
+    def string(self) -> str:
+        return str(self.raw_string(), "utf-8", "surrogatepass")
+
+
+def dump_item(cache_hash: str, content: Sequence) -> bytes:
+    uid, etag, text, name, tag, start, end = content
+    writer = _Writer(KIND_ITEM)
+    writer.string(cache_hash)
+    writer.pack(_TIME_RANGE, start, end)
+    for value in (uid, etag, text, name, tag):
+        writer.string(value)
+    return writer.getvalue()
+
+
+def load_item(data: bytes, cache_hash: str) -> Optional[ItemCacheContent]:
+    """Content of an item cache file, ``None`` if it was stored for another
+    ``cache_hash``."""
+    if not is_binary(data):
+        hash_, *content = pickle.loads(data)
+        if not hash_ or hash_ != cache_hash:
+            return None
+        return cast(ItemCacheContent, tuple(content))
+    reader = _Reader(data, KIND_ITEM)
+    if not cache_hash or reader.raw_string() != cache_hash.encode(
+            "utf-8", "surrogatepass"):
+        return None
+    start, end = reader.unpack(_TIME_RANGE)
+    uid, etag, text, name, tag = (reader.string() for _ in range(5))
+    return uid, etag, text, name, tag, start, end
+
+
+def dump_history(etag: str, history_etag: str) -> bytes:
+    writer = _Writer(KIND_HISTORY)
+    writer.string(etag)
+    writer.string(history_etag)
+    return writer.getvalue()
+
+
+def load_history(data: bytes) -> Tuple[str, str]:
+    if not is_binary(data):
+        etag, history_etag = pickle.loads(data)
+        return etag, history_etag
+    reader = _Reader(data, KIND_HISTORY)
+    return reader.string(), reader.string()
+
+
+def dump_sync_state(state: Mapping[str, str]) -> bytes:
+    writer = _Writer(KIND_SYNC_STATE)
+    writer.pack(_LENGTH, len(state))
+    for href, history_etag in state.items():
+        writer.string(href)
+        writer.string(history_etag)
+    return writer.getvalue()
+
+
+def load_sync_state(data: bytes) -> Dict[str, str]:
+    if not is_binary(data):
+        return pickle.loads(data)
+    reader = _Reader(data, KIND_SYNC_STATE)
+    count, = reader.unpack(_LENGTH)
+    state = {}
+    for _ in range(count):
+        href = reader.string()
+        state[href] = reader.string()
+    return state
+
+
+def dump_sync_delta(base: str, changed: Mapping[str, str],
+                    removed: Sequence[str]) -> bytes:
+    writer = _Writer(KIND_SYNC_DELTA)
+    writer.string(base)
+    writer.pack(_LENGTH, len(changed))
+    for href, history_etag in changed.items():
+        writer.string(href)
+        writer.string(history_etag)
+    writer.pack(_LENGTH, len(removed))
+    for href in removed:
+        writer.string(href)
+    return writer.getvalue()
+
+
+def load_sync_token(data: bytes) -> SyncTokenState:
+    """Complete state or delta of a sync token."""
+    if not is_binary(data):
+        content = pickle.loads(data)
+        if isinstance(content, tuple):
+            base, changed, removed = content
+            return base, changed, removed
+        return "", content, []
+    if data[_HEADER.size - 1:_HEADER.size] != bytes((KIND_SYNC_DELTA,)):
+        return "", load_sync_state(data), []
+    reader = _Reader(data, KIND_SYNC_DELTA)
+    base = reader.string()
+    count, = reader.unpack(_LENGTH)
+    changed = {}
+    for _ in range(count):
+        href = reader.string()
+        changed[href] = reader.string()
+    count, = reader.unpack(_LENGTH)
+    removed = [reader.string() for _ in range(count)]
+    return base, changed, removed
@@ -0,0 +1,386 @@
+# This file is part of Radicale - CalDAV and CardDAV server
+#
+# This library is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Radicale.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Packed item cache of a collection.
+
+Instead of one pickle file per item, all entries of the item cache of a
+collection are stored in two files in the item cache folder:
+
+``.Radicale.pack``
+    Index. A header with the name of the data file, followed by records
+    mapping an href to the cache hash and the location of its entry in the
+    data file. Records are only appended, later records supersede earlier
+    ones for the same href. Every record carries a CRC32, so a partially
+    written tail is detected and ignored.
+
+``.Radicale.pack.data-<id>``
+    Concatenated pickled entries. Only appended to, read through ``mmap``.
+
+Appending requires the item cache lock (or the exclusive storage lock).
+When most of the data is stale, ``compact`` writes a new data file and then
+atomically replaces the index, so readers never combine an index with the
+wrong data file. The names start with a dot and can't collide with hrefs.
+
+``on_create`` is called once when a new pack is created, e.g. to remove the
+files of the unpacked item cache.
+
+"""
+
+import binascii
+import contextlib
+import mmap
+import os
+import pickle
+import struct
+import zlib
+from typing import (Callable, Dict, Iterable, Iterator, List, Optional,
+                    Sequence, Tuple)
+
+from radicale.log import logger
+from radicale.storage.multifilesystem.base import StorageBase
+
+INDEX_NAME = ".Radicale.pack"
+DATA_PREFIX = ".Radicale.pack.data-"
+MAGIC = b"RADICALE-PACK\x01"
+
+# Compact if the data file is larger than this and more than half of it is
+# stale
+COMPACT_MIN_SIZE = 1024 * 1024
+
+_RECORD = struct.Struct("<HHQI")  # href length, hash length, offset, length
+_CRC = struct.Struct("<I")
+_NAME_LENGTH = struct.Struct("<H")
+
+# (cache hash, offset, length)
+PackEntry = Tuple[str, int, int]
+
+
+def _encode_href(href: str) -> bytes:
+    return href.encode("utf-8", "surrogateescape")
+
+
+def _record(href: str, cache_hash: str, offset: int, length: int) -> bytes:
+    href_bytes = _encode_href(href)
+    hash_bytes = cache_hash.encode("ascii")
+    record = (_RECORD.pack(len(href_bytes), len(hash_bytes), offset, length) +
+              href_bytes + hash_bytes)
+    return record + _CRC.pack(zlib.crc32(record))
+
+
+class ItemCachePack:
+    """Index and data file of the packed item cache in ``folder``."""
+
+    _storage: StorageBase
+    _folder: str
+    _entries: Dict[str, PackEntry]
+    _index_id: Optional[Tuple[int, int]]
+    _index_size: int
+    _data_name: str
+    _data_map: Optional[mmap.mmap]
+    _live_size: int
+    _on_create: Optional[Callable[[], object]]
+
+    def __init__(self, storage_: StorageBase, folder: str,
+                 on_create: Optional[Callable[[], object]] = None) -> None:
+        self._storage = storage_
+        self._folder = folder
+        self._on_create = on_create
+        self._entries = {}
+        self._index_id = None
+        self._index_size = 0
+        self._data_name = ""
+        self._data_map = None
+        self._live_size = 0
+
+    @property
+    def _index_path(self) -> str:
+        return os.path.join(self._folder, INDEX_NAME)
+
+    def _parse(self, data: bytes, pos: int) -> int:
+        """Parse records in ``data`` from ``pos``, return end of last valid
+        record."""
+        while pos + _RECORD.size <= len(data):
+            href_length, hash_length, offset, length = _RECORD.unpack_from(
+                data, pos)
+            end = pos + _RECORD.size + href_length + hash_length
+            if end + _CRC.size > len(data):
+                break
+            crc, = _CRC.unpack_from(data, end)
+            if crc != zlib.crc32(data[pos:end]):
+                logger.warning("Ignoring invalid tail of packed item cache "
+                               "%r", self._index_path)
+                break
+            href_start = pos + _RECORD.size
+            href = data[href_start:href_start + href_length].decode(
+                "utf-8", "surrogateescape")
+            cache_hash = data[href_start + href_length:end].decode("ascii")
+            old = self._entries.pop(href, None)
+            if old is not None:
+                self._live_size -= old[2]
+            if length > 0:
+                self._entries[href] = (cache_hash, offset, length)
+                self._live_size += length
+            pos = end + _CRC.size
+        return pos
+
+    def refresh(self) -> None:
+        """Read records appended (or a new index written) by others."""
+        try:
+            f = open(self._index_path, "rb")
+        except FileNotFoundError:
+            self._reset()
+            return
+        with f:
+            st = os.fstat(f.fileno())
+            index_id = (st.st_dev, st.st_ino)
+            if index_id == self._index_id:
+                if st.st_size <= self._index_size:
+                    return
+                f.seek(self._index_size)
+                data = f.read()
+                self._index_size += self._parse(data, 0)
+                return
+            data = f.read()
+        self._reset()
+        if not data.startswith(MAGIC):
+            logger.warning("Ignoring invalid packed item cache %r",
+                           self._index_path)
+            return
+        pos = len(MAGIC)
+        name_length, = _NAME_LENGTH.unpack_from(data, pos)
+        pos += _NAME_LENGTH.size
+        data_name = data[pos:pos + name_length].decode("ascii")
+        if not data_name.startswith(DATA_PREFIX) or "/" in data_name:
+            logger.warning("Ignoring invalid packed item cache %r",
+                           self._index_path)
+            return
+        self._data_name = data_name
+        self._index_id = index_id
+        self._index_size = self._parse(data, pos + name_length)
+
+    def _reset(self) -> None:
+        self.close()
+        self._entries = {}
+        self._index_id = None
+        self._index_size = 0
+        self._data_name = ""
+        self._live_size = 0
+
+    def close(self) -> None:
+        if self._data_map is not None:
+            self._data_map.close()
+            self._data_map = None
+
+    def _read(self, offset: int, length: int) -> Optional[bytes]:
+        data_map = self._data_map
+        if data_map is None or offset + length > len(data_map):
+            self.close()
+            try:
+                with open(os.path.join(self._folder, self._data_name),
+                          "rb") as f:
+                    if os.fstat(f.fileno()).st_size == 0:
+                        return None
+                    data_map = mmap.mmap(f.fileno(), 0,
+                                         access=mmap.ACCESS_READ)
+            except FileNotFoundError:
+                return None
+            self._data_map = data_map
+            if offset + length > len(data_map):
+                return None
+        return data_map[offset:offset + length]
+
+    def _load(self, href: str) -> Optional[Tuple[str, Sequence]]:
+        entry = self._entries.get(href)
+        if entry is None:
+            return None
+        cache_hash, offset, length = entry
+        raw = self._read(offset, length)
+        if raw is None:
+            return None
+        href_, hash_, *content = pickle.loads(raw)
+        if href_ != href or hash_ != cache_hash:
+            raise ValueError("Entry at offset %d does not match index" %
+                             offset)
+        return cache_hash, content
+
+    def load(self, href: str, cache_hash: str
+             ) -> Optional[Tuple[str, Sequence]]:
+        """Get ``(cache_hash, content)`` of ``href``.
+
+        Rereads the index if ``href`` is unknown or has another hash.
+
+        """
+        if self._index_id is None or (
+                self._entries.get(href, ("",))[0] != cache_hash):
+            self.refresh()
+        result = self._load(href)
+        if result is None and href in self._entries:
+            # Compacted by another process in the meantime
+            self.refresh()
+            result = self._load(href)
+        return result
+
+    def get(self, href: str) -> Optional[Tuple[str, Sequence]]:
+        """Get ``(cache_hash, content)`` of ``href`` regardless of its hash."""
+        self.refresh()
+        return self._load(href)
+
+    def hrefs(self) -> List[str]:
+        self.refresh()
+        return list(self._entries)
+
+    def _prepare_append(self) -> None:
+        """Drop a partially written tail and create missing files."""
+        self.refresh()
+        if self._index_id is None:
+            self._write_index(self._new_data_name(), [])
+            self.refresh()
+            if self._on_create is not None:
+                self._on_create()
+            return
+        with open(self._index_path, "r+b") as f:
+            if os.fstat(f.fileno()).st_size > self._index_size:
+                f.truncate(self._index_size)
+
+    @staticmethod
+    def _new_data_name() -> str:
+        return DATA_PREFIX + binascii.hexlify(os.urandom(8)).decode("ascii")
+
+    def store(self, entries: Iterable[Tuple[str, str, Sequence]]) -> None:
+        """Append ``(href, cache_hash, content)`` entries."""
+        self._storage._makedirs_synced(self._folder)
+        self._prepare_append()
+        records = []
+        data_path = os.path.join(self._folder, self._data_name)
+        with open(data_path, "ab") as f:
+            offset = f.seek(0, os.SEEK_END)
+            for href, cache_hash, content in entries:
+                raw = pickle.dumps((href, cache_hash, *content))
+                f.write(raw)
+                records.append(_record(href, cache_hash, offset, len(raw)))
+                offset += len(raw)
+            f.flush()
+            self._storage._fsync(f)
+        self._append_records(records)
+        self._compact_if_stale(offset)
+
+    def remove(self, hrefs: Iterable[str]) -> None:
+        """Append records removing ``hrefs``."""
+        self.refresh()
+        if self._index_id is None:
+            return
+        records = [_record(href, "", 0, 0) for href in hrefs
+                   if href in self._entries]
+        if not records:
+            return
+        self._prepare_append()
+        self._append_records(records)
+
+    def clean(self, keep: Callable[[str], bool]) -> None:
+        """Remove the entries of the hrefs not selected by ``keep``.
+
+        The data file is only rewritten if most of it is stale.
+
+        """
+        self.refresh()
+        if self._index_id is None:
+            return
+        self.remove([href for href in self._entries if not keep(href)])
+        try:
+            data_size = os.path.getsize(os.path.join(self._folder,
+                                                     self._data_name))
+        except FileNotFoundError:
+            # Race: Compacted by another process in the meantime
+            return
+        self._compact_if_stale(data_size)
+
+    def _compact_if_stale(self, data_size: int) -> None:
+        if data_size > COMPACT_MIN_SIZE and data_size > 2 * self._live_size:
+            self.compact()
+
+    def _append_records(self, records: List[bytes]) -> None:
+        if not records:
+            return
+        data = b"".join(records)
+        with open(self._index_path, "ab") as f:
+            f.write(data)
+            f.flush()
+            self._storage._fsync(f)
+        self._index_size += self._parse(data, 0)
+
+    def _write_index(self, data_name: str, records: List[bytes]) -> None:
+        name = data_name.encode("ascii")
+        tmp_path = os.path.join(self._folder, ".Radicale.tmp-pack-" +
+                                binascii.hexlify(os.urandom(8)).decode("ascii"))
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(MAGIC + _NAME_LENGTH.pack(len(name)) + name)
+                f.write(b"".join(records))
+                f.flush()
+                self._storage._fsync(f)
+            os.replace(tmp_path, self._index_path)
+        finally:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(tmp_path)
+        self._storage._sync_directory(self._folder)
+
+    def compact(self, keep: Optional[Callable[[str], bool]] = None) -> None:
+        """Rewrite the data file without stale entries.
+
+        ``keep`` selects the hrefs to retain (default: all).
+
+        """
+        self._prepare_append()
+        data_name = self._new_data_name()
+        records = []
+        with open(os.path.join(self._folder, data_name), "wb") as f:
+            offset = 0
+            for href, (cache_hash, old_offset, length) in list(
+                    self._entries.items()):
+                if keep is not None and not keep(href):
+                    continue
+                raw = self._read(old_offset, length)
+                if raw is None:
+                    continue
+                f.write(raw)
+                records.append(_record(href, cache_hash, offset, length))
+                offset += length
+            f.flush()
+            self._storage._fsync(f)
+        self._write_index(data_name, records)
+        logger.debug("Compacted packed item cache %r: %d entries",
+                     self._folder, len(records))
+        self.refresh()
+        self._clean_data_files()
+
+    def _clean_data_files(self) -> None:
+        for name in self._list_data_files():
+            if name == self._data_name:
+                continue
+            # Race: Another process might have deleted the file or (on
+            # Windows) still have it mapped.
+            with contextlib.suppress(OSError):
+                os.remove(os.path.join(self._folder, name))
+        self._storage._sync_directory(self._folder)
+
+    def _list_data_files(self) -> Iterator[str]:
+        try:
+            entries = list(os.scandir(self._folder))
+        except FileNotFoundError:
+            return
+        for entry in entries:
+            if entry.name.startswith(DATA_PREFIX):
+                yield entry.name
@@ -0,0 +1,359 @@
+# This file is part of Radicale - CalDAV and CardDAV server
+#
+# This library is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Radicale.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Append-only change log of a collection for sync-collection.
+
+The log is stored as ``.Radicale.changelog`` in the sync-token cache folder
+of the collection. Every line is a JSON array:
+
+``["H", version, id, floor]``
+    Header. ``id`` is random and changes whenever the log is recreated,
+    sync tokens with sequence numbers below ``floor`` are expired.
+``["C", seq, href, etag, time]``
+    Change of ``href``, ``etag`` is empty for deleted items.
+``["M", mtime_ns]``
+    Checkpoint: all changes up to the modification time ``mtime_ns`` of the
+    collection folder are logged.
+
+A sync token is the id followed by the sequence number of the last change.
+Changes made by other means than Radicale are detected by the modification
+time of the collection folder and added to the log by comparing it with all
+items.
+
+"""
+
+import binascii
+import bisect
+import contextlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import (Dict, Iterable, Iterator, List, NamedTuple, Optional,
+                    Sequence, Set, Tuple)
+
+import radicale.item as radicale_item
+from radicale.log import logger
+from radicale.storage.multifilesystem.base import CollectionBase, StorageBase
+from radicale.storage.multifilesystem.get import CollectionPartGet
+from radicale.storage.multifilesystem.history import CollectionPartHistory
+from radicale.storage.multifilesystem.lock import CollectionPartLock
+
+LOG_NAME = ".Radicale.changelog"
+LOG_VERSION = 1
+
+# Rewrite the log if it has more records than this and more than half of
+# them are superseded or expired
+COMPACT_MIN_RECORDS = 1024
+
+# Number of change logs kept in memory per process
+MAX_CACHED_LOGS = 128
+
+
+class ChangeRecord(NamedTuple):
+    seq: int
+    href: str
+    etag: str
+    time: int
+
+
+class ChangeLog:
+    """Change log file at ``path``, read incrementally."""
+
+    lock: threading.Lock
+    log_id: str
+    floor: int
+    seq: int
+    checkpoint: Optional[int]
+
+    def __init__(self, storage_: StorageBase, path: str) -> None:
+        self._storage = storage_
+        self.path = path
+        self.lock = threading.Lock()
+        self._reset()
+
+    def _reset(self) -> None:
+        self.log_id = ""
+        self.floor = 0
+        self.seq = 0
+        self.checkpoint = None
+        self._records: List[ChangeRecord] = []
+        self._seqs: List[int] = []
+        self._current: Dict[str, ChangeRecord] = {}
+        self._file_id: Optional[Tuple[int, int]] = None
+        self._size = 0
+
+    @property
+    def exists(self) -> bool:
+        return self._file_id is not None
+
+    def etag(self, href: str) -> str:
+        record = self._current.get(href)
+        return record.etag if record else ""
+
+    def hrefs(self) -> Iterator[str]:
+        """All hrefs of present items."""
+        for href, record in self._current.items():
+            if record.etag:
+                yield href
+
+    def changes_since(self, seq: int) -> Set[str]:
+        start = bisect.bisect_right(self._seqs, seq)
+        return {record.href for record in self._records[start:]}
+
+    def _parse(self, data: bytes) -> int:
+        """Parse complete lines of ``data``, return the number of bytes
+        consumed."""
+        pos = 0
+        while True:
+            end = data.find(b"\n", pos)
+            if end < 0:
+                return pos
+            line = json.loads(data[pos:end].decode("utf-8",
+                                                   "surrogateescape"))
+            if line[0] == "H":
+                if line[1] != LOG_VERSION:
+                    raise ValueError("Unsupported version %r" % line[1])
+                self.log_id, self.floor = line[2], line[3]
+                self.seq = max(self.seq, self.floor)
+            elif line[0] == "C":
+                record = ChangeRecord(*line[1:])
+                self._records.append(record)
+                self._seqs.append(record.seq)
+                self._current[record.href] = record
+                self.seq = max(self.seq, record.seq)
+            elif line[0] == "M":
+                self.checkpoint = line[1]
+            else:
+                raise ValueError("Unknown record type %r" % line[0])
+            pos = end + 1
+
+    def refresh(self) -> None:
+        """Read records appended (or a new log written) by others."""
+        try:
+            f = open(self.path, "rb")
+        except FileNotFoundError:
+            self._reset()
+            return
+        with f:
+            st = os.fstat(f.fileno())
+            file_id = (st.st_dev, st.st_ino)
+            if file_id == self._file_id:
+                if st.st_size > self._size:
+                    f.seek(self._size)
+                    self._size += self._parse(f.read())
+                return
+            data = f.read()
+        self._reset()
+        try:
+            size = self._parse(data)
+            if not self.log_id:
+                raise ValueError("Missing header")
+        except (ValueError, TypeError, IndexError) as e:
+            logger.warning("Ignoring invalid change log %r: %s", self.path, e)
+            self._reset()
+            return
+        self._file_id = file_id
+        self._size = size
+
+    @staticmethod
+    def _line(*values) -> bytes:
+        return json.dumps(values, separators=(",", ":")).encode(
+            "utf-8", "surrogateescape") + b"\n"
+
+    def _change_lines(self, changes: Iterable[Tuple[str, str]]
+                      ) -> Iterator[bytes]:
+        now = int(time.time())
+        seq = self.seq
+        for href, etag in changes:
+            seq += 1
+            yield self._line("C", seq, href, etag, now)
+
+    def append(self, changes: Sequence[Tuple[str, str]],
+               checkpoint: Optional[int] = None) -> None:
+        """Append ``(href, etag)`` changes and optionally a checkpoint."""
+        if not changes and (checkpoint is None or
+                            checkpoint == self.checkpoint):
+            return
+        data = b"".join(self._change_lines(changes))
+        if checkpoint is not None:
+            data += self._line("M", checkpoint)
+        with open(self.path, "r+b") as f:
+            # Drop a partially written tail
+            f.truncate(self._size)
+            f.seek(self._size)
+            f.write(data)
+            f.flush()
+            self._storage._fsync(f)
+        self._size += self._parse(data)
+
+    def create(self, changes: Sequence[Tuple[str, str]],
+               checkpoint: int) -> None:
+        """Replace the log by a new one, invalidating all sync tokens."""
+        self._reset()
+        self._write([self._line("H", LOG_VERSION, binascii.hexlify(
+            os.urandom(16)).decode("ascii"), 0)] +
+            list(self._change_lines(changes)) +
+            [self._line("M", checkpoint)])
+
+    def compact(self, max_age: int) -> None:
+        """Drop superseded records and deleted items older than
+        ``max_age``, keeping the id and sequence numbers."""
+        if (len(self._records) <= COMPACT_MIN_RECORDS or
+                len(self._records) <= 2 * len(self._current)):
+            return
+        age_limit = time.time() - max_age
+        floor = self.floor
+        lines = []
+        for record in sorted(self._current.values()):
+            if not record.etag and record.time < age_limit:
+                floor = max(floor, record.seq)
+                continue
+            lines.append(self._line("C", *record))
+        lines.insert(0, self._line("H", LOG_VERSION, self.log_id, floor))
+        if self.checkpoint is not None:
+            lines.append(self._line("M", self.checkpoint))
+        self._write(lines)
+        logger.debug("Compacted change log %r: %d records",
+                     self.path, len(lines) - 1)
+
+    def _write(self, lines: List[bytes]) -> None:
+        folder = os.path.dirname(self.path)
+        tmp_path = os.path.join(folder, ".Radicale.tmp-changelog-" +
+                                binascii.hexlify(os.urandom(8)).decode("ascii"))
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(b"".join(lines))
+                f.flush()
+                self._storage._fsync(f)
+            os.replace(tmp_path, self.path)
+        finally:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(tmp_path)
+        self._storage._sync_directory(folder)
+        self.refresh()
+
+
+_logs: "OrderedDict[str, ChangeLog]" = OrderedDict()
+_logs_lock = threading.Lock()
+
+
+def _get_change_log(storage_: StorageBase, path: str) -> ChangeLog:
+    with _logs_lock:
+        log = _logs.get(path)
+        if log is None or log._storage is not storage_:
+            log = _logs[path] = ChangeLog(storage_, path)
+        _logs.move_to_end(path)
+        while len(_logs) > MAX_CACHED_LOGS:
+            _logs.popitem(last=False)
+        return log
+
+
+class CollectionPartChangeLog(CollectionPartGet, CollectionPartHistory,
+                              CollectionPartLock, CollectionBase):
+
+    def _change_log(self) -> ChangeLog:
+        token_folder = self._storage._get_collection_cache_subfolder(
+            self._filesystem_path, ".Radicale.cache", "sync-token")
+        return _get_change_log(self._storage,
+                               os.path.join(token_folder, LOG_NAME))
+
+    def _change_log_checkpoint(self) -> int:
+        return os.stat(self._filesystem_path).st_mtime_ns
+
+    def _change_log_is_current(self) -> bool:
+        """The change log contains all changes of the collection.
+
+        Must be called before changing the collection.
+
+        """
+        log = self._change_log()
+        with log.lock:
+            log.refresh()
+            return (log.exists and
+                    log.checkpoint == self._change_log_checkpoint())
+
+    def _log_changes(self, changes: Iterable[Tuple[str, Optional[
+            "radicale_item.Item"]]], was_current: bool) -> None:
+        """Append the changes of items to an existing change log.
+
+        ``was_current`` is the result of ``_change_log_is_current`` before
+        the change. Otherwise the log is checked against all items on the
+        next synchronization.
+
+        """
+        log = self._change_log()
+        with log.lock:
+            log.refresh()
+            if not log.exists:
+                return
+            try:
+                log.append([(href, item.etag if item else "")
+                            for href, item in changes],
+                           self._change_log_checkpoint() if was_current
+                           else None)
+                log.compact(self._max_sync_token_age)
+            except OSError as e:
+                logger.warning("Failed to update change log of collection "
+                               "%r: %s", self.path, e)
+
+    def _reconcile_change_log(self, log: ChangeLog) -> None:
+        """Log the differences between the change log and the items."""
+        self._storage._makedirs_synced(os.path.dirname(log.path))
+        checkpoint = self._change_log_checkpoint()
+        if log.exists and log.checkpoint == checkpoint:
+            return
+        changes = []
+        present = set()
+        for item in self.get_all():
+            assert item.href
+            present.add(item.href)
+            if log.etag(item.href) != item.etag:
+                changes.append((item.href, item.etag))
+        for href in list(log.hrefs()):
+            if href not in present:
+                changes.append((href, ""))
+        if self._storage._debug_cache_actions is True:
+            logger.debug("Change log of %r: %d changes by other means",
+                         self.path, len(changes))
+        if log.exists:
+            log.append(changes, checkpoint)
+        else:
+            log.create(changes, checkpoint)
+
+    def _sync_change_log(self, old_token_name: str
+                         ) -> Tuple[str, Iterable[str]]:
+        log = self._change_log()
+        with log.lock:
+            log.refresh()
+            if not log.exists or log.checkpoint != (
+                    self._change_log_checkpoint()):
+                with self._acquire_cache_lock("sync-token"):
+                    log.refresh()
+                    self._reconcile_change_log(log)
+            token_name = "%s%032x" % (log.log_id, log.seq)
+            token = "http://radicale.org/ns/sync/%s" % token_name
+            if not old_token_name:
+                return token, list(log.hrefs())
+            if token_name == old_token_name:
+                # Nothing changed
+                return token, ()
+            old_seq = int(old_token_name[32:], 16)
+            if (old_token_name[:32] != log.log_id or old_seq > log.seq or
+                    old_seq < log.floor):
+                raise ValueError("Token not found: %r" % old_token_name)
+            return token, sorted(log.changes_since(old_seq))
@@ -25,6 +25,7 @@ import radicale.item as radicale_item
 from radicale import pathutils
 from radicale.log import logger
 from radicale.storage import multifilesystem
+from radicale.storage.events import CollectionEvent
 from radicale.storage.multifilesystem.base import StorageBase
 
 
@@ -79,6 +80,7 @@ class StoragePartCreateCollection(StorageBase):
 
         replaced_items: Dict[str, radicale_item.Item] = {}
         new_item_hrefs: List[str] = []
+        replaced = False
 
         # Create a temporary directory with an unsafe name
         try:
@@ -91,7 +93,8 @@ class StoragePartCreateCollection(StorageBase):
                     cast(multifilesystem.Storage, self),
                     pathutils.unstrip_path(sane_path, True),
                     filesystem_path=tmp_filesystem_path)
-                col.set_meta(props)
+                # The events are emitted after the collection is in place
+                col._write_meta(props)
                 if items is not None:
                     if props.get("tag") == "VCALENDAR":
                         col._upload_all_nonatomic(items, suffix=".ics")
@@ -99,6 +102,7 @@ class StoragePartCreateCollection(StorageBase):
                         col._upload_all_nonatomic(items, suffix=".vcf")
 
                 if os.path.lexists(filesystem_path):
+                    replaced = True
                     replaced_items, new_item_hrefs = self._discover_existing_items_pre_overwrite(
                         tmp_collection=col,
                         dst_path=sane_path)
@@ -112,7 +116,9 @@ class StoragePartCreateCollection(StorageBase):
             raise ValueError("Failed to create collection %r as %r %s" %
                              (href, filesystem_path, e)) from e
 
-        # TODO: Return new-old pairs and just-new items (new vs updated)
-        return self._collection_class(
+        collection = self._collection_class(
             cast(multifilesystem.Storage, self),
-            pathutils.unstrip_path(sane_path, True)), replaced_items, new_item_hrefs
+            pathutils.unstrip_path(sane_path, True))
+        self.events.emit(CollectionEvent(sane_path, props, replaced))
+        # TODO: Return new-old pairs and just-new items (new vs updated)
+        return collection, replaced_items, new_item_hrefs
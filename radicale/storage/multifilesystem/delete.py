@@ -22,11 +22,18 @@ from tempfile import TemporaryDirectory
 from typing import Optional
 
 from radicale import pathutils, storage
+from radicale.storage.events import DeleteEvent
 from radicale.storage.multifilesystem.base import CollectionBase
+from radicale.storage.multifilesystem.cache import CollectionPartCache
+from radicale.storage.multifilesystem.changelog import CollectionPartChangeLog
 from radicale.storage.multifilesystem.history import CollectionPartHistory
+from radicale.storage.multifilesystem.item_index import CollectionPartItemIndex
+from radicale.storage.multifilesystem.manifest import CollectionPartManifest
 
 
-class CollectionPartDelete(CollectionPartHistory, CollectionBase):
+class CollectionPartDelete(CollectionPartManifest, CollectionPartChangeLog,
+                           CollectionPartItemIndex, CollectionPartCache,
+                           CollectionPartHistory, CollectionBase):
 
     def delete(self, href: Optional[str] = None) -> None:
         if href is None:
@@ -42,6 +49,7 @@ class CollectionPartDelete(CollectionPartHistory, CollectionBase):
                     self._storage._sync_directory(parent_dir)
             else:
                 self._storage._sync_directory(parent_dir)
+            self._storage.events.emit(DeleteEvent(self.path, None, None))
         else:
             # Delete an item
             if not pathutils.is_safe_filesystem_path_component(href):
@@ -49,14 +57,41 @@ class CollectionPartDelete(CollectionPartHistory, CollectionBase):
             path = pathutils.path_to_filesystem(self._filesystem_path, href, self._is_collision_free)
             if not os.path.isfile(path):
                 raise storage.ComponentNotFoundError(href)
+            manifest = None
+            if self._storage._use_collection_manifest is True:
+                manifest = self._read_manifest()
+            change_log_is_current = (
+                self._storage._use_sync_change_log is True and
+                self._change_log_is_current())
+            item_index = None
+            if self._storage._use_item_index is True:
+                item_index = self._read_item_index()
+            old_item = None
+            if manifest is not None or self._storage.events.active:
+                old_item = self._get(href, verify_href=False)
             os.remove(path)
             self._storage._sync_directory(os.path.dirname(path))
+            if self._storage._item_memory_cache is not None:
+                self._storage._item_memory_cache.invalidate(path)
+            if manifest is not None:
+                if old_item is not None:
+                    self._update_manifest(manifest,
+                                          removed=[(href, old_item.etag)])
+                else:
+                    self._invalidate_manifest()
+            if item_index is not None:
+                self._update_item_index(item_index, removed=[href])
             # Track the change
             self._update_history_etag(href, None)
             self._clean_history()
+            if self._storage._use_sync_change_log is True:
+                self._log_changes([(href, None)], change_log_is_current)
             # Remove item from cache
+            if self._storage._use_packed_item_cache is True:
+                self._item_cache_pack().remove([href])
             cache_folder = self._storage._get_collection_cache_subfolder(os.path.dirname(path), ".Radicale.cache", "item")
             cache_file = os.path.join(cache_folder, os.path.basename(path))
             if os.path.isfile(cache_file):
                 os.remove(cache_file)
                 self._storage._sync_directory(cache_folder)
+            self._storage.events.emit(DeleteEvent(self.path, href, old_item))
@@ -86,9 +86,12 @@ class StoragePartDiscover(StorageBase):
         if depth == "0":
             return
 
-        for href in collection._list():
-            with child_context_manager(sane_path, href):
-                item = collection._get(href)
+        for entry in collection._scan():
+            with child_context_manager(sane_path, entry.name):
+                # We don't need to check for collisions, because the file
+                # names are from os.scandir.
+                item = collection._get(entry.name, verify_href=False,
+                                       entry=entry)
                 if item is not None:
                     yield item
 
@@ -116,3 +119,20 @@ class StoragePartDiscover(StorageBase):
             with child_context_manager(sane_child_path, None):
                 yield self._collection_class(
                     cast(multifilesystem.Storage, self), child_path)
+
+    def _collection_paths(self) -> Iterator[str]:
+        """Paths of all collections, parents first."""
+        root_folder = self._get_collection_root_folder()
+        remaining_sane_paths = [""]
+        while remaining_sane_paths:
+            sane_path = remaining_sane_paths.pop(0)
+            yield sane_path
+            filesystem_path = pathutils.path_to_filesystem(
+                root_folder, sane_path, self._is_collision_free)
+            for entry in sorted(os.scandir(filesystem_path),
+                                key=lambda entry: entry.name):
+                if (entry.is_dir() and
+                        pathutils.is_safe_filesystem_path_component(
+                            entry.name)):
+                    remaining_sane_paths.append(
+                        posixpath.join(sane_path, entry.name))
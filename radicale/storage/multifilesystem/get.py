@@ -17,19 +17,39 @@
 # You should have received a copy of the GNU General Public License
 # along with Radicale.  If not, see <http://www.gnu.org/licenses/>.
 
+import collections
 import os
-import sys
+import stat
 import time
-from typing import Iterable, Iterator, Optional, Tuple
+from concurrent.futures import Future
+from typing import Deque, Dict, Iterable, Iterator, NamedTuple, Optional, Tuple
 
 import radicale.item as radicale_item
-from radicale import pathutils
+from radicale import pathutils, utils
+from radicale.item import scanner as radicale_scanner
 from radicale.log import logger
 from radicale.storage import multifilesystem
 from radicale.storage.multifilesystem.base import CollectionBase
-from radicale.storage.multifilesystem.cache import CollectionPartCache
+from radicale.storage.multifilesystem.cache import (CacheContent,
+                                                    CollectionPartCache)
 from radicale.storage.multifilesystem.lock import CollectionPartLock
 
+# Number of items that are read in advance per prefetch worker, limits the
+# memory used by prefetched items
+PREFETCH_ITEMS_PER_WORKER = 4
+
+
+class _Prefetched(NamedTuple):
+    """Item file and item cache file read in advance."""
+
+    st: os.stat_result
+    # ``False`` if the files weren't read (e.g. item in the memory cache)
+    read: bool
+    # ``None`` with ``use_mtime_and_size_for_item_cache``
+    raw_text: Optional[bytes]
+    # ``None`` if the item cache file doesn't exist
+    cache_data: Optional[bytes]
+
 
 class CollectionPartGet(CollectionPartCache, CollectionPartLock,
                         CollectionBase):
@@ -41,7 +61,13 @@ class CollectionPartGet(CollectionPartCache, CollectionPartLock,
         super().__init__(storage_, path, filesystem_path)
         self._item_cache_cleaned = False
 
-    def _list(self) -> Iterator[str]:
+    def _scan(self) -> Iterator["os.DirEntry[str]"]:
+        """Directory entries of the item files.
+
+        The result of ``DirEntry.stat()`` is cached, it's reused for the
+        size limit, the validation of the cache and Last-Modified.
+
+        """
         for entry in os.scandir(self._filesystem_path):
             if not entry.is_file():
                 continue
@@ -50,9 +76,28 @@ class CollectionPartGet(CollectionPartCache, CollectionPartLock,
                 if not href.startswith(".Radicale"):
                     logger.debug("Skipping item %r in %r", href, self.path)
                 continue
-            yield href
+            yield entry
 
-    def _get(self, href: str, verify_href: bool = True
+    def _list(self) -> Iterator[str]:
+        for entry in self._scan():
+            yield entry.name
+
+    def _check_size(self, entry: "os.DirEntry[str]") -> bool:
+        """Check the size of the item file against the limit, ``False`` if
+        the file is too large or doesn't exist anymore."""
+        try:
+            size = entry.stat().st_size
+        except FileNotFoundError:
+            return False
+        limit = self._storage._max_resource_size
+        if size > limit:
+            logger.warning("file skipped because size exceeds limit %s > %s: %r", utils.format_unit(size, binary=True), utils.format_unit(limit, binary=True), entry.path)
+            return False
+        return True
+
+    def _get(self, href: str, verify_href: bool = True,
+             entry: Optional["os.DirEntry[str]"] = None,
+             prefetched: Optional[_Prefetched] = None
              ) -> Optional[radicale_item.Item]:
         if verify_href:
             try:
@@ -68,41 +113,56 @@ class CollectionPartGet(CollectionPartCache, CollectionPartLock,
                 return None
         else:
             path = os.path.join(self._filesystem_path, href)
-        try:
-            if self._storage._use_mtime_and_size_for_item_cache is True:
-                # try to avoid "open"
-                if not os.path.isfile(path):
-                    if not os.path.exists(path):
-                        raise FileNotFoundError(path)
-                    if os.path.isdir(path):
-                        raise IsADirectoryError(path)
-                if not os.access(path, os.R_OK):
-                    raise PermissionError(path)
-            else:
+        # The result of the only ``stat`` call is used for the memory cache,
+        # the item cache and Last-Modified.
+        if prefetched is not None:
+            st = prefetched.st
+        else:
+            try:
+                st = entry.stat() if entry is not None else os.stat(path)
+            except FileNotFoundError:
+                return None
+        if not stat.S_ISREG(st.st_mode):
+            return None
+        memory_cache = self._storage._item_memory_cache
+        if memory_cache is not None:
+            cache_content = memory_cache.get(path, st.st_mtime_ns, st.st_size)
+            if cache_content is not None:
+                if self._storage._debug_cache_actions is True:
+                    logger.debug("Item memory cache hit for: %r", path)
+                return self._item_from_cache(href, st.st_mtime, cache_content)
+        if prefetched is not None and not prefetched.read:
+            # The item was in the memory cache, when it was prefetched
+            prefetched = None
+        raw_text: Optional[bytes] = None
+        if prefetched is not None:
+            raw_text = prefetched.raw_text
+        elif self._storage._use_mtime_and_size_for_item_cache is not True:
+            try:
                 with open(path, "rb") as f:
                     # early read of the content
                     if self._storage._debug_cache_actions is True:
                         logger.debug("Item cache early read: %r", path)
                     raw_text = f.read()
-        except (FileNotFoundError, IsADirectoryError):
-            return None
-        except PermissionError:
-            # Windows raises ``PermissionError`` when ``path`` is a directory
-            if (sys.platform == "win32" and
-                    os.path.isdir(path) and os.access(path, os.R_OK)):
+            except (FileNotFoundError, IsADirectoryError):
                 return None
-            raise
         # The hash of the component in the file system. This is used to check,
         # if the entry in the cache is still valid.
-        if self._storage._use_mtime_and_size_for_item_cache is True:
-            cache_hash = self._item_cache_mtime_and_size(os.stat(path).st_size, os.stat(path).st_mtime_ns)
+        if raw_text is None:
+            cache_hash = self._item_cache_mtime_and_size(st.st_size, st.st_mtime_ns)
             if self._storage._debug_cache_actions is True:
                 logger.debug("Item cache check  for: %r with mtime and size %r", path, cache_hash)
         else:
             cache_hash = self._item_cache_hash(raw_text)
             if self._storage._debug_cache_actions is True:
                 logger.debug("Item cache check  for: %r with hash %r", path, cache_hash)
-        cache_content = self._load_item_cache(href, cache_hash)
+        if prefetched is None or self._storage._use_packed_item_cache is True:
+            cache_content = self._load_item_cache(href, cache_hash)
+        elif prefetched.cache_data is None:
+            cache_content = None
+        else:
+            cache_content = self._load_item_cache(href, cache_hash,
+                                                  prefetched.cache_data)
         if cache_content is None:
             if self._storage._debug_cache_actions is True:
                 logger.debug("Item cache miss   for: %r", path)
@@ -110,24 +170,31 @@ class CollectionPartGet(CollectionPartCache, CollectionPartLock,
                 # Lock the item cache to prevent multiple processes from
                 # generating the same data in parallel.
                 # This improves the performance for multiple requests.
-                if self._storage._lock.locked == "r":
+                if not self._storage._write_locked:
                     # Check if another process created the file in the meantime
                     cache_content = self._load_item_cache(href, cache_hash)
                 if cache_content is None:
-                    if self._storage._use_mtime_and_size_for_item_cache is True:
+                    if raw_text is None:
                         # late read of the content
                         if self._storage._debug_cache_actions is True:
                             logger.debug("Item cache late read : %r", path)
-                        with open(path, "rb") as f:
-                            raw_text = f.read()
+                        try:
+                            with open(path, "rb") as f:
+                                raw_text = f.read()
+                        except FileNotFoundError:
+                            return None
                     try:
-                        vobject_items = radicale_item.read_components(
-                            raw_text.decode(self._encoding))
-                        radicale_item.check_and_sanitize_items(
-                            vobject_items, tag=self.tag)
-                        vobject_item, = vobject_items
-                        temp_item = radicale_item.Item(
-                            collection=self, vobject_item=vobject_item)
+                        text = raw_text.decode(self._encoding)
+                        temp_item = radicale_scanner.scan_item(
+                            text, self.tag, collection=self)
+                        if temp_item is None:
+                            vobject_items = radicale_item.read_components(
+                                text)
+                            radicale_item.check_and_sanitize_items(
+                                vobject_items, tag=self.tag)
+                            vobject_item, = vobject_items
+                            temp_item = radicale_item.Item(
+                                collection=self, vobject_item=vobject_item)
                         if self._storage._debug_cache_actions is True:
                             logger.debug("Item cache store  for: %r", path)
                         cache_content = self._store_item_cache(
@@ -147,9 +214,82 @@ class CollectionPartGet(CollectionPartCache, CollectionPartLock,
         else:
             if self._storage._debug_cache_actions is True:
                 logger.debug("Item cache hit    for: %r", path)
+        if memory_cache is not None:
+            memory_cache.put(path, st.st_mtime_ns, st.st_size, cache_content)
+        return self._item_from_cache(href, st.st_mtime, cache_content)
+
+    def _prefetch_item(self, entry: "os.DirEntry[str]") -> Optional[_Prefetched]:
+        """Read the item file and the item cache file of ``entry``.
+
+        Runs in the prefetch threads. Returns ``None`` if the file can't be
+        accessed, the item is loaded as usual in that case.
+
+        """
+        try:
+            st = entry.stat()
+        except OSError:
+            return None
+        memory_cache = self._storage._item_memory_cache
+        if (not stat.S_ISREG(st.st_mode) or
+                st.st_size > self._storage._max_resource_size or
+                memory_cache is not None and memory_cache.get(
+                    entry.path, st.st_mtime_ns, st.st_size) is not None):
+            return _Prefetched(st, False, None, None)
+        raw_text: Optional[bytes] = None
+        if self._storage._use_mtime_and_size_for_item_cache is not True:
+            try:
+                with open(entry.path, "rb") as f:
+                    raw_text = f.read()
+            except OSError:
+                return None
+        cache_data: Optional[bytes] = None
+        if self._storage._use_packed_item_cache is not True:
+            cache_data = self._read_item_cache(entry.name)
+        return _Prefetched(st, True, raw_text, cache_data)
+
+    def _prefetch(self, entries: Iterable[
+                      Tuple[str, Optional["os.DirEntry[str]"]]]
+                  ) -> Iterator[Tuple[str, Optional["os.DirEntry[str]"],
+                                      Optional[_Prefetched]]]:
+        """Read the files of ``entries`` in advance in the prefetch threads.
+
+        ``entries`` are pairs of href and directory entry (``None`` for
+        missing items). The results are returned in the same order, the
+        number of items read in advance is limited.
+
+        """
+        executor = self._storage._item_prefetch_executor
+        if executor is None:
+            for href, entry in entries:
+                yield href, entry, None
+            return
+        window = (self._storage._item_prefetch_workers *
+                  PREFETCH_ITEMS_PER_WORKER)
+        pending: Deque[Tuple[str, Optional["os.DirEntry[str]"],
+                             Optional["Future[Optional[_Prefetched]]"]]] = (
+            collections.deque())
+        try:
+            for href, entry in entries:
+                future = None
+                if entry is not None:
+                    future = executor.submit(self._prefetch_item, entry)
+                pending.append((href, entry, future))
+                while len(pending) >= window:
+                    href, entry, future = pending.popleft()
+                    yield href, entry, future.result() if future else None
+            while pending:
+                href, entry, future = pending.popleft()
+                yield href, entry, future.result() if future else None
+        finally:
+            # The consumer stopped early
+            for _, _, future in pending:
+                if future is not None:
+                    future.cancel()
+
+    def _item_from_cache(self, href: str, mtime: float,
+                         cache_content: CacheContent) -> radicale_item.Item:
         last_modified = time.strftime(
-            "%a, %d %b %Y %H:%M:%S GMT",
-            time.gmtime(os.path.getmtime(path)))
+            "%a, %d %b %Y %H:%M:%S GMT", time.gmtime(mtime))
         # Don't keep reference to ``vobject_item``, because it requires a lot
         # of memory.
         return radicale_item.Item(
@@ -162,28 +302,40 @@ class CollectionPartGet(CollectionPartCache, CollectionPartLock,
     def get_multi(self, hrefs: Iterable[str]
                   ) -> Iterator[Tuple[str, Optional[radicale_item.Item]]]:
         # It's faster to check for file name collisions here, because
-        # we only need to call os.listdir once.
-        files = None
-        for href in hrefs:
-            if files is None:
-                # List dir after hrefs returned one item, the iterator may be
-                # empty and the for-loop is never executed.
-                files = os.listdir(self._filesystem_path)
-            path = os.path.join(self._filesystem_path, href)
-            if (not pathutils.is_safe_filesystem_path_component(href) or
-                    href not in files and os.path.lexists(path)):
+        # we only need to call os.scandir once.
+        def hrefs_with_entries() -> Iterator[Tuple[str, Optional["os.DirEntry[str]"]]]:
+            entries: Optional[Dict[str, "os.DirEntry[str]"]] = None
+            for href in hrefs:
+                if entries is None:
+                    # Scan dir after hrefs returned one item, the iterator may
+                    # be empty and the for-loop is never executed.
+                    entries = {entry.name: entry for entry in
+                               os.scandir(self._filesystem_path)}
+                if not pathutils.is_safe_filesystem_path_component(href):
+                    yield href, None
+                else:
+                    yield href, entries.get(href)
+
+        for href, entry, prefetched in self._prefetch(hrefs_with_entries()):
+            if entry is None:
+                # Missing files and names that only match an existing file
+                # because of case-insensitivity or short names
                 logger.debug("Can't translate name safely to filesystem: %r",
                              href)
                 yield (href, None)
-            else:
-                if pathutils.file_check_size(path, self._storage._max_resource_size):
-                    yield (href, self._get(href, verify_href=False))
+            elif self._check_size(entry):
+                yield (href, self._get(href, verify_href=False, entry=entry,
+                                       prefetched=prefetched))
 
     def get_all(self) -> Iterator[radicale_item.Item]:
-        for href in self._list():
-            # We don't need to check for collisions, because the file names
-            # are from os.listdir.
-            item = self._get(href, verify_href=False)
+        # We don't need to check for collisions, because the file names
+        # are from os.scandir.
+        for href, entry, prefetched in self._prefetch(
+                (entry.name, entry) for entry in self._scan()):
+            assert entry is not None
+            if not self._check_size(entry):
+                continue
+            item = self._get(href, verify_href=False, entry=entry,
+                             prefetched=prefetched)
             if item is not None:
-                if pathutils.file_check_size(os.path.join(self._filesystem_path, href), self._storage._max_resource_size):
-                    yield item
+                yield item
@@ -20,18 +20,26 @@ import binascii
 import contextlib
 import os
 import pickle
-from typing import BinaryIO, Optional, cast
+import time
+from typing import (BinaryIO, Dict, Iterable, Iterator, List, Optional, Tuple,
+                    cast)
 
 import radicale.item as radicale_item
 from radicale import pathutils
 from radicale.log import logger
 from radicale.storage import multifilesystem
+from radicale.storage.multifilesystem import cache_format
 from radicale.storage.multifilesystem.base import CollectionBase
+from radicale.storage.multifilesystem.history_store import (STORE_NAME,
+                                                            HistoryEntry,
+                                                            HistoryStore)
+from radicale.storage.multifilesystem.lock import CollectionPartLock
 
 
-class CollectionPartHistory(CollectionBase):
+class CollectionPartHistory(CollectionPartLock, CollectionBase):
 
     _max_sync_token_age: int
+    _history_store: Optional[HistoryStore] = None
 
     def __init__(self, storage_: "multifilesystem.Storage", path: str,
                  filesystem_path: Optional[str] = None) -> None:
@@ -47,10 +55,12 @@ class CollectionPartHistory(CollectionBase):
         string for deleted items) and a history etag, which is a hash over
         the previous history etag and the etag separated by "/".
         """
+        if self._storage._use_history_store is True:
+            return self._update_history_etags([(href, item)])[href]
         history_folder = self._storage._get_collection_cache_subfolder(self._filesystem_path, ".Radicale.cache", "history")
         try:
             with open(os.path.join(history_folder, href), "rb") as f:
-                cache_etag, history_etag = pickle.load(f)
+                cache_etag, history_etag = cache_format.load_history(f.read())
         except (FileNotFoundError, pickle.UnpicklingError, ValueError) as e:
             if isinstance(e, (pickle.UnpicklingError, ValueError)):
                 logger.warning(
@@ -69,9 +79,105 @@ class CollectionPartHistory(CollectionBase):
             with contextlib.suppress(PermissionError), self._atomic_write(
                     os.path.join(history_folder, href), "wb") as fo:
                 fb = cast(BinaryIO, fo)
-                pickle.dump([etag, history_etag], fb)
+                if self._storage._use_binary_cache is True:
+                    fb.write(cache_format.dump_history(etag, history_etag))
+                else:
+                    pickle.dump([etag, history_etag], fb)
         return history_etag
 
+    def _update_history_etags(
+            self, items: Iterable[Tuple[str, Optional[radicale_item.Item]]],
+            deleted: bool = False) -> Dict[str, str]:
+        """Batch version of ``_update_history_etag``.
+
+        With ``deleted`` the history etags of all other items in the
+        history cache are updated as deleted too.
+
+        """
+        if self._storage._use_history_store is not True:
+            state = {href: self._update_history_etag(href, item)
+                     for href, item in items}
+            if deleted:
+                for href in self._get_deleted_history_hrefs():
+                    if href not in state:
+                        state[href] = self._update_history_etag(href, None)
+            return state
+        state = {}
+        changes: List[Tuple[str, HistoryEntry]] = []
+        change_time = int(time.time())
+
+        def update(href: str, item: Optional[radicale_item.Item]) -> None:
+            entry = store.get(href)
+            etag = item.etag if item else ""
+            if entry is None:
+                # Initialize with random data to prevent collisions with
+                # cleaned expired items.
+                history_etag = binascii.hexlify(os.urandom(16)).decode(
+                    "ascii")
+            elif entry.etag == etag:
+                state[href] = entry.history_etag
+                return
+            else:
+                history_etag = entry.history_etag
+            history_etag = radicale_item.get_etag(
+                history_etag + "/" + etag).strip("\"")
+            changes.append((href, HistoryEntry(etag, history_etag,
+                                               change_time)))
+            state[href] = history_etag
+
+        with self._acquire_cache_lock("history"):
+            store = self._load_history_store()
+            for href, item in items:
+                update(href, item)
+            if deleted:
+                for href in list(store.hrefs()):
+                    if href not in state:
+                        update(href, None)
+            store.update(changes)
+        return state
+
+    def _load_history_store(self) -> HistoryStore:
+        """The up-to-date history store, the history cache files of earlier
+        versions are imported once."""
+        history_folder = self._storage._get_collection_cache_subfolder(self._filesystem_path, ".Radicale.cache", "history")
+        if self._history_store is None:
+            self._history_store = HistoryStore(self._storage, history_folder)
+        store = self._history_store
+        store.refresh()
+        if not store.exists:
+            names = list(self._history_files(history_folder))
+            store.update(self._read_history_files(history_folder, names))
+            store.refresh()
+            for name in names:
+                # Race: Another process might have deleted the file.
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(os.path.join(history_folder, name))
+        return store
+
+    @staticmethod
+    def _history_files(history_folder: str) -> Iterator[str]:
+        with contextlib.suppress(FileNotFoundError):
+            for entry in os.scandir(history_folder):
+                if (entry.name != STORE_NAME and
+                        pathutils.is_safe_filesystem_path_component(
+                            entry.name)):
+                    yield entry.name
+
+    def _read_history_files(self, history_folder: str, names: Iterable[str]
+                            ) -> Iterator[Tuple[str, HistoryEntry]]:
+        for name in names:
+            path = os.path.join(history_folder, name)
+            try:
+                with open(path, "rb") as f:
+                    etag, history_etag = cache_format.load_history(f.read())
+                    mtime = os.fstat(f.fileno()).st_mtime
+            except (OSError, pickle.UnpicklingError, ValueError) as e:
+                logger.warning(
+                    "Failed to load history cache entry %r in %r: %s",
+                    name, self.path, e, exc_info=True)
+                continue
+            yield name, HistoryEntry(etag, history_etag, int(mtime))
+
     def _get_deleted_history_hrefs(self):
         """Returns the hrefs of all deleted items that are still in the
         history cache."""
@@ -87,6 +193,10 @@ class CollectionPartHistory(CollectionBase):
 
     def _clean_history(self):
         # Delete all expired history entries of deleted items.
+        if self._storage._use_history_store is True:
+            with self._acquire_cache_lock("history"):
+                self._load_history_store().clean(self._max_sync_token_age)
+            return
         history_folder = self._storage._get_collection_cache_subfolder(self._filesystem_path, ".Radicale.cache", "history")
         self._clean_cache(history_folder, self._get_deleted_history_hrefs(),
                           max_age=self._max_sync_token_age)
@@ -0,0 +1,242 @@
+# This file is part of Radicale - CalDAV and CardDAV server
+#
+# This library is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Radicale.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+History cache of a collection in a single file.
+
+Instead of one file per item, the history cache of a collection is stored
+as ``.Radicale.history`` in the history cache folder. The file starts with a
+magic, followed by blocks that are only appended. Every block carries its
+length and a CRC32 and contains the records of one batch update, so a batch
+is applied completely or (if the write was interrupted) not at all.
+
+A record maps an href to the etag of the item (empty for deleted items), its
+history etag and the time of the change. Later records supersede earlier
+ones for the same href.
+
+When most records are superseded or entries of deleted items expired,
+``compact`` atomically replaces the file with one that only contains the
+current entries. The name starts with a dot and can't collide with hrefs.
+
+"""
+
+import binascii
+import contextlib
+import os
+import struct
+import time
+import zlib
+from typing import (Callable, Dict, Iterable, Iterator, NamedTuple, Optional,
+                    Tuple)
+
+from radicale.log import logger
+from radicale.storage.multifilesystem.base import StorageBase
+
+STORE_NAME = ".Radicale.history"
+MAGIC = b"RADICALE-HISTORY\x01"
+
+# Compact if the file has more records than this and more than half of them
+# are superseded
+COMPACT_MIN_RECORDS = 1024
+
+_BLOCK = struct.Struct("<II")  # payload length, CRC32 of payload
+_RECORD = struct.Struct("<HHHq")  # href, etag, history etag lengths, time
+
+
+class HistoryEntry(NamedTuple):
+    etag: str
+    history_etag: str
+    time: int
+
+
+def _encode(value: str) -> bytes:
+    return value.encode("utf-8", "surrogateescape")
+
+
+def _decode(value: bytes) -> str:
+    return value.decode("utf-8", "surrogateescape")
+
+
+def _record(href: str, entry: HistoryEntry) -> bytes:
+    values = [_encode(href), _encode(entry.etag),
+              _encode(entry.history_etag)]
+    return (_RECORD.pack(*(len(value) for value in values), entry.time) +
+            b"".join(values))
+
+
+def _block(records: Iterable[bytes]) -> bytes:
+    payload = b"".join(records)
+    return _BLOCK.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+class HistoryStore:
+    """History cache file in ``folder``, read incrementally."""
+
+    _storage: StorageBase
+    _folder: str
+    _entries: Dict[str, HistoryEntry]
+    _records: int
+    _file_id: Optional[Tuple[int, int]]
+    _size: int
+
+    def __init__(self, storage_: StorageBase, folder: str) -> None:
+        self._storage = storage_
+        self._folder = folder
+        self._reset()
+
+    def _reset(self) -> None:
+        self._entries = {}
+        self._records = 0
+        self._file_id = None
+        self._size = 0
+
+    @property
+    def path(self) -> str:
+        return os.path.join(self._folder, STORE_NAME)
+
+    @property
+    def exists(self) -> bool:
+        return self._file_id is not None
+
+    def _parse(self, data: bytes) -> int:
+        """Parse complete blocks of ``data``, return the number of bytes
+        consumed."""
+        pos = 0
+        while pos + _BLOCK.size <= len(data):
+            length, crc = _BLOCK.unpack_from(data, pos)
+            start = pos + _BLOCK.size
+            payload = data[start:start + length]
+            if len(payload) < length:
+                break
+            if zlib.crc32(payload) != crc:
+                logger.warning("Ignoring invalid tail of history cache %r",
+                               self.path)
+                break
+            record_pos = 0
+            while record_pos < length:
+                *lengths, change_time = _RECORD.unpack_from(payload,
+                                                            record_pos)
+                record_pos += _RECORD.size
+                values = []
+                for value_length in lengths:
+                    values.append(_decode(
+                        payload[record_pos:record_pos + value_length]))
+                    record_pos += value_length
+                href, etag, history_etag = values
+                self._entries[href] = HistoryEntry(etag, history_etag,
+                                                   change_time)
+                self._records += 1
+            pos = start + length
+        return pos
+
+    def refresh(self) -> None:
+        """Read blocks appended (or a new file written) by others."""
+        try:
+            f = open(self.path, "rb")
+        except FileNotFoundError:
+            self._reset()
+            return
+        with f:
+            st = os.fstat(f.fileno())
+            file_id = (st.st_dev, st.st_ino)
+            if file_id == self._file_id:
+                if st.st_size > self._size:
+                    f.seek(self._size)
+                    self._size += self._parse(f.read())
+                return
+            data = f.read()
+        self._reset()
+        if not data.startswith(MAGIC):
+            logger.warning("Ignoring invalid history cache %r", self.path)
+            return
+        self._file_id = file_id
+        self._size = len(MAGIC) + self._parse(data[len(MAGIC):])
+
+    def get(self, href: str) -> Optional[HistoryEntry]:
+        return self._entries.get(href)
+
+    def hrefs(self) -> Iterator[str]:
+        return iter(self._entries)
+
+    def items(self) -> Iterator[Tuple[str, HistoryEntry]]:
+        return iter(self._entries.items())
+
+    def update(self, changes: Iterable[Tuple[str, HistoryEntry]]) -> None:
+        """Append ``(href, entry)`` changes as one batch."""
+        records = [_record(href, entry) for href, entry in changes]
+        if not records:
+            return
+        self._storage._makedirs_synced(self._folder)
+        if not self.exists:
+            self._write(())
+            self.refresh()
+        block = _block(records)
+        with open(self.path, "r+b") as f:
+            # Drop a partially written tail
+            if os.fstat(f.fileno()).st_size > self._size:
+                f.truncate(self._size)
+            f.seek(self._size)
+            f.write(block)
+            f.flush()
+            self._storage._fsync(f)
+        self._size += self._parse(block)
+        if (self._records > COMPACT_MIN_RECORDS and
+                self._records > 2 * len(self._entries)):
+            self.compact()
+
+    def _write(self, entries: Iterable[Tuple[str, HistoryEntry]]) -> None:
+        tmp_path = os.path.join(
+            self._folder, ".Radicale.tmp-history-" +
+            binascii.hexlify(os.urandom(8)).decode("ascii"))
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(MAGIC)
+                records = [_record(href, entry) for href, entry in entries]
+                if records:
+                    f.write(_block(records))
+                f.flush()
+                self._storage._fsync(f)
+            os.replace(tmp_path, self.path)
+        finally:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(tmp_path)
+        self._storage._sync_directory(self._folder)
+
+    def compact(self, keep: Optional[Callable[[str, HistoryEntry], bool]]
+                = None) -> None:
+        """Rewrite the file with the current entries.
+
+        ``keep`` selects the entries to retain (default: all).
+
+        """
+        self.refresh()
+        self._write((href, entry) for href, entry in self._entries.items()
+                    if keep is None or keep(href, entry))
+        logger.debug("Compacted history cache %r", self.path)
+        self.refresh()
+
+    def clean(self, max_age: int) -> None:
+        """Drop the entries of items deleted more than ``max_age`` seconds
+        ago."""
+        if not self.exists:
+            return
+        age_limit = time.time() - max_age if max_age > 0 else None
+
+        def keep(href: str, entry: HistoryEntry) -> bool:
+            return bool(entry.etag) or (
+                age_limit is not None and entry.time >= age_limit)
+
+        if not all(keep(href, entry) for href, entry in self.items()):
+            self.compact(keep)
@@ -0,0 +1,142 @@
+# This file is part of Radicale - CalDAV and CardDAV server
+#
+# This library is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Radicale.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Background execution of the storage hook.
+
+Commands are queued after the storage lock is released and run by a pool of
+worker threads. A command that is already waiting in the queue is not
+queued again, so a burst of changes results in a single run for every
+distinct command (e.g. one ``git commit`` per user).
+
+"""
+
+import atexit
+import threading
+import weakref
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
+
+from radicale.log import logger
+
+
+class HookExecutor:
+    """Bounded queue of hook commands with coalescing of pending ones."""
+
+    def __init__(self, run: Callable[[str], bool], workers: int,
+                 queue_size: int, flush_on_shutdown: bool) -> None:
+        self._run = run
+        self._workers = max(1, workers)
+        self._queue_size = max(1, queue_size)
+        self._flush_on_shutdown = flush_on_shutdown
+        self._pending: "OrderedDict[str, None]" = OrderedDict()
+        self._running = 0
+        self._closed = False
+        self._threads: List[threading.Thread] = []
+        self._cond = threading.Condition()
+        self._submitted = 0
+        self._coalesced = 0
+        self._succeeded = 0
+        self._failed = 0
+        _executors.add(self)
+
+    def submit(self, command: str) -> None:
+        """Queue ``command``, blocks while the queue is full."""
+        with self._cond:
+            if self._closed:
+                logger.warning("Storage hook executor is shut down, "
+                               "skip execution of: %r", command)
+                return
+            self._submitted += 1
+            if command in self._pending:
+                self._coalesced += 1
+                logger.debug("Storage hook already queued: %r", command)
+                return
+            while len(self._pending) >= self._queue_size:
+                self._cond.wait()
+            self._pending[command] = None
+            if len(self._threads) < min(self._workers, len(self._pending) +
+                                        self._running):
+                thread = threading.Thread(target=self._work, daemon=True,
+                                          name="storage-hook")
+                thread.start()
+                self._threads.append(thread)
+            self._cond.notify_all()
+
+    def _work(self) -> None:
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+                if not self._pending:
+                    return
+                command, _ = self._pending.popitem(last=False)
+                self._running += 1
+                self._cond.notify_all()
+            success = False
+            try:
+                success = self._run(command)
+            except Exception as e:
+                logger.error("Execution of storage hook not successful: %s",
+                             e, exc_info=True)
+            finally:
+                with self._cond:
+                    self._running -= 1
+                    if success:
+                        self._succeeded += 1
+                    else:
+                        self._failed += 1
+                        logger.warning(
+                            "Storage hook failed %d of %d runs",
+                            self._failed, self._failed + self._succeeded)
+                    self._cond.notify_all()
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Wait until all queued commands ran, ``False`` on timeout."""
+        with self._cond:
+            return self._cond.wait_for(
+                lambda: not self._pending and not self._running, timeout)
+
+    def shutdown(self) -> None:
+        """Stop the workers, running the queued commands first if
+        ``flush_on_shutdown`` is set."""
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            if not self._flush_on_shutdown and self._pending:
+                logger.warning("Storage hook executor shut down, dropping %d "
+                               "queued runs", len(self._pending))
+                self._pending.clear()
+            self._cond.notify_all()
+            threads = list(self._threads)
+        for thread in threads:
+            thread.join()
+
+    def stats(self) -> Dict[str, int]:
+        with self._cond:
+            return {"submitted": self._submitted,
+                    "coalesced": self._coalesced,
+                    "succeeded": self._succeeded, "failed": self._failed,
+                    "pending": len(self._pending), "running": self._running}
+
+
+_executors: "weakref.WeakSet[HookExecutor]" = weakref.WeakSet()
+
+
+@atexit.register
+def _shutdown_executors() -> None:
+    for executor in list(_executors):
+        executor.shutdown()
@@ -0,0 +1,272 @@
+# This file is part of Radicale - CalDAV and CardDAV server
+#
+# This library is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Radicale.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Index of the items of a collection for prefiltering reports.
+
+The index holds the time range, the component name and the UID of all
+items, sorted by start of the time range. An array with the maximum end of
+all preceding entries allows to find all items overlapping a time range
+without looking at the items that end before it. The same structure is kept
+for the items of each component name, and a map from UID to href.
+
+The index records the modification time and the size of every item file.
+They are compared with the directory entries before the index is used, only
+the entries of item files that changed, appeared or disappeared are
+updated. The index is stored next to the item cache (see
+``_get_collection_cache_subfolder``).
+
+"""
+
+import bisect
+import contextlib
+import itertools
+import os
+import pickle
+import xml.etree.ElementTree as ET
+from typing import (BinaryIO, Dict, Iterable, Iterator, List, NamedTuple,
+                    Optional, Set, Tuple, cast)
+
+import radicale.item as radicale_item
+import radicale.item.filter as radicale_filter
+from radicale import pathutils
+from radicale.log import logger
+from radicale.storage.multifilesystem.base import CollectionBase
+from radicale.storage.multifilesystem.get import CollectionPartGet
+
+INDEX_VERSION = 3
+
+# Name of the index in the item cache folder of the collection
+INDEX_NAME = ".Radicale.item-index"
+
+# Modification time in nanoseconds and size of an item file
+ItemStat = Tuple[int, int]
+
+
+class IndexEntry(NamedTuple):
+    start: int
+    end: int
+    href: str
+    tag: str
+    uid: str
+
+
+class _Intervals:
+    """Entries sorted by start with the running maximum of the end."""
+
+    def __init__(self, entries: List[IndexEntry]) -> None:
+        self._entries = entries
+        self._starts = [entry.start for entry in entries]
+        self._max_ends = list(itertools.accumulate(
+            (entry.end for entry in entries), max))
+
+    def query(self, start: int, end: int) -> List[str]:
+        hrefs = []
+        for i in reversed(range(bisect.bisect_left(self._starts, end))):
+            if self._max_ends[i] <= start:
+                # No preceding entry ends after the start
+                break
+            entry = self._entries[i]
+            if entry.end > start:
+                hrefs.append(entry.href)
+        hrefs.reverse()
+        return hrefs
+
+
+class ItemIndex:
+    """Time ranges of all items and per component name, UIDs of all items."""
+
+    stats: Dict[str, ItemStat]
+
+    def __init__(self, stats: Dict[str, ItemStat],
+                 entries: Iterable[IndexEntry]) -> None:
+        self.stats = stats
+        self._entries = sorted(entries)
+        self._all = _Intervals(self._entries)
+        buckets: Dict[str, List[IndexEntry]] = {}
+        for entry in self._entries:
+            buckets.setdefault(entry.tag, []).append(entry)
+        self._buckets = {tag: _Intervals(bucket)
+                         for tag, bucket in buckets.items()}
+        self._uids = {entry.uid: entry.href for entry in self._entries}
+
+    @property
+    def entries(self) -> List[IndexEntry]:
+        return self._entries
+
+    def query(self, tag: Optional[str], start: int, end: int) -> List[str]:
+        """hrefs of the items with component ``tag`` (or all) that overlap
+        the time range from ``start`` to ``end``."""
+        intervals = self._all if tag is None else self._buckets.get(tag)
+        return intervals.query(start, end) if intervals else []
+
+    def href_of_uid(self, uid: str) -> Optional[str]:
+        return self._uids.get(uid)
+
+    def replace(self, removed: Iterable[str],
+                added: Iterable[radicale_item.Item],
+                stats: Iterable[Tuple[str, ItemStat]] = ()) -> "ItemIndex":
+        """New index without the hrefs in ``removed`` and with ``added``.
+
+        ``stats`` are the modification times and sizes of the added item
+        files.
+
+        """
+        removed_hrefs = set(removed)
+        entries = [entry for entry in self._entries
+                   if entry.href not in removed_hrefs]
+        entries.extend(_index_entry(item) for item in added)
+        new_stats = {href: stat for href, stat in self.stats.items()
+                     if href not in removed_hrefs}
+        new_stats.update(stats)
+        return ItemIndex(new_stats, entries)
+
+
+def _index_entry(item: radicale_item.Item) -> IndexEntry:
+    assert item.href
+    start, end = item.time_range
+    return IndexEntry(start, end, item.href, item.component_name, item.uid)
+
+
+class CollectionPartItemIndex(CollectionPartGet, CollectionBase):
+
+    @property
+    def _item_index_path(self) -> str:
+        return os.path.join(self._storage._get_collection_cache_subfolder(
+            self._filesystem_path, ".Radicale.cache", "item"), INDEX_NAME)
+
+    def _item_stat(self, href: str) -> Optional[ItemStat]:
+        try:
+            st = os.stat(os.path.join(self._filesystem_path, href))
+        except FileNotFoundError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def _read_item_index(self) -> Optional[ItemIndex]:
+        """Load the index as stored, ``None`` if it is missing.
+
+        Entries of item files changed by other means than Radicale are only
+        updated by ``_item_index``.
+
+        """
+        try:
+            with open(self._item_index_path, "rb") as f:
+                version, stats, entries = pickle.load(f)
+            if version != INDEX_VERSION:
+                return None
+            index = ItemIndex(dict(stats),
+                              (IndexEntry(*entry) for entry in entries))
+        except FileNotFoundError:
+            return None
+        except (pickle.UnpicklingError, ValueError, TypeError, EOFError) as e:
+            logger.warning("Ignoring invalid item index of collection %r: %s",
+                           self.path, e)
+            return None
+        return index
+
+    def _write_item_index(self, index: ItemIndex) -> None:
+        try:
+            # TODO: better fix for "mypy"
+            with self._atomic_write(self._item_index_path, "wb") as fo:  # type: ignore
+                fb = cast(BinaryIO, fo)
+                pickle.dump((INDEX_VERSION, index.stats,
+                             [tuple(entry) for entry in index.entries]), fb)
+        except OSError as e:
+            logger.warning("Failed to write item index of collection %r: %s",
+                           self.path, e)
+
+    def _item_index(self) -> ItemIndex:
+        """Load the index and update the entries of changed item files."""
+        index = self._read_item_index()
+        if index is None:
+            self._storage._makedirs_synced(
+                os.path.dirname(self._item_index_path))
+            index = ItemIndex({}, ())
+        # The stat of an item file is taken before it is read, a file that
+        # changes in between is read again the next time.
+        stats: Dict[str, ItemStat] = {}
+        for entry in self._scan():
+            try:
+                st = entry.stat()
+            except FileNotFoundError:
+                continue
+            stats[entry.name] = (st.st_mtime_ns, st.st_size)
+        changed = [href for href, stat in stats.items()
+                   if index.stats.get(href) != stat]
+        removed: Set[str] = set(index.stats).difference(stats)
+        if not changed and not removed:
+            return index
+        if self._storage._debug_cache_actions is True:
+            logger.debug("Item index of collection %r: %d changed and %d "
+                         "removed items", self.path, len(changed),
+                         len(removed))
+        removed.update(changed)
+        added = [item for _, item in self.get_multi(changed)
+                 if item is not None]
+        index = index.replace(removed, added,
+                              ((href, stats[href]) for href in changed))
+        self._write_item_index(index)
+        return index
+
+    def _update_item_index(self, index: ItemIndex,
+                           removed: Iterable[str] = (),
+                           added: Iterable[radicale_item.Item] = ()) -> None:
+        """Apply the removal of hrefs and the addition of items to ``index``
+        as loaded before the change and store it."""
+        added = list(added)
+        stats = []
+        for item in added:
+            assert item.href
+            stat = self._item_stat(item.href)
+            if stat is not None:
+                stats.append((item.href, stat))
+        self._write_item_index(index.replace(removed, added, stats))
+
+    def _invalidate_item_index(self) -> None:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(self._item_index_path)
+
+    def has_uid(self, uid: str) -> bool:
+        if self._storage._use_item_index is not True:
+            return super().has_uid(uid)
+        return self._item_index().href_of_uid(uid) is not None
+
+    def get_filtered(self, filters: Iterable[ET.Element]
+                     ) -> Iterator[Tuple[radicale_item.Item, bool]]:
+        if self._storage._use_item_index is not True:
+            yield from super().get_filtered(filters)
+            return
+        if not self.tag:
+            return
+        tag, start, end, simple = radicale_filter.simplify_prefilters(
+            filters, self.tag)
+        if tag is None and (start, end) == (radicale_filter.TIMESTAMP_MIN,
+                                            radicale_filter.TIMESTAMP_MAX):
+            # All items are candidates
+            yield from super().get_filtered(filters)
+            return
+        for href in self._item_index().query(tag, start, end):
+            if not pathutils.file_check_size(
+                    os.path.join(self._filesystem_path, href),
+                    self._storage._max_resource_size):
+                continue
+            item = self._get(href, verify_href=False)
+            if item is None:
+                continue
+            istart, iend = item.time_range
+            if (tag is not None and tag != item.component_name or
+                    istart >= end or iend <= start):
+                continue
+            yield item, simple and (start <= istart or iend <= end)
@@ -24,18 +24,24 @@ import shlex
 import signal
 import subprocess
 import sys
-from typing import Iterator
+import threading
+from hashlib import sha256
+from typing import Dict, Iterator, Optional
 
 from radicale import config, pathutils, types
 from radicale.log import logger
 from radicale.storage.multifilesystem.base import CollectionBase, StorageBase
+from radicale.storage.multifilesystem.hook_executor import HookExecutor
+
+# Folder with the lock files of the principal collections
+PRINCIPAL_LOCK_FOLDER = ".Radicale.locks"
 
 
 class CollectionPartLock(CollectionBase):
 
     @types.contextmanager
     def _acquire_cache_lock(self, ns: str = "") -> Iterator[None]:
-        if self._storage._lock.locked == "w":
+        if self._storage._write_locked:
             yield
             return
         cache_folder = self._storage._get_collection_cache_subfolder(self._filesystem_path, ".Radicale.cache", ns)
@@ -51,77 +57,167 @@ class CollectionPartLock(CollectionBase):
 class StoragePartLock(StorageBase):
 
     _lock: pathutils.RwLock
+    _use_principal_locks: bool
+    _principal_locks: Dict[str, pathutils.RwLock]
+    _principal_locks_lock: threading.Lock
+    _write_lock_depth: threading.local
     _hook: str
+    _hook_executor: Optional[HookExecutor]
 
     def __init__(self, configuration: config.Configuration) -> None:
         super().__init__(configuration)
         lock_path = os.path.join(self._filesystem_folder, ".Radicale.lock")
         logger.debug("Lock file (StoragePartLock): %r" % lock_path)
         self._lock = pathutils.RwLock(lock_path)
+        self._use_principal_locks = configuration.get(
+            "storage", "use_principal_locks")
+        self._principal_locks = {}
+        self._principal_locks_lock = threading.Lock()
+        self._write_lock_depth = threading.local()
         self._hook = configuration.get("storage", "hook")
+        self._hook_executor = None
+        if self._hook and configuration.get("storage", "hook_async"):
+            self._hook_executor = HookExecutor(
+                self._run_hook,
+                configuration.get("storage", "hook_async_workers"),
+                configuration.get("storage", "hook_async_queue_size"),
+                configuration.get("storage", "hook_async_flush_on_shutdown"))
+
+    def _principal_lock(self, principal: str) -> pathutils.RwLock:
+        with self._principal_locks_lock:
+            lock = self._principal_locks.get(principal)
+            if lock is None:
+                lock_folder = os.path.join(self._filesystem_folder,
+                                           PRINCIPAL_LOCK_FOLDER)
+                self._makedirs_synced(lock_folder)
+                lock_path = os.path.join(
+                    lock_folder, sha256(principal.encode()).hexdigest())
+                lock = self._principal_locks[principal] = pathutils.RwLock(
+                    lock_path)
+            return lock
+
+    @property
+    def _write_locked(self) -> bool:
+        """The current thread holds a write lock on the storage or on a
+        principal collection.
+
+        With principal locks, the storage lock is only held in read mode.
+
+        """
+        return getattr(self._write_lock_depth, "value", 0) > 0
+
+    def _lock_principal(self, mode: str, path: str = "", to_path: str = "",
+                        request: str = "", **kwargs) -> Optional[str]:
+        """Principal collection that contains everything accessed by the
+        request, ``None`` if the whole storage must be locked.
+
+        Only requests (with ``request`` set) are locked per principal,
+        writes must be below the principal collection.
+
+        """
+        if not self._use_principal_locks or not request or not path:
+            return None
+        principals = set()
+        for sane_path in (path, to_path):
+            if not sane_path:
+                continue
+            parts = pathutils.strip_path(
+                pathutils.sanitize_path(sane_path)).split("/")
+            if not parts[0] or mode == "w" and len(parts) < 2:
+                return None
+            principals.add(parts[0])
+        return principals.pop() if len(principals) == 1 else None
 
     @types.contextmanager
     def acquire_lock(self, mode: str, user: str = "", *args, **kwargs) -> Iterator[None]:
-        with self._lock.acquire(mode):
+        principal = self._lock_principal(mode, **kwargs)
+        with contextlib.ExitStack() as lock_stack:
+            if principal is None:
+                lock_stack.enter_context(self._lock.acquire(mode))
+            else:
+                # The shared storage lock excludes operations on the
+                # whole storage (and scripts locking the storage)
+                lock_stack.enter_context(self._lock.acquire("r"))
+                lock_stack.enter_context(
+                    self._principal_lock(principal).acquire(mode))
+            if mode == "w":
+                self._write_lock_depth.value = getattr(
+                    self._write_lock_depth, "value", 0) + 1
+                lock_stack.callback(self._release_write_lock)
             yield
             # execute hook
-            if mode == "w" and self._hook:
-                debug = logger.isEnabledFor(logging.DEBUG)
-                # Use new process group for child to prevent terminals
-                # from sending SIGINT etc.
-                preexec_fn = None
-                creationflags = 0
-                if sys.platform == "win32":
-                    creationflags |= subprocess.CREATE_NEW_PROCESS_GROUP
-                else:
-                    # Process group is also used to identify child processes
-                    preexec_fn = os.setpgrp
-                # optional argument
-                path = kwargs.get('path', "")
-                request = kwargs.get('request', "NONE")
-                to_path = kwargs.get('to_path', "")
-                if to_path != "":
-                    to_path = shlex.quote(self._get_collection_root_folder() + to_path)
-                try:
-                    command = self._hook % {
-                        "path": shlex.quote(self._get_collection_root_folder() + path),
-                        "to_path": to_path,
-                        "cwd": shlex.quote(self._filesystem_folder),
-                        "request": shlex.quote(request),
-                        "user": shlex.quote(user or "Anonymous")}
-                except KeyError as e:
-                    logger.error("Storage hook contains not supported placeholder %s (skip execution of: %r)" % (e, self._hook))
-                    return
-
-                logger.debug("Executing storage hook: '%s'" % command)
-                try:
-                    p = subprocess.Popen(
-                        command, stdin=subprocess.DEVNULL,
-                        stdout=subprocess.PIPE if debug else subprocess.DEVNULL,
-                        stderr=subprocess.PIPE if debug else subprocess.DEVNULL,
-                        shell=True, universal_newlines=True, preexec_fn=preexec_fn,
-                        cwd=self._filesystem_folder, creationflags=creationflags)
-                except Exception as e:
-                    logger.error("Execution of storage hook not successful on 'Popen': %s" % e)
-                    return
-                logger.debug("Executing storage hook started 'Popen'")
-                try:
-                    stdout_data, stderr_data = p.communicate()
-                except BaseException as e:  # e.g. KeyboardInterrupt or SystemExit
-                    logger.error("Execution of storage hook not successful on 'communicate': %s" % e)
-                    p.kill()
-                    p.wait()
-                    return
-                finally:
-                    if sys.platform != "win32":
-                        # Kill remaining children identified by process group
-                        with contextlib.suppress(OSError):
-                            os.killpg(p.pid, signal.SIGKILL)
-                logger.debug("Executing storage hook finished")
-                if stdout_data:
-                    logger.debug("Captured stdout from storage hook:\n%s", stdout_data)
-                if stderr_data:
-                    logger.debug("Captured stderr from storage hook:\n%s", stderr_data)
-                if p.returncode != 0:
-                    logger.error("Execution of storage hook not successful: %s" % subprocess.CalledProcessError(p.returncode, p.args))
-                    return
+            if mode == "w" and self._hook and self._hook_executor is None:
+                command = self._hook_command(user, **kwargs)
+                if command is not None:
+                    self._run_hook(command)
+        if mode == "w" and self._hook and self._hook_executor is not None:
+            # queue hook after releasing the lock
+            command = self._hook_command(user, **kwargs)
+            if command is not None:
+                self._hook_executor.submit(command)
+
+    def _release_write_lock(self) -> None:
+        self._write_lock_depth.value -= 1
+
+    def _hook_command(self, user: str, path: str = "", request: str = "NONE",
+                      to_path: str = "", **kwargs) -> Optional[str]:
+        if to_path != "":
+            to_path = shlex.quote(self._get_collection_root_folder() + to_path)
+        try:
+            return self._hook % {
+                "path": shlex.quote(self._get_collection_root_folder() + path),
+                "to_path": to_path,
+                "cwd": shlex.quote(self._filesystem_folder),
+                "request": shlex.quote(request),
+                "user": shlex.quote(user or "Anonymous")}
+        except KeyError as e:
+            logger.error("Storage hook contains not supported placeholder %s (skip execution of: %r)" % (e, self._hook))
+            return None
+
+    def _run_hook(self, command: str) -> bool:
+        debug = logger.isEnabledFor(logging.DEBUG)
+        # Use new process group for child to prevent terminals
+        # from sending SIGINT etc.
+        # The hook runs in the threads of the hook executor, ``preexec_fn``
+        # isn't safe in the presence of threads.
+        start_new_session = False
+        creationflags = 0
+        if sys.platform == "win32":
+            creationflags |= subprocess.CREATE_NEW_PROCESS_GROUP
+        else:
+            # Process group is also used to identify child processes
+            start_new_session = True
+        logger.debug("Executing storage hook: '%s'" % command)
+        try:
+            p = subprocess.Popen(
+                command, stdin=subprocess.DEVNULL,
+                stdout=subprocess.PIPE if debug else subprocess.DEVNULL,
+                stderr=subprocess.PIPE if debug else subprocess.DEVNULL,
+                shell=True, universal_newlines=True,
+                start_new_session=start_new_session,
+                cwd=self._filesystem_folder, creationflags=creationflags)
+        except Exception as e:
+            logger.error("Execution of storage hook not successful on 'Popen': %s" % e)
+            return False
+        logger.debug("Executing storage hook started 'Popen'")
+        try:
+            stdout_data, stderr_data = p.communicate()
+        except BaseException as e:  # e.g. KeyboardInterrupt or SystemExit
+            logger.error("Execution of storage hook not successful on 'communicate': %s" % e)
+            p.kill()
+            p.wait()
+            return False
+        finally:
+            if sys.platform != "win32":
+                # Kill remaining children identified by process group
+                with contextlib.suppress(OSError):
+                    os.killpg(p.pid, signal.SIGKILL)
+        logger.debug("Executing storage hook finished")
+        if stdout_data:
+            logger.debug("Captured stdout from storage hook:\n%s", stdout_data)
+        if stderr_data:
+            logger.debug("Captured stderr from storage hook:\n%s", stderr_data)
+        if p.returncode != 0:
+            logger.error("Execution of storage hook not successful: %s" % subprocess.CalledProcessError(p.returncode, p.args))
+            return False
+        return True
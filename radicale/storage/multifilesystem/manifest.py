@@ -0,0 +1,177 @@
+# This file is part of Radicale - CalDAV and CardDAV server
+#
+# This library is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Radicale.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Manifest of a collection.
+
+The manifest holds a digest of the ``href/etag`` pairs of all items, the
+number of items and the last modification time of the collection. The
+digest is the XOR of the SHA256 hashes of the pairs, so it can be updated
+for a single item without reading the others.
+
+The manifest records the modification times of the collection folder and of
+the properties file. Every change by Radicale replaces a file in the
+collection folder, a manifest with other modification times is stale and
+gets rebuilt. Item files changed in place by other means than Radicale don't
+change these times, the manifest then stays stale until it is rebuilt (e.g.
+by ``--rebuild-cache``).
+
+The manifest is stored next to the item cache (see
+``_get_collection_cache_subfolder``).
+
+"""
+
+import contextlib
+import itertools
+import json
+import os
+from hashlib import sha256
+from typing import Iterable, Mapping, NamedTuple, Optional, TextIO, Tuple, cast
+
+from radicale.log import logger
+from radicale.storage.multifilesystem.base import CollectionBase
+from radicale.storage.multifilesystem.get import CollectionPartGet
+from radicale.storage.multifilesystem.meta import CollectionPartMeta
+
+MANIFEST_VERSION = 1
+
+# Name of the manifest in the item cache folder of the collection
+MANIFEST_NAME = ".Radicale.manifest"
+
+
+class CollectionManifest(NamedTuple):
+    folder_mtime_ns: int
+    props_mtime_ns: Optional[int]
+    digest: int
+    item_count: int
+    last_modified: float
+
+
+def _item_digest(href: str, etag: str) -> int:
+    return int.from_bytes(sha256((href + "/" + etag).encode()).digest(), "big")
+
+
+def _mtime_ns(path: str) -> Optional[int]:
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+class CollectionPartManifest(CollectionPartMeta, CollectionPartGet,
+                             CollectionBase):
+
+    @property
+    def _manifest_path(self) -> str:
+        return os.path.join(self._storage._get_collection_cache_subfolder(
+            self._filesystem_path, ".Radicale.cache", "item"), MANIFEST_NAME)
+
+    def _manifest_mtimes(self) -> Tuple[int, Optional[int]]:
+        return (os.stat(self._filesystem_path).st_mtime_ns,
+                _mtime_ns(self._props_path))
+
+    def _read_manifest(self) -> Optional[CollectionManifest]:
+        """Load the manifest, ``None`` if it is missing or stale."""
+        try:
+            with open(self._manifest_path, encoding="utf-8") as f:
+                data = json.load(f)
+            if data.pop("version") != MANIFEST_VERSION:
+                return None
+            data["digest"] = int(data["digest"], 16)
+            manifest = CollectionManifest(**data)
+        except FileNotFoundError:
+            return None
+        except (ValueError, TypeError, KeyError, AttributeError) as e:
+            logger.warning("Ignoring invalid manifest of collection %r: %s",
+                           self.path, e)
+            return None
+        if (manifest.folder_mtime_ns, manifest.props_mtime_ns) != (
+                self._manifest_mtimes()):
+            if self._storage._debug_cache_actions is True:
+                logger.debug("Manifest of collection %r is stale", self.path)
+            return None
+        return manifest
+
+    def _write_manifest(self, manifest: CollectionManifest) -> None:
+        data = dict(manifest._asdict(), version=MANIFEST_VERSION,
+                    digest="%064x" % manifest.digest)
+        try:
+            # TODO: better fix for "mypy"
+            with self._atomic_write(self._manifest_path, "w") as fo:  # type: ignore
+                f = cast(TextIO, fo)
+                json.dump(data, f, sort_keys=True)
+        except OSError as e:
+            logger.warning("Failed to write manifest of collection %r: %s",
+                           self.path, e)
+
+    def _build_manifest(self) -> CollectionManifest:
+        # Create the cache folder first, it can change the collection folder
+        self._storage._makedirs_synced(
+            os.path.dirname(self._manifest_path))
+        folder_mtime_ns, props_mtime_ns = self._manifest_mtimes()
+        digest = 0
+        count = 0
+        for item in self.get_all():
+            assert item.href
+            digest ^= _item_digest(item.href, item.etag)
+            count += 1
+        last_modified = max(itertools.chain(
+            (folder_mtime_ns / 1e9, (props_mtime_ns or 0) / 1e9),
+            (os.path.getmtime(os.path.join(self._filesystem_path, href))
+             for href in self._list())))
+        manifest = CollectionManifest(folder_mtime_ns, props_mtime_ns, digest,
+                                      count, last_modified)
+        self._write_manifest(manifest)
+        return manifest
+
+    def _manifest(self) -> CollectionManifest:
+        manifest = self._read_manifest()
+        if manifest is None:
+            manifest = self._build_manifest()
+        return manifest
+
+    def _update_manifest(self, manifest: CollectionManifest,
+                         removed: Iterable[Tuple[str, str]] = (),
+                         added: Iterable[Tuple[str, str]] = ()) -> None:
+        """Apply the removal and addition of ``(href, etag)`` pairs to
+        ``manifest`` as loaded before the change and store it."""
+        digest = manifest.digest
+        count = manifest.item_count
+        last_modified = manifest.last_modified
+        for href, etag in removed:
+            digest ^= _item_digest(href, etag)
+            count -= 1
+        for href, etag in added:
+            digest ^= _item_digest(href, etag)
+            count += 1
+            last_modified = max(last_modified, os.path.getmtime(
+                os.path.join(self._filesystem_path, href)))
+        folder_mtime_ns, props_mtime_ns = self._manifest_mtimes()
+        last_modified = max(last_modified, folder_mtime_ns / 1e9,
+                            (props_mtime_ns or 0) / 1e9)
+        self._write_manifest(CollectionManifest(
+            folder_mtime_ns, props_mtime_ns, digest, count, last_modified))
+
+    def _invalidate_manifest(self) -> None:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(self._manifest_path)
+
+    def set_meta(self, props: Mapping[str, str]) -> None:
+        manifest = None
+        if self._storage._use_collection_manifest is True:
+            manifest = self._read_manifest()
+        super().set_meta(props)
+        if manifest is not None:
+            self._update_manifest(manifest)
@@ -0,0 +1,122 @@
+# This file is part of Radicale - CalDAV and CardDAV server
+#
+# This library is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Radicale.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+In-memory cache of loaded items shared by all requests of a process.
+
+Entries are keyed by the path of the item file and validated with its
+modification time and size, so items edited by other means are reloaded.
+Writes by Radicale remove the entries of the written files.
+
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Dict, NamedTuple, Optional
+
+from radicale.log import logger
+
+if TYPE_CHECKING:
+    from radicale.storage.multifilesystem.cache import CacheContent
+
+# Estimated size of an entry without its strings (bytes)
+ENTRY_OVERHEAD = 512
+
+# Interval for logging the statistics (seconds)
+STATS_LOG_INTERVAL = 3600
+
+
+class _Entry(NamedTuple):
+    mtime_ns: int
+    size: int
+    content: "CacheContent"
+    memory_size: int
+
+
+class ItemMemoryCache:
+    """Size-bounded (in bytes) LRU cache of the item cache content."""
+
+    def __init__(self, max_size: int) -> None:
+        self._max_size = max_size
+        self._size = 0
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._log_time = time.monotonic()
+
+    @staticmethod
+    def _memory_size(content: "CacheContent") -> int:
+        return ENTRY_OVERHEAD + sum(len(value) for value in content
+                                    if isinstance(value, str))
+
+    def get(self, path: str, mtime_ns: int, size: int
+            ) -> Optional["CacheContent"]:
+        """Content stored for ``path`` with the same modification time and
+        size, otherwise ``None``."""
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and (entry.mtime_ns, entry.size) == (
+                    mtime_ns, size):
+                self._entries.move_to_end(path)
+                self._hits += 1
+                content: Optional["CacheContent"] = entry.content
+            else:
+                self._misses += 1
+                content = None
+            self._log_stats()
+            return content
+
+    def put(self, path: str, mtime_ns: int, size: int,
+            content: "CacheContent") -> None:
+        memory_size = self._memory_size(content)
+        if memory_size > self._max_size:
+            return
+        with self._lock:
+            old = self._entries.pop(path, None)
+            if old is not None:
+                self._size -= old.memory_size
+            self._entries[path] = _Entry(mtime_ns, size, content,
+                                         memory_size)
+            self._size += memory_size
+            while self._size > self._max_size:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= evicted.memory_size
+                self._evictions += 1
+
+    def invalidate(self, path: str) -> None:
+        with self._lock:
+            entry = self._entries.pop(path, None)
+            if entry is not None:
+                self._size -= entry.memory_size
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"hits": self._hits, "misses": self._misses,
+                    "evictions": self._evictions,
+                    "entries": len(self._entries), "size": self._size}
+
+    def _log_stats(self) -> None:
+        now = time.monotonic()
+        if now - self._log_time < STATS_LOG_INTERVAL:
+            return
+        self._log_time = now
+        lookups = self._hits + self._misses
+        logger.info("Storage item memory cache: %d%% hit ratio (%d/%d), "
+                    "%d entries, %d bytes, %d evictions",
+                    100 * self._hits // lookups, self._hits, lookups,
+                    len(self._entries), self._size, self._evictions)
@@ -23,6 +23,7 @@ from typing import Mapping, Optional, TextIO, Union, cast, overload
 
 import radicale.item as radicale_item
 from radicale.storage import multifilesystem
+from radicale.storage.events import MetaEvent
 from radicale.storage.multifilesystem.base import CollectionBase
 
 
@@ -47,7 +48,7 @@ class CollectionPartMeta(CollectionBase):
     def get_meta(self, key: Optional[str] = None) -> Union[Mapping[str, str],
                                                            Optional[str]]:
         # reuse cached value if the storage is read-only
-        if self._storage._lock.locked == "w" or self._meta_cache is None:
+        if self._storage._write_locked or self._meta_cache is None:
             try:
                 try:
                     with open(self._props_path, encoding=self._encoding) as f:
@@ -62,6 +63,10 @@ class CollectionPartMeta(CollectionBase):
         return self._meta_cache if key is None else self._meta_cache.get(key)
 
     def set_meta(self, props: Mapping[str, str]) -> None:
+        self._write_meta(props)
+        self._storage.events.emit(MetaEvent(self.path, props))
+
+    def _write_meta(self, props: Mapping[str, str]) -> None:
         # TODO: better fix for "mypy"
         try:
             with self._atomic_write(self._props_path, "w") as fo:  # type: ignore
@@ -23,6 +23,7 @@ from radicale import item as radicale_item
 from radicale import pathutils, storage
 from radicale.log import logger
 from radicale.storage import multifilesystem
+from radicale.storage.events import MoveEvent
 from radicale.storage.multifilesystem.base import StorageBase
 
 
@@ -37,14 +38,32 @@ class StoragePartMove(StorageBase):
         assert item.href
         move_from = pathutils.path_to_filesystem(item.collection._filesystem_path, item.href, self._is_collision_free)
         move_to = pathutils.path_to_filesystem(to_collection._filesystem_path, to_href, self._is_collision_free)
+        if self._use_sync_change_log is True:
+            from_log_is_current = item.collection._change_log_is_current()
+            to_log_is_current = to_collection._change_log_is_current()
+        replaced_item = None
+        if self.events.active and os.path.exists(move_to):
+            replaced_item = to_collection._get(to_href, verify_href=False)
         try:
             os.replace(move_from, move_to)
         except OSError as e:
             raise ValueError("Failed to move file %r => %r %s" % (move_from, move_to, e)) from e
+        if self._item_memory_cache is not None:
+            self._item_memory_cache.invalidate(move_from)
+            self._item_memory_cache.invalidate(move_to)
         self._sync_directory(to_collection._filesystem_path)
         if item.collection._filesystem_path != to_collection._filesystem_path:
             self._sync_directory(item.collection._filesystem_path)
         # Move the item cache entry
+        if self._use_packed_item_cache is True:
+            from_pack = item.collection._item_cache_pack()
+            try:
+                entry = from_pack.get(item.href)
+                if entry is not None:
+                    to_collection._item_cache_pack().store([(to_href, *entry)])
+            except Exception as e:
+                logger.error("Failed to move packed cache entry %r => %r %s" % (item.href, to_href, e))
+            from_pack.remove([item.href])
         cache_folder = self._get_collection_cache_subfolder(item.collection._filesystem_path, ".Radicale.cache", "item")
         to_cache_folder = self._get_collection_cache_subfolder(to_collection._filesystem_path, ".Radicale.cache", "item")
         self._makedirs_synced(to_cache_folder)
@@ -61,9 +80,27 @@ class StoragePartMove(StorageBase):
             self._makedirs_synced(to_cache_folder)
             if cache_folder != to_cache_folder:
                 self._makedirs_synced(cache_folder)
+        if self._use_collection_manifest is True:
+            to_collection._invalidate_manifest()
+            item.collection._invalidate_manifest()
+        if self._use_item_index is True:
+            to_collection._invalidate_item_index()
+            item.collection._invalidate_item_index()
         # Track the change
         to_collection._update_history_etag(to_href, item)
         item.collection._update_history_etag(item.href, None)
         to_collection._clean_history()
         if item.collection._filesystem_path != to_collection._filesystem_path:
             item.collection._clean_history()
+        if self._use_sync_change_log is True:
+            if item.collection._filesystem_path == to_collection._filesystem_path:
+                to_collection._log_changes(
+                    [(item.href, None), (to_href, item)], to_log_is_current)
+            else:
+                item.collection._log_changes([(item.href, None)],
+                                             from_log_is_current)
+                to_collection._log_changes([(to_href, item)],
+                                           to_log_is_current)
+        self.events.emit(MoveEvent(item.collection.path, item.href,
+                                   to_collection.path, to_href, item,
+                                   replaced_item))
@@ -0,0 +1,133 @@
+# This file is part of Radicale - CalDAV and CardDAV server
+#
+# This library is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Radicale.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Rebuild of the item, history and index caches of all collections.
+
+Items are parsed by a pool of processes. Every collection is processed while
+holding the shared storage lock and the item cache lock of the collection,
+like a request that loads the items, so it is safe to run beside a server.
+
+"""
+
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import List, Optional, Tuple, cast
+
+import radicale.item as radicale_item
+from radicale import pathutils
+from radicale.log import logger
+from radicale.storage import multifilesystem
+from radicale.storage.multifilesystem.base import StorageBase
+from radicale.storage.multifilesystem.cache import (CacheContent,
+                                                    parse_item_cache_content)
+from radicale.storage.multifilesystem.discover import StoragePartDiscover
+
+# Number of items sent to a worker process at once
+CHUNK_SIZE = 16
+
+
+class StoragePartRebuildCache(StoragePartDiscover, StorageBase):
+
+    def _rebuild_collection_cache(
+            self, collection: "multifilesystem.Collection", executor: Executor,
+            skip_unchanged: bool) -> Tuple[int, int, int]:
+        """Rebuild the caches of ``collection``.
+
+        Returns the number of items, of parsed items and of broken items.
+
+        """
+        items: List[Tuple[str, str, float, Optional[CacheContent]]] = []
+        jobs: List[Tuple[str, str, bytes, str, bool]] = []
+        with collection._acquire_cache_lock("item"):
+            for href in collection._list():
+                path = os.path.join(collection._filesystem_path, href)
+                try:
+                    with open(path, "rb") as f:
+                        raw_text = f.read()
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                cache_hash = collection._item_file_cache_hash(raw_text, st)
+                content = None
+                if skip_unchanged:
+                    content = collection._load_item_cache(href, cache_hash)
+                if content is None:
+                    jobs.append((collection.path, collection.tag, raw_text,
+                                 collection._encoding, True))
+                items.append((href, cache_hash, st.st_mtime, content))
+            results = executor.map(parse_item_cache_content, jobs, chunksize=CHUNK_SIZE)
+            broken = 0
+            history: List[Tuple[str, Optional[radicale_item.Item]]] = []
+            for href, cache_hash, mtime, content in items:
+                if content is None:
+                    content, error = next(results)
+                    if content is None:
+                        broken += 1
+                        logger.warning("Skip broken item %r in %r: %s",
+                                       href, collection.path, error)
+                        continue
+                    collection._store_item_cache_content(href, cache_hash,
+                                                         content)
+                history.append(
+                    (href, collection._item_from_cache(href, mtime, content)))
+        # Outside of the item cache lock, ``sync`` takes the locks in the
+        # order history, item.
+        collection._update_history_etags(history)
+        if self._use_collection_manifest is True:
+            collection._invalidate_manifest()
+        if self._use_item_index is True:
+            if not skip_unchanged:
+                collection._invalidate_item_index()
+            collection._item_index()
+        return len(items), len(jobs), broken
+
+    def rebuild_cache(self, workers: int = 0,
+                      skip_unchanged: bool = False) -> bool:
+        """Build the item, history and index caches of all collections.
+
+        ``workers`` is the number of worker processes (0: number of CPUs).
+
+        ``skip_unchanged`` keeps valid item cache entries instead of parsing
+        all items again.
+
+        """
+        sane_paths = list(self._collection_paths())
+        errors = 0
+        with ProcessPoolExecutor(max_workers=workers or None) as executor:
+            # Start the worker processes before acquiring any lock, forked
+            # processes inherit the open lock files.
+            executor.submit(int).result()
+            for i, sane_path in enumerate(sane_paths, start=1):
+                try:
+                    with self.acquire_lock("r"):
+                        collection = self._collection_class(
+                            cast(multifilesystem.Storage, self),
+                            pathutils.unstrip_path(sane_path, True))
+                        if not collection.tag:
+                            continue
+                        count, parsed, broken = (
+                            self._rebuild_collection_cache(
+                                collection, executor, skip_unchanged))
+                except Exception as e:
+                    errors += 1
+                    logger.error("Failed to rebuild cache of collection %r: "
+                                 "%s", sane_path, e, exc_info=True)
+                    continue
+                errors += broken
+                logger.info("Rebuilt cache of collection %r (items: %d, "
+                            "parsed: %d, broken: %d) [%d/%d]", sane_path,
+                            count, parsed, broken, i, len(sane_paths))
+        return errors == 0
@@ -17,50 +17,45 @@
 # along with Radicale.  If not, see <http://www.gnu.org/licenses/>.
 
 import contextlib
-import itertools
 import os
 import pickle
 from hashlib import sha256
-from typing import BinaryIO, Iterable, Tuple, cast
+from typing import BinaryIO, Dict, Iterable, Tuple, cast
 
 from radicale.log import logger
+from radicale.storage.multifilesystem import cache_format
 from radicale.storage.multifilesystem.base import CollectionBase
 from radicale.storage.multifilesystem.cache import CollectionPartCache
+from radicale.storage.multifilesystem.changelog import CollectionPartChangeLog
 from radicale.storage.multifilesystem.history import CollectionPartHistory
 
 
-class CollectionPartSync(CollectionPartCache, CollectionPartHistory,
-                         CollectionBase):
+class CollectionPartSync(CollectionPartChangeLog, CollectionPartCache,
+                         CollectionPartHistory, CollectionBase):
 
     def sync(self, old_token: str = "") -> Tuple[str, Iterable[str]]:
         # The sync token has the form http://radicale.org/ns/sync/TOKEN_NAME
         # where TOKEN_NAME is the sha256 hash of all history etags of present
         # and past items of the collection.
-        def check_token_name(token_name: str) -> bool:
-            if len(token_name) != 64:
-                return False
-            for c in token_name:
-                if c not in "0123456789abcdef":
-                    return False
-            return True
-
         old_token_name = ""
         if old_token:
             # Extract the token name from the sync token
             if not old_token.startswith("http://radicale.org/ns/sync/"):
                 raise ValueError("Malformed token: %r" % old_token)
             old_token_name = old_token[len("http://radicale.org/ns/sync/"):]
-            if not check_token_name(old_token_name):
+            if not _check_token_name(old_token_name):
                 raise ValueError("Malformed token: %r" % old_token)
+        if self._storage._use_sync_change_log is True:
+            return self._sync_change_log(old_token_name)
         # Get the current state and sync-token of the collection.
-        state = {}
-        token_name_hash = sha256()
         # Find the history of all existing and deleted items
-        for href, item in itertools.chain(
-                ((item.href, item) for item in self.get_all()),
-                ((href, None) for href in self._get_deleted_history_hrefs())):
-            history_etag = self._update_history_etag(href, item)
-            state[href] = history_etag
+        # Load the items before the history cache is locked, ``get_all``
+        # might lock the item cache.
+        state = self._update_history_etags(
+            [(cast(str, item.href), item) for item in self.get_all()],
+            deleted=True)
+        token_name_hash = sha256()
+        for href, history_etag in state.items():
             token_name_hash.update((href + "/" + history_etag).encode())
         token_name = token_name_hash.hexdigest()
         token = "http://radicale.org/ns/sync/%s" % token_name
@@ -69,14 +64,16 @@ class CollectionPartSync(CollectionPartCache, CollectionPartHistory,
             return token, ()
         token_folder = self._storage._get_collection_cache_subfolder(self._filesystem_path, ".Radicale.cache", "sync-token")
         token_path = os.path.join(token_folder, token_name)
-        old_state = {}
+        old_state: Dict[str, str] = {}
+        base_name = ""
+        base_state: Dict[str, str] = {}
         if old_token_name:
             # load the old token state
             old_token_path = os.path.join(token_folder, old_token_name)
             try:
                 # Race: Another process might have deleted the file.
-                with open(old_token_path, "rb") as f:
-                    old_state = pickle.load(f)
+                old_state, base_name, base_state = self._load_sync_token(
+                    token_folder, old_token_name)
             except (FileNotFoundError, pickle.UnpicklingError,
                     ValueError) as e:
                 if isinstance(e, (pickle.UnpicklingError, ValueError)):
@@ -97,7 +94,8 @@ class CollectionPartSync(CollectionPartCache, CollectionPartHistory,
                 # TODO: better fix for "mypy"
                 with self._atomic_write(token_path, "wb") as fo:  # type: ignore
                     fb = cast(BinaryIO, fo)
-                    pickle.dump(state, fb)
+                    fb.write(self._dump_sync_token(
+                        token_folder, state, base_name, base_state))
             except PermissionError:
                 pass
             else:
@@ -110,6 +108,8 @@ class CollectionPartSync(CollectionPartCache, CollectionPartHistory,
             with contextlib.suppress(FileNotFoundError):
                 # Race: Another process might have deleted the file.
                 os.utime(token_path)
+                if self._storage._use_sync_token_deltas is True:
+                    self._touch_sync_token_base(token_folder, token_name)
         changes = []
         # Find all new, changed and deleted (that are still in the item cache)
         # items
@@ -121,3 +121,86 @@ class CollectionPartSync(CollectionPartCache, CollectionPartHistory,
             if href not in state:
                 changes.append(href)
         return token, changes
+
+    def _load_sync_token(self, token_folder: str, token_name: str
+                         ) -> Tuple[Dict[str, str], str, Dict[str, str]]:
+        """State of the sync token ``token_name``, name and state of the
+        sync token with the complete base state (the token itself if its
+        state isn't a delta)."""
+        with open(os.path.join(token_folder, token_name), "rb") as f:
+            base_name, state, removed = cache_format.load_sync_token(f.read())
+        if not base_name:
+            return state, token_name, state
+        if not _check_token_name(base_name):
+            raise ValueError("Malformed base token: %r" % base_name)
+        base_path = os.path.join(token_folder, base_name)
+        with open(base_path, "rb") as f:
+            base_base_name, base_state, _ = cache_format.load_sync_token(
+                f.read())
+        if base_base_name:
+            raise ValueError("Base token %r is a delta" % base_name)
+        # Keep the base as long as its deltas are used
+        os.utime(base_path)
+        delta = state
+        state = base_state.copy()
+        for href in removed:
+            state.pop(href, None)
+        state.update(delta)
+        return state, base_name, base_state
+
+    def _dump_sync_token(self, token_folder: str, state: Dict[str, str],
+                         base_name: str, base_state: Dict[str, str]) -> bytes:
+        """Content of the sync token file with ``state``.
+
+        With ``use_sync_token_deltas`` only the difference to the complete
+        ``base_state`` is stored, until it gets larger than half of the
+        state and a new base is started. The base is kept at least as long
+        as the new sync token.
+
+        """
+        if self._storage._use_sync_token_deltas is True and base_name:
+            changed = {href: history_etag
+                       for href, history_etag in state.items()
+                       if base_state.get(href) != history_etag}
+            removed = [href for href in base_state if href not in state]
+            if (2 * (len(changed) + len(removed)) <= len(state) and
+                    self._touch_file(os.path.join(token_folder, base_name))):
+                if self._storage._use_binary_cache is True:
+                    return cache_format.dump_sync_delta(base_name, changed,
+                                                        removed)
+                return pickle.dumps((base_name, changed, removed))
+        if self._storage._use_binary_cache is True:
+            return cache_format.dump_sync_state(state)
+        return pickle.dumps(state)
+
+    @staticmethod
+    def _touch_file(path: str) -> bool:
+        """Update the modification time of ``path``, ``False`` if it
+        doesn't exist."""
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            # Race: Another process might have deleted the file.
+            return False
+        return True
+
+    @staticmethod
+    def _touch_sync_token_base(token_folder: str, token_name: str) -> None:
+        """Update the modification time of the base of the sync token
+        ``token_name``."""
+        try:
+            with open(os.path.join(token_folder, token_name), "rb") as f:
+                base_name, _, _ = cache_format.load_sync_token(f.read())
+        except (pickle.UnpicklingError, ValueError):
+            return
+        if base_name and _check_token_name(base_name):
+            os.utime(os.path.join(token_folder, base_name))
+
+
+def _check_token_name(token_name: str) -> bool:
+    if len(token_name) != 64:
+        return False
+    for c in token_name:
+        if c not in "0123456789abcdef":
+            return False
+    return True
@@ -19,7 +19,6 @@
 
 import errno
 import os
-import pickle
 import sys
 from typing import Iterable, Iterator, Optional, TextIO, Tuple, cast
 
@@ -28,14 +27,20 @@ from radicale import pathutils
 from radicale.log import logger
 from radicale.privacy.database import PrivacyDatabase
 from radicale.privacy.enforcement import PrivacyEnforcement
+from radicale.storage.events import UpsertEvent
 from radicale.storage.multifilesystem.base import CollectionBase
 from radicale.storage.multifilesystem.cache import CollectionPartCache
+from radicale.storage.multifilesystem.changelog import CollectionPartChangeLog
 from radicale.storage.multifilesystem.get import CollectionPartGet
 from radicale.storage.multifilesystem.history import CollectionPartHistory
+from radicale.storage.multifilesystem.item_index import CollectionPartItemIndex
+from radicale.storage.multifilesystem.manifest import CollectionPartManifest
 
 
-class CollectionPartUpload(CollectionPartGet, CollectionPartCache,
-                           CollectionPartHistory, CollectionBase):
+class CollectionPartUpload(CollectionPartManifest, CollectionPartChangeLog,
+                           CollectionPartItemIndex, CollectionPartGet,
+                           CollectionPartCache, CollectionPartHistory,
+                           CollectionBase):
 
     _privacy_db: Optional[PrivacyDatabase] = None
     _privacy_enforcement: Optional[PrivacyEnforcement] = None
@@ -46,6 +51,14 @@ class CollectionPartUpload(CollectionPartGet, CollectionPartCache,
             raise pathutils.UnsafePathError(href)
         path = pathutils.path_to_filesystem(self._filesystem_path, href, self._is_collision_free)
         old_item = self._get(href, verify_href=False)
+        manifest = None
+        if self._storage._use_collection_manifest is True:
+            manifest = self._read_manifest()
+        change_log_is_current = (self._storage._use_sync_change_log is True and
+                                 self._change_log_is_current())
+        item_index = None
+        if self._storage._use_item_index is True:
+            item_index = self._read_item_index()
 
         # Debug logging for item properties
         logger.debug("Item component name: %r", item.component_name)
@@ -73,6 +86,8 @@ class CollectionPartUpload(CollectionPartGet, CollectionPartCache,
             logger.error("Failed to store item %r in collection %r: %s", href, self.path, str(e))
             raise ValueError("Failed to store item %r in collection %r: %s" %
                              (href, self.path, e)) from e
+        if self._storage._item_memory_cache is not None:
+            self._storage._item_memory_cache.invalidate(path)
 
         # store cache file
         if self._storage._use_mtime_and_size_for_item_cache is True:
@@ -91,9 +106,21 @@ class CollectionPartUpload(CollectionPartGet, CollectionPartCache,
         # Track the change
         self._update_history_etag(href, item)
         self._clean_history()
+        if self._storage._use_sync_change_log is True:
+            self._log_changes([(href, item)], change_log_is_current)
         uploaded_item = self._get(href, verify_href=False)
         if uploaded_item is None:
             raise RuntimeError("Storage modified externally")
+        if manifest is not None:
+            self._update_manifest(
+                manifest,
+                removed=[(href, old_item.etag)] if old_item else [],
+                added=[(href, uploaded_item.etag)])
+        if item_index is not None:
+            self._update_item_index(item_index, removed=[href],
+                                    added=[uploaded_item])
+        self._storage.events.emit(
+            UpsertEvent(self.path, href, uploaded_item, old_item))
         return uploaded_item, old_item
 
     def _upload_all_nonatomic(self, items: Iterable[radicale_item.Item],
@@ -115,68 +142,68 @@ class CollectionPartUpload(CollectionPartGet, CollectionPartCache,
 
         cache_folder = self._storage._get_collection_cache_subfolder(self._filesystem_path, ".Radicale.cache", "item")
         self._storage._makedirs_synced(cache_folder)
+        packed_entries = []
 
-        # PRIVACY: Get privacy enforcement instance
+        # PRIVACY: Apply privacy enforcement to all items at once
         try:
             privacy_enforcement = PrivacyEnforcement.get_instance(self._storage.configuration)
+            items = privacy_enforcement.enforce_privacy_bulk(items)
         except Exception as e:
-            logger.error("Failed to get privacy enforcement instance: %s", str(e))
-            raise ValueError("Failed to get privacy enforcement instance: %s" % e) from e
-
-        for item in items:
-            uid = item.uid
-            logger.debug("Store item from list with uid: '%s'" % uid)
-
-            # PRIVACY: Apply privacy enforcement
-            try:
-                item = privacy_enforcement.enforce_privacy(item)
-            except Exception as e:
-                logger.error("Privacy enforcement error when uploading item with uid %r: %s", uid, str(e))
-                raise ValueError("Privacy enforcement error when uploading item with uid %r: %s" %
-                                 (uid, e)) from e
-
-            cache_content = self._item_cache_content(item)
-            for href in get_safe_free_hrefs(uid):
-                path = os.path.join(self._filesystem_path, href)
+            logger.error("Privacy enforcement error when uploading items to %r: %s", self.path, str(e))
+            raise ValueError("Privacy enforcement error when uploading items to %r: %s" %
+                             (self.path, e)) from e
+
+        # Sync all files together instead of one after another
+        with self._storage._group_fsync() as fsync:
+            for item in items:
+                uid = item.uid
+                logger.debug("Store item from list with uid: '%s'" % uid)
+
+                cache_content = self._item_cache_content(item)
+                for href in get_safe_free_hrefs(uid):
+                    path = os.path.join(self._filesystem_path, href)
+                    try:
+                        f = open(path,
+                                 "w", newline="", encoding=self._encoding)
+                    except OSError as e:
+                        if (sys.platform != "win32" and e.errno == errno.EINVAL or
+                                sys.platform == "win32" and e.errno == 123):
+                            # not a valid filename
+                            continue
+                        raise
+                    break
+                else:
+                    raise RuntimeError("No href found for item %r in temporary "
+                                       "collection %r" % (uid, self.path))
+
                 try:
-                    f = open(path,
-                             "w", newline="", encoding=self._encoding)
-                except OSError as e:
-                    if (sys.platform != "win32" and e.errno == errno.EINVAL or
-                            sys.platform == "win32" and e.errno == 123):
-                        # not a valid filename
-                        continue
-                    raise
-                break
-            else:
-                raise RuntimeError("No href found for item %r in temporary "
-                                   "collection %r" % (uid, self.path))
-
-            try:
-                with f:
-                    f.write(item.serialize())
-                    f.flush()
-                    self._storage._fsync(f)
-            except Exception as e:
-                raise ValueError(
-                    "Failed to store item %r in temporary collection %r: %s" %
-                    (uid, self.path, e)) from e
-
-            # store cache file
-            if self._storage._use_mtime_and_size_for_item_cache is True:
-                cache_hash = self._item_cache_mtime_and_size(os.stat(path).st_size, os.stat(path).st_mtime_ns)
-                if self._storage._debug_cache_actions is True:
-                    logger.debug("Item cache store  for: %r with mtime and size %r", path, cache_hash)
-            else:
-                cache_hash = self._item_cache_hash(item.serialize().encode(self._encoding))
+                    with f:
+                        f.write(item.serialize())
+                    fsync(path)
+                except Exception as e:
+                    raise ValueError(
+                        "Failed to store item %r in temporary collection %r: %s" %
+                        (uid, self.path, e)) from e
+
+                # store cache file
+                if self._storage._use_mtime_and_size_for_item_cache is True:
+                    cache_hash = self._item_cache_mtime_and_size(os.stat(path).st_size, os.stat(path).st_mtime_ns)
+                    if self._storage._debug_cache_actions is True:
+                        logger.debug("Item cache store  for: %r with mtime and size %r", path, cache_hash)
+                else:
+                    cache_hash = self._item_cache_hash(item.serialize().encode(self._encoding))
+                    if self._storage._debug_cache_actions is True:
+                        logger.debug("Item cache store  for: %r with hash %r", path, cache_hash)
+                if self._storage._use_packed_item_cache is True:
+                    packed_entries.append((href, cache_hash, cache_content))
+                    continue
+                path_cache = os.path.join(cache_folder, href)
                 if self._storage._debug_cache_actions is True:
-                    logger.debug("Item cache store  for: %r with hash %r", path, cache_hash)
-            path_cache = os.path.join(cache_folder, href)
-            if self._storage._debug_cache_actions is True:
-                logger.debug("Item cache store into: %r", path_cache)
-            with open(os.path.join(cache_folder, href), "wb") as fb:
-                pickle.dump((cache_hash, *cache_content), fb)
-                fb.flush()
-                self._storage._fsync(fb)
+                    logger.debug("Item cache store into: %r", path_cache)
+                with open(path_cache, "wb") as fb:
+                    fb.write(self._dump_item_cache(cache_hash, cache_content))
+                fsync(path_cache)
+        if packed_entries:
+            self._item_cache_pack().store(packed_entries)
         self._storage._sync_directory(cache_folder)
         self._storage._sync_directory(self._filesystem_path)
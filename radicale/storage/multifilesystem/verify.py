@@ -17,76 +17,263 @@
 # You should have received a copy of the GNU General Public License
 # along with Radicale.  If not, see <http://www.gnu.org/licenses/>.
 
-from typing import Iterator, Optional, Set
+import collections
+import json
+import os
+import pickle
+import posixpath
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import (Any, BinaryIO, Deque, Dict, Iterator, List, Optional, Set,
+                    Tuple, cast)
 
-from radicale import pathutils, storage, types
+from radicale import pathutils
 from radicale.log import logger
+from radicale.storage import multifilesystem
 from radicale.storage.multifilesystem.base import StorageBase
+from radicale.storage.multifilesystem.cache import (CacheContent,
+                                                    parse_item_cache_content)
 from radicale.storage.multifilesystem.discover import StoragePartDiscover
+from radicale.storage.multifilesystem.rebuild_cache import CHUNK_SIZE
+
+# Version of the file with the hashes of the verified items
+VERIFIED_VERSION = 1
+
+# Number of collections in progress per worker process
+COLLECTIONS_PER_WORKER = 2
+
+
+def _parse_item_timed(job: Tuple[str, str, bytes, str, bool]
+                      ) -> Tuple[Tuple[Optional[CacheContent], str], float]:
+    """``parse_item_cache_content`` and the time it took in the worker
+    process."""
+    start = time.monotonic()
+    result = parse_item_cache_content(job)
+    return result, time.monotonic() - start
+
+
+class _Verification:
+    """Verification of a collection in progress."""
+
+    def __init__(self, sane_path: str) -> None:
+        self.sane_path = sane_path
+        # Time spent on the collection, without the time it was queued
+        self.seconds = 0.0
+        self.collection: Optional["multifilesystem.Collection"] = None
+        self.failed = False
+        # href, hash of the file, item cache hash and the UID of unchanged
+        # items (``None`` if the item is parsed)
+        self.items: List[Tuple[str, str, str, Optional[str]]] = []
+        self.results: Iterator[Tuple[Tuple[Optional[CacheContent], str],
+                                     float]] = iter(())
 
 
 class StoragePartVerify(StoragePartDiscover, StorageBase):
 
-    def verify(self) -> bool:
+    @staticmethod
+    def _verified_path(collection: "multifilesystem.Collection") -> str:
+        return os.path.join(collection._filesystem_path, ".Radicale.cache",
+                            "verified")
+
+    def _read_verified(self, collection: "multifilesystem.Collection"
+                       ) -> Dict[str, Tuple[str, str]]:
+        """Hash and UID of the items verified by the last run."""
+        try:
+            with open(self._verified_path(collection), "rb") as f:
+                version, verified = pickle.load(f)
+            if version == VERIFIED_VERSION:
+                return verified
+        except FileNotFoundError:
+            pass
+        except (pickle.UnpicklingError, ValueError, TypeError, EOFError) as e:
+            logger.warning("Ignoring invalid verification state of "
+                           "collection %r: %s", collection.path, e)
+        return {}
+
+    def _write_verified(self, collection: "multifilesystem.Collection",
+                        verified: Dict[str, Tuple[str, str]]) -> None:
+        path = self._verified_path(collection)
+        try:
+            self._makedirs_synced(os.path.dirname(path))
+            # TODO: better fix for "mypy"
+            with collection._atomic_write(path, "wb") as fo:  # type: ignore
+                fb = cast(BinaryIO, fo)
+                pickle.dump((VERIFIED_VERSION, verified), fb)
+        except OSError as e:
+            logger.warning("Failed to write verification state of "
+                           "collection %r: %s", collection.path, e)
+
+    def _start_verification(self, sane_path: str, executor: Executor,
+                            incremental: bool) -> _Verification:
+        """Read the items of the collection and queue the parsing."""
+        verification = _Verification(sane_path)
+        start = time.monotonic()
+        logger.info("Verifying   path %r", sane_path)
+        try:
+            collection = self._collection_class(
+                cast(multifilesystem.Storage, self),
+                pathutils.unstrip_path(sane_path, True))
+            collection.get_meta()
+            verification.collection = collection
+            if not collection.tag:
+                logger.info("Skip !collection %r", sane_path)
+                return verification
+            verified = self._read_verified(collection) if incremental else {}
+            jobs = []
+            for href in collection._list():
+                path = os.path.join(collection._filesystem_path, href)
+                try:
+                    with open(path, "rb") as f:
+                        raw_text = f.read()
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                item_hash = collection._item_cache_hash(raw_text)
+                cache_hash = collection._item_file_cache_hash(raw_text, st)
+                known = verified.get(href)
+                if known is not None and known[0] == item_hash:
+                    verification.items.append(
+                        (href, item_hash, cache_hash, known[1]))
+                    continue
+                verification.items.append((href, item_hash, cache_hash, None))
+                # The items are checked completely with vobject
+                jobs.append((collection.path, collection.tag, raw_text,
+                             collection._encoding, False))
+            verification.results = executor.map(
+                _parse_item_timed, jobs, chunksize=CHUNK_SIZE)
+        except Exception as e:
+            verification.failed = True
+            logger.error("Invalid collection %r: %s", sane_path, e,
+                         exc_info=True)
+        finally:
+            verification.seconds += time.monotonic() - start
+        return verification
+
+    def _finish_verification(self, verification: _Verification,
+                             has_child_collections: bool
+                             ) -> Tuple[int, Dict[str, Any]]:
+        """Check the parsed items of the collection.
+
+        Returns the number of invalid items and the report of the
+        collection.
+
+        """
+        start = time.monotonic()
+        sane_path = verification.sane_path
+        collection = verification.collection
+        report: Dict[str, Any] = {"path": sane_path}
+        if verification.failed or collection is None or not collection.tag:
+            report["status"] = "invalid" if verification.failed else "skipped"
+            report["seconds"] = round(
+                verification.seconds + time.monotonic() - start, 3)
+            return 0, report
+        # Time spent waiting for the worker processes
+        waited = 0.0
+        item_errors = count = parsed = 0
+        uids: Set[str] = set()
+        verified: Dict[str, Tuple[str, str]] = {}
+        with collection._acquire_cache_lock("item"):
+            for href, item_hash, cache_hash, uid in verification.items:
+                if uid is None:
+                    wait_start = time.monotonic()
+                    (content, error), parse_seconds = next(
+                        verification.results)
+                    waited += time.monotonic() - wait_start
+                    verification.seconds += parse_seconds
+                    parsed += 1
+                    if content is None:
+                        item_errors += 1
+                        logger.error("Invalid item %r in %r: %s",
+                                     href, sane_path, error)
+                        continue
+                    if collection._load_item_cache(href, cache_hash) is None:
+                        collection._store_item_cache_content(
+                            href, cache_hash, content)
+                    uid = content.uid
+                if uid in uids:
+                    logger.error("Invalid item %r in %r: UID conflict %r",
+                                 href, sane_path, uid)
+                    continue
+                uids.add(uid)
+                verified[href] = (item_hash, uid)
+                count += 1
+                logger.debug("Verified in %r item %r", sane_path, href)
+        if item_errors == 0:
+            try:
+                collection.sync()
+            except Exception as e:
+                item_errors += 1
+                logger.error("Invalid collection %r: %s", sane_path, e,
+                             exc_info=True)
+        if has_child_collections:
+            logger.error("Invalid collection %r: %r must not have "
+                         "child collections", sane_path, collection.tag)
+        self._write_verified(collection, verified)
+        logger.info("Verified collect %r (items: %d)", sane_path, count)
+        report.update({
+            "status": "invalid" if item_errors else "valid",
+            "tag": collection.tag, "items": count,
+            "parsed": parsed, "skipped": len(verification.items) - parsed,
+            "errors": item_errors,
+            "seconds": round(verification.seconds + time.monotonic() - start
+                             - waited, 3)})
+        return item_errors, report
+
+    def verify(self, workers: int = 0, incremental: bool = False,
+               report: str = "") -> bool:
+        """Check the storage for errors.
+
+        ``workers`` is the number of processes parsing items (0: number of
+        CPUs), several collections are verified at the same time.
+
+        ``incremental`` skips items that are unchanged since they were
+        verified the last time.
+
+        ``report`` is the path of a JSON file that receives the results and
+        timings of all collections. The time of a collection is spent
+        reading, parsing (summed over the worker processes) and checking its
+        items, without the time it was queued.
+
+        """
+        start = time.monotonic()
         item_errors = collection_errors = 0
         logger.info("Disable fsync during storage verification")
         self._filesystem_fsync = False
+        sane_paths = list(self._collection_paths())
+        parent_paths = {posixpath.dirname(sane_path)
+                        for sane_path in sane_paths if sane_path}
+        reports: List[Dict[str, Any]] = []
+        workers = workers or os.cpu_count() or 1
+        pending: Deque[_Verification] = collections.deque()
 
-        @types.contextmanager
-        def exception_cm(sane_path: str, href: Optional[str]
-                         ) -> Iterator[None]:
+        def finish_next() -> None:
             nonlocal item_errors, collection_errors
-            try:
-                yield
-            except Exception as e:
-                if href is not None:
-                    item_errors += 1
-                    name = "item %r in %r" % (href, sane_path)
-                else:
-                    collection_errors += 1
-                    name = "collection %r" % sane_path
-                logger.error("Invalid %s: %s", name, e, exc_info=True)
-
-        remaining_sane_paths = [""]
-        while remaining_sane_paths:
-            sane_path = remaining_sane_paths.pop(0)
-            path = pathutils.unstrip_path(sane_path, True)
-            logger.info("Verifying   path %r", sane_path)
-            count = 0
-            is_collection = True
-            with exception_cm(sane_path, None):
-                saved_item_errors = item_errors
-                collection: Optional[storage.BaseCollection] = None
-                uids: Set[str] = set()
-                has_child_collections = False
-                for item in self.discover(path, "1", exception_cm):
-                    if not collection:
-                        assert isinstance(item, storage.BaseCollection)
-                        collection = item
-                        collection.get_meta()
-                        if not collection.tag:
-                            is_collection = False
-                            logger.info("Skip !collection %r", sane_path)
-                        continue
-                    if isinstance(item, storage.BaseCollection):
-                        has_child_collections = True
-                        remaining_sane_paths.append(item.path)
-                    elif item.uid in uids:
-                        logger.error("Invalid item %r in %r: UID conflict %r",
-                                     item.href, sane_path, item.uid)
-                    else:
-                        uids.add(item.uid)
-                        count += 1
-                        logger.debug("Verified in %r item %r",
-                                     sane_path, item.href)
-                assert collection
-                if item_errors == saved_item_errors:
-                    if is_collection:
-                        collection.sync()
-                if has_child_collections and collection.tag:
-                    logger.error("Invalid collection %r: %r must not have "
-                                 "child collections", sane_path,
-                                 collection.tag)
-            if is_collection:
-                logger.info("Verified collect %r (items: %d)", sane_path, count)
+            verification = pending.popleft()
+            if verification.failed:
+                collection_errors += 1
+            errors, collection_report = self._finish_verification(
+                verification, verification.sane_path in parent_paths)
+            item_errors += errors
+            reports.append(collection_report)
+
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            # Start the worker processes before acquiring any cache lock,
+            # forked processes inherit the open lock files and would hold
+            # them until they exit. (The storage lock is held by the caller
+            # during the whole verification.)
+            executor.submit(int).result()
+            for sane_path in sane_paths:
+                pending.append(self._start_verification(
+                    sane_path, executor, incremental))
+                if len(pending) > workers * COLLECTIONS_PER_WORKER:
+                    finish_next()
+            while pending:
+                finish_next()
+        if report:
+            with open(report, "w", encoding="utf-8") as f:
+                json.dump({"collections": reports,
+                           "item_errors": item_errors,
+                           "collection_errors": collection_errors,
+                           "seconds": round(time.monotonic() - start, 3)},
+                          f, indent=2)
         return item_errors == 0 and collection_errors == 0
@@ -95,7 +95,7 @@ class Collection(multifilesystem.Collection):
 
     @types.contextmanager
     def _acquire_cache_lock(self, ns: str = "") -> Iterator[None]:
-        if self._storage._lock.locked == "w":
+        if self._storage._write_locked:
             yield
             return
         with self._storage._cache_lock.acquire((self.path, ns)):
@@ -0,0 +1,760 @@
+# This file is part of Radicale - CalDAV and CardDAV server
+#
+# This library is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Radicale.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Storage backend that keeps all collections in a SQLite database.
+
+Collections are rows of the table ``collections`` with their properties as
+JSON. Items are stored with their UID, etag, component name and time range
+in indexed columns, so reports and UID checks don't parse the items.
+
+Every change of an item increments the sequence number of its collection
+and records the href with the new etag (empty for deleted items) in the
+table ``history``. A sync token is the random id of the collection followed
+by its sequence number, the changes since a token are the history records
+with a greater sequence number.
+
+"""
+
+import base64
+import binascii
+import json
+import os
+import posixpath
+import sqlite3
+import threading
+import time
+import xml.etree.ElementTree as ET
+from email.utils import parsedate_to_datetime
+from typing import (Callable, ContextManager, Dict, Iterable, Iterator, List,
+                    Mapping, Optional, Sequence, Set, Tuple, Union, overload)
+
+import radicale.item as radicale_item
+from radicale import config, pathutils, storage, types, utils
+from radicale.item import filter as radicale_filter
+from radicale.log import logger
+from radicale.privacy.enforcement import PrivacyEnforcement
+from radicale.storage.events import (CollectionEvent, DeleteEvent, MetaEvent,
+                                     MoveEvent, UpsertEvent)
+
+SCHEMA_VERSION = 1
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS collections (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    parent TEXT,
+    props TEXT NOT NULL,
+    modified REAL NOT NULL,
+    sync_id TEXT NOT NULL,
+    sync_seq INTEGER NOT NULL DEFAULT 0,
+    sync_floor INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS collections_parent ON collections (parent);
+CREATE TABLE IF NOT EXISTS items (
+    collection INTEGER NOT NULL
+        REFERENCES collections (id) ON DELETE CASCADE,
+    href TEXT NOT NULL,
+    uid TEXT NOT NULL,
+    etag TEXT NOT NULL,
+    name TEXT NOT NULL,
+    component TEXT NOT NULL,
+    start_time INTEGER NOT NULL,
+    end_time INTEGER NOT NULL,
+    modified REAL NOT NULL,
+    size INTEGER NOT NULL,
+    text TEXT NOT NULL,
+    PRIMARY KEY (collection, href)
+);
+CREATE INDEX IF NOT EXISTS items_uid ON items (collection, uid);
+CREATE INDEX IF NOT EXISTS items_time_range
+    ON items (collection, start_time, end_time);
+CREATE TABLE IF NOT EXISTS history (
+    collection INTEGER NOT NULL
+        REFERENCES collections (id) ON DELETE CASCADE,
+    href TEXT NOT NULL,
+    etag TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    modified REAL NOT NULL,
+    PRIMARY KEY (collection, href)
+);
+CREATE INDEX IF NOT EXISTS history_seq ON history (collection, seq);
+"""
+
+ITEM_COLUMNS = ("href, uid, etag, name, component, start_time, end_time, "
+                "modified, size, text")
+
+# Maximum number of parameters of a single statement
+MAX_VARIABLES = 500
+
+SYNC_TOKEN_PREFIX = "http://radicale.org/ns/sync/"
+
+
+def _new_sync_id() -> str:
+    return binascii.hexlify(os.urandom(16)).decode("ascii")
+
+
+def _http_date(timestamp: float) -> str:
+    return time.strftime("%a, %d %b %Y %H:%M:%S GMT", time.gmtime(timestamp))
+
+
+class Collection(storage.BaseCollection):
+
+    _storage: "Storage"
+    _id: int
+    _path: str
+    _meta: Optional[Mapping[str, str]]
+
+    def __init__(self, storage_: "Storage", row: sqlite3.Row) -> None:
+        self._storage = storage_
+        self._id = row["id"]
+        self._path = row["path"]
+        self._props = row["props"]
+        self._modified = row["modified"]
+        self._meta = None
+
+    @property
+    def path(self) -> str:
+        return self._path
+
+    def _item(self, row: sqlite3.Row) -> "radicale_item.Item":
+        return radicale_item.Item(
+            collection=self, href=row["href"],
+            last_modified=_http_date(row["modified"]), etag=row["etag"],
+            text=row["text"], uid=row["uid"], name=row["name"],
+            component_name=row["component"],
+            time_range=(row["start_time"], row["end_time"]))
+
+    def _check_size(self, row: sqlite3.Row) -> bool:
+        limit = self._storage._max_resource_size
+        if row["size"] > limit:
+            logger.warning("item skipped because size exceeds limit %s > %s: "
+                           "%r in %r", utils.format_unit(row["size"], binary=True),
+                           utils.format_unit(limit, binary=True),
+                           row["href"], self.path)
+            return False
+        return True
+
+    def _query_items(self, where: str = "", parameters: Sequence = ()
+                     ) -> Iterator["radicale_item.Item"]:
+        cursor = self._storage._connection().execute(
+            "SELECT %s FROM items WHERE collection = ?%s ORDER BY href" %
+            (ITEM_COLUMNS, where), (self._id, *parameters))
+        for row in cursor:
+            if self._check_size(row):
+                yield self._item(row)
+
+    def get_multi(self, hrefs: Iterable[str]
+                  ) -> Iterator[Tuple[str, Optional["radicale_item.Item"]]]:
+        hrefs = list(dict.fromkeys(hrefs))
+        connection = self._storage._connection()
+        for i in range(0, len(hrefs), MAX_VARIABLES):
+            batch = hrefs[i:i + MAX_VARIABLES]
+            found = set()
+            for row in connection.execute(
+                    "SELECT %s FROM items WHERE collection = ? AND href IN "
+                    "(%s)" % (ITEM_COLUMNS, ", ".join("?" * len(batch))),
+                    (self._id, *batch)):
+                found.add(row["href"])
+                yield row["href"], (self._item(row) if self._check_size(row)
+                                    else None)
+            for href in batch:
+                if href not in found:
+                    yield href, None
+
+    def get_all(self) -> Iterator["radicale_item.Item"]:
+        return self._query_items()
+
+    def get_filtered(self, filters: Iterable[ET.Element]
+                     ) -> Iterator[Tuple["radicale_item.Item", bool]]:
+        if not self.tag:
+            return
+        tag, start, end, simple = radicale_filter.simplify_prefilters(
+            filters, self.tag)
+        where = " AND start_time < ? AND end_time > ?"
+        parameters: List[Union[str, int]] = [end, start]
+        if tag is not None:
+            where += " AND component = ?"
+            parameters.append(tag)
+        for item in self._query_items(where, parameters):
+            istart, iend = item.time_range
+            yield item, simple and (start <= istart or iend <= end)
+
+    def has_uid(self, uid: str) -> bool:
+        return self._storage._connection().execute(
+            "SELECT 1 FROM items WHERE collection = ? AND uid = ? LIMIT 1",
+            (self._id, uid)).fetchone() is not None
+
+    def _get(self, href: str) -> Optional["radicale_item.Item"]:
+        row = self._storage._connection().execute(
+            "SELECT %s FROM items WHERE collection = ? AND href = ?" %
+            ITEM_COLUMNS, (self._id, href)).fetchone()
+        if row is None or not self._check_size(row):
+            return None
+        return self._item(row)
+
+    def _log_change(self, connection: sqlite3.Connection, href: str,
+                    etag: str, now: float) -> None:
+        """Record the change of ``href`` in the history (in a transaction)."""
+        connection.execute(
+            "UPDATE collections SET sync_seq = sync_seq + 1, modified = ? "
+            "WHERE id = ?", (now, self._id))
+        connection.execute(
+            "INSERT OR REPLACE INTO history (collection, href, etag, seq, "
+            "modified) SELECT id, ?, ?, sync_seq, ? FROM collections "
+            "WHERE id = ?", (href, etag, now, self._id))
+        self._modified = now
+
+    def _insert_item(self, connection: sqlite3.Connection, href: str,
+                     item: "radicale_item.Item", now: float) -> str:
+        """Store ``item`` (in a transaction), returns its etag."""
+        text = item.serialize()
+        etag = radicale_item.get_etag(text)
+        start, end = item.time_range
+        connection.execute(
+            "INSERT OR REPLACE INTO items (collection, %s) VALUES "
+            "(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)" % ITEM_COLUMNS,
+            (self._id, href, item.uid, etag, item.name, item.component_name,
+             start, end, now, len(text.encode(self._storage._encoding)),
+             text))
+        return etag
+
+    def upload(self, href: str, item: "radicale_item.Item"
+               ) -> Tuple["radicale_item.Item", Optional["radicale_item.Item"]]:
+        if not pathutils.is_safe_path_component(href):
+            raise pathutils.UnsafePathError(href)
+        old_item = self._get(href)
+        # PRIVACY: Apply privacy enforcement
+        try:
+            item = PrivacyEnforcement.get_instance(
+                self._storage.configuration).enforce_privacy(item)
+        except Exception as e:
+            logger.error("Privacy enforcement error when uploading %r: %s",
+                         href, e)
+            raise ValueError("Privacy enforcement error when uploading %r: "
+                             "%s" % (href, e)) from e
+        now = time.time()
+        connection = self._storage._connection()
+        try:
+            with connection:
+                etag = self._insert_item(connection, href, item, now)
+                self._log_change(connection, href, etag, now)
+        except sqlite3.Error as e:
+            raise ValueError("Failed to store item %r in collection %r: %s" %
+                             (href, self.path, e)) from e
+        uploaded_item = self._get(href)
+        if uploaded_item is None:
+            raise RuntimeError("Storage modified externally")
+        self._storage.events.emit(
+            UpsertEvent(self.path, href, uploaded_item, old_item))
+        return uploaded_item, old_item
+
+    def delete(self, href: Optional[str] = None) -> None:
+        connection = self._storage._connection()
+        if href is None:
+            # Delete the collection and all collections below it
+            with connection:
+                self._storage._delete_collection_rows(connection, self.path)
+                # The root collection always exists
+                self._storage._ensure_collection(connection, "")
+            self._storage.events.emit(DeleteEvent(self.path, None, None))
+            return
+        if not pathutils.is_safe_path_component(href):
+            raise pathutils.UnsafePathError(href)
+        old_item = self._get(href)
+        if old_item is None:
+            raise storage.ComponentNotFoundError(href)
+        with connection:
+            connection.execute(
+                "DELETE FROM items WHERE collection = ? AND href = ?",
+                (self._id, href))
+            self._log_change(connection, href, "", time.time())
+        self._storage.events.emit(DeleteEvent(self.path, href, old_item))
+
+    @overload
+    def get_meta(self, key: None = None) -> Mapping[str, str]: ...
+
+    @overload
+    def get_meta(self, key: str) -> Optional[str]: ...
+
+    def get_meta(self, key: Optional[str] = None) -> Union[Mapping[str, str],
+                                                           Optional[str]]:
+        if self._meta is None:
+            try:
+                self._meta = radicale_item.check_and_sanitize_props(
+                    json.loads(self._props))
+            except ValueError as e:
+                raise RuntimeError("Failed to load properties of collection "
+                                   "%r: %s" % (self.path, e)) from e
+        return self._meta if key is None else self._meta.get(key)
+
+    def set_meta(self, props: Mapping[str, str]) -> None:
+        self._props = json.dumps(props, sort_keys=True)
+        self._meta = None
+        self._modified = time.time()
+        connection = self._storage._connection()
+        with connection:
+            connection.execute(
+                "UPDATE collections SET props = ?, modified = ? WHERE id = ?",
+                (self._props, self._modified, self._id))
+        self._storage.events.emit(MetaEvent(self.path, props))
+
+    @property
+    def etag(self) -> str:
+        etag = radicale_item.sha256()
+        for href, item_etag in self._storage._connection().execute(
+                "SELECT href, etag FROM items WHERE collection = ? "
+                "ORDER BY href", (self._id,)):
+            etag.update((href + "/" + item_etag).encode())
+        etag.update(json.dumps(self.get_meta(), sort_keys=True).encode())
+        return '"%s"' % etag.hexdigest()
+
+    @property
+    def last_modified(self) -> str:
+        return _http_date(self._modified)
+
+    def sync(self, old_token: str = "") -> Tuple[str, Iterable[str]]:
+        old_token_name = ""
+        if old_token:
+            if not old_token.startswith(SYNC_TOKEN_PREFIX):
+                raise ValueError("Malformed token: %r" % old_token)
+            old_token_name = old_token[len(SYNC_TOKEN_PREFIX):]
+            if len(old_token_name) != 64 or old_token_name.strip(
+                    "0123456789abcdef"):
+                raise ValueError("Malformed token: %r" % old_token)
+        connection = self._storage._connection()
+        self._storage._clean_history(connection, self._id)
+        sync_id, sync_seq, sync_floor = connection.execute(
+            "SELECT sync_id, sync_seq, sync_floor FROM collections "
+            "WHERE id = ?", (self._id,)).fetchone()
+        token_name = "%s%032x" % (sync_id, sync_seq)
+        token = SYNC_TOKEN_PREFIX + token_name
+        if not old_token_name:
+            return token, [row[0] for row in connection.execute(
+                "SELECT href FROM items WHERE collection = ? ORDER BY href",
+                (self._id,))]
+        if token_name == old_token_name:
+            # Nothing changed
+            return token, ()
+        old_seq = int(old_token_name[32:], 16)
+        if (old_token_name[:32] != sync_id or old_seq > sync_seq or
+                old_seq < sync_floor):
+            raise ValueError("Token not found: %r" % old_token)
+        return token, [row[0] for row in connection.execute(
+            "SELECT href FROM history WHERE collection = ? AND seq > ? "
+            "ORDER BY href", (self._id, old_seq))]
+
+
+class Storage(storage.BaseStorage):
+
+    _is_collision_free: bool = True
+    _supports_unicode: bool = True
+    _supports_trailing_whitespace: bool = True
+    _supports_problematic_chars: bool = True
+
+    _database_path: str
+    _encoding: str
+    _max_resource_size: int
+    _max_sync_token_age: int
+    _synchronous: bool
+    _lock: pathutils.RwLock
+    _local: threading.local
+
+    def __init__(self, configuration: config.Configuration) -> None:
+        super().__init__(configuration)
+        filesystem_folder = configuration.get("storage", "filesystem_folder")
+        self._database_path = (
+            configuration.get("storage", "sqlite_database") or
+            os.path.join(filesystem_folder, ".Radicale.sqlite"))
+        self._encoding = configuration.get("encoding", "stock")
+        self._max_resource_size = int(configuration.get(
+            "server", "max_resource_size") * 0.95)
+        self._max_sync_token_age = configuration.get(
+            "storage", "max_sync_token_age")
+        self._synchronous = configuration.get("storage", "_filesystem_fsync")
+        if configuration.get("storage", "hook"):
+            logger.warning("Storage hook is not supported by the sqlite "
+                           "storage and ignored")
+        os.makedirs(os.path.dirname(self._database_path), exist_ok=True)
+        self._lock = pathutils.RwLock(self._database_path + ".lock")
+        self._local = threading.local()
+        logger.info("Storage database: %r", self._database_path)
+        connection = self._connection()
+        version = connection.execute("PRAGMA user_version").fetchone()[0]
+        if version > SCHEMA_VERSION:
+            raise RuntimeError("Unsupported schema version %d of storage "
+                               "database %r" % (version, self._database_path))
+        with connection:
+            connection.executescript(SCHEMA)
+            connection.execute("PRAGMA user_version = %d" % SCHEMA_VERSION)
+            self._ensure_collection(connection, "")
+
+    def _connection(self) -> sqlite3.Connection:
+        """Connection of the current thread."""
+        connection: Optional[sqlite3.Connection] = getattr(
+            self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self._database_path, timeout=60,
+                                         check_same_thread=False)
+            connection.row_factory = sqlite3.Row
+            connection.execute("PRAGMA foreign_keys = ON")
+            connection.execute("PRAGMA journal_mode = WAL")
+            connection.execute("PRAGMA synchronous = %s" % (
+                "FULL" if self._synchronous else "OFF"))
+            self._local.connection = connection
+        return connection
+
+    def _collection_row(self, connection: sqlite3.Connection, sane_path: str
+                        ) -> Optional[sqlite3.Row]:
+        return connection.execute(
+            "SELECT id, path, props, modified FROM collections WHERE path = ?",
+            (sane_path,)).fetchone()
+
+    def _ensure_collection(self, connection: sqlite3.Connection,
+                           sane_path: str) -> sqlite3.Row:
+        """Get the collection, create it and its parents if missing (in a
+        transaction)."""
+        row = self._collection_row(connection, sane_path)
+        if row is not None:
+            return row
+        parent = None
+        if sane_path:
+            parent = posixpath.dirname(sane_path)
+            self._ensure_collection(connection, parent)
+        connection.execute(
+            "INSERT INTO collections (path, parent, props, modified, sync_id) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (sane_path, parent, "{}", time.time(), _new_sync_id()))
+        row = self._collection_row(connection, sane_path)
+        assert row is not None
+        return row
+
+    def _delete_collection_rows(self, connection: sqlite3.Connection,
+                                sane_path: str) -> None:
+        """Delete the collection and all collections below it (in a
+        transaction)."""
+        if sane_path:
+            connection.execute(
+                "DELETE FROM collections WHERE path = ? OR "
+                "substr(path, 1, ?) = ?",
+                (sane_path, len(sane_path) + 1, sane_path + "/"))
+        else:
+            connection.execute("DELETE FROM collections")
+
+    def _clean_history(self, connection: sqlite3.Connection,
+                       collection_id: int) -> None:
+        """Delete the expired history records of deleted items."""
+        age_limit = time.time() - self._max_sync_token_age
+        with connection:
+            floor = connection.execute(
+                "SELECT max(seq) FROM history WHERE collection = ? AND "
+                "etag = '' AND modified < ?",
+                (collection_id, age_limit)).fetchone()[0]
+            if floor is None:
+                return
+            connection.execute(
+                "DELETE FROM history WHERE collection = ? AND etag = '' AND "
+                "modified < ?", (collection_id, age_limit))
+            connection.execute(
+                "UPDATE collections SET sync_floor = max(sync_floor, ?) "
+                "WHERE id = ?", (floor, collection_id))
+
+    def discover(
+            self, path: str, depth: str = "0",
+            child_context_manager: Optional[
+            Callable[[str, Optional[str]], ContextManager[None]]] = None,
+            user_groups: Set[str] = set([])
+            ) -> Iterator[types.CollectionOrItem]:
+        # Path should already be sanitized
+        sane_path = pathutils.strip_path(path)
+        connection = self._connection()
+        row = self._collection_row(connection, sane_path)
+        if row is None:
+            if not sane_path:
+                return
+            parent_path, href = posixpath.split(sane_path)
+            parent_row = self._collection_row(connection, parent_path)
+            if parent_row is None:
+                return
+            item_row = connection.execute(
+                "SELECT %s FROM items WHERE collection = ? AND href = ?" %
+                ITEM_COLUMNS, (parent_row["id"], href)).fetchone()
+            if item_row is None:
+                return
+            collection = Collection(self, parent_row)
+            if collection._check_size(item_row):
+                yield collection._item(item_row)
+            return
+
+        collection = Collection(self, row)
+        yield collection
+
+        if depth == "0":
+            return
+
+        for item_row in connection.execute(
+                "SELECT %s FROM items WHERE collection = ? ORDER BY href" %
+                ITEM_COLUMNS, (row["id"],)):
+            if child_context_manager is None:
+                if collection._check_size(item_row):
+                    yield collection._item(item_row)
+                continue
+            with child_context_manager(sane_path, item_row["href"]):
+                if collection._check_size(item_row):
+                    yield collection._item(item_row)
+
+        child_rows = list(connection.execute(
+            "SELECT id, path, props, modified FROM collections "
+            "WHERE parent = ? ORDER BY path", (sane_path,)))
+        for group in user_groups:
+            href = base64.b64encode(group.encode('utf-8')).decode('ascii')
+            logger.debug(f"searching for group calendar {group} {href}")
+            group_row = self._collection_row(connection, f"GROUPS/{href}")
+            if group_row is not None:
+                child_rows.append(group_row)
+        for child_row in child_rows:
+            if child_context_manager is None:
+                yield Collection(self, child_row)
+                continue
+            with child_context_manager(child_row["path"], None):
+                yield Collection(self, child_row)
+
+    def move(self, item: "radicale_item.Item",
+             to_collection: storage.BaseCollection, to_href: str) -> None:
+        if not pathutils.is_safe_path_component(to_href):
+            raise pathutils.UnsafePathError(to_href)
+        assert isinstance(to_collection, Collection)
+        assert isinstance(item.collection, Collection)
+        assert item.href
+        from_collection = item.collection
+        replaced_item = None
+        if self.events.active:
+            replaced_item = to_collection._get(to_href)
+        now = time.time()
+        connection = self._connection()
+        with connection:
+            connection.execute(
+                "DELETE FROM items WHERE collection = ? AND href = ?",
+                (to_collection._id, to_href))
+            connection.execute(
+                "UPDATE items SET collection = ?, href = ?, modified = ? "
+                "WHERE collection = ? AND href = ?",
+                (to_collection._id, to_href, now, from_collection._id,
+                 item.href))
+            from_collection._log_change(connection, item.href, "", now)
+            to_collection._log_change(connection, to_href, item.etag, now)
+        self.events.emit(MoveEvent(from_collection.path, item.href,
+                                   to_collection.path, to_href, item,
+                                   replaced_item))
+
+    def _free_hrefs(self, taken: Set[str], uid: str, suffix: str
+                    ) -> Iterator[str]:
+        for href in [uid if uid.lower().endswith(suffix.lower())
+                     else uid + suffix,
+                     radicale_item.get_etag(uid).strip('"') + suffix]:
+            if pathutils.is_safe_path_component(href) and href not in taken:
+                yield href
+        yield radicale_item.find_available_uid(
+            lambda href: href in taken, suffix)
+
+    def create_collection(
+            self, href: str,
+            items: Optional[Iterable["radicale_item.Item"]] = None,
+            props: Optional[Mapping[str, str]] = None) -> Tuple[
+                Collection, Dict[str, "radicale_item.Item"], List[str]]:
+        # Path should already be sanitized
+        sane_path = pathutils.strip_path(href)
+        logger.debug("Create collection: %r" % sane_path)
+        connection = self._connection()
+        if not props:
+            with connection:
+                row = self._ensure_collection(connection, sane_path)
+            return Collection(self, row), {}, []
+
+        old_row = self._collection_row(connection, sane_path)
+        old_items: Dict[str, radicale_item.Item] = {}
+        if old_row is not None:
+            old_items = {item.href: item for item in
+                         Collection(self, old_row).get_all()
+                         if item.href is not None}
+        if items is not None and props.get("tag"):
+            # PRIVACY: Apply privacy enforcement to all items at once
+            try:
+                items = PrivacyEnforcement.get_instance(
+                    self.configuration).enforce_privacy_bulk(items)
+            except Exception as e:
+                logger.error("Privacy enforcement error when uploading items "
+                             "to %r: %s", sane_path, e)
+                raise ValueError("Privacy enforcement error when uploading "
+                                 "items to %r: %s" % (sane_path, e)) from e
+        else:
+            items = []
+        suffix = {"VCALENDAR": ".ics", "VADDRESSBOOK": ".vcf"}.get(
+            props.get("tag", ""), "")
+        now = time.time()
+        new_hrefs: List[str] = []
+        try:
+            with connection:
+                if old_row is not None:
+                    self._delete_collection_rows(connection, sane_path)
+                if sane_path:
+                    self._ensure_collection(connection,
+                                            posixpath.dirname(sane_path))
+                connection.execute(
+                    "INSERT INTO collections (path, parent, props, modified, "
+                    "sync_id) VALUES (?, ?, ?, ?, ?)",
+                    (sane_path, posixpath.dirname(sane_path) if sane_path
+                     else None, json.dumps(props, sort_keys=True), now,
+                     _new_sync_id()))
+                new_row = self._collection_row(connection, sane_path)
+                assert new_row is not None
+                collection = Collection(self, new_row)
+                taken: Set[str] = set()
+                for item in items:
+                    logger.debug("Store item from list with uid: '%s'" %
+                                 item.uid)
+                    item_href = next(self._free_hrefs(taken, item.uid,
+                                                      suffix))
+                    taken.add(item_href)
+                    new_hrefs.append(item_href)
+                    etag = collection._insert_item(connection, item_href,
+                                                   item, now)
+                    collection._log_change(connection, item_href, etag, now)
+        except sqlite3.Error as e:
+            raise ValueError("Failed to create collection %r: %s" %
+                             (href, e)) from e
+        new_row = self._collection_row(connection, sane_path)
+        assert new_row is not None
+        collection = Collection(self, new_row)
+        self.events.emit(CollectionEvent(sane_path, props,
+                                         old_row is not None))
+        replaced_items = {href: item for href, item in old_items.items()
+                          if href in taken}
+        return (collection, replaced_items,
+                [href for href in new_hrefs if href not in old_items])
+
+    def migrate(self, source: storage.BaseStorage) -> bool:
+        """Copy all collections of ``source`` into the database.
+
+        Collections that already exist in the database are replaced.
+
+        """
+        errors = 0
+        connection = self._connection()
+        remaining = [""]
+        while remaining:
+            sane_path = remaining.pop(0)
+            try:
+                discovered = iter(source.discover(
+                    pathutils.unstrip_path(sane_path, True), "1"))
+                collection = next(discovered)
+                assert isinstance(collection, storage.BaseCollection)
+                props = collection.get_meta()
+                items = []
+                for child in discovered:
+                    if isinstance(child, storage.BaseCollection):
+                        remaining.append(child.path)
+                    else:
+                        items.append(child)
+                try:
+                    modified = parsedate_to_datetime(
+                        collection.last_modified).timestamp()
+                except (ValueError, TypeError, NotImplementedError):
+                    modified = time.time()
+                with connection:
+                    if sane_path:
+                        self._delete_collection_rows(connection, sane_path)
+                        self._ensure_collection(connection,
+                                                posixpath.dirname(sane_path))
+                        connection.execute(
+                            "INSERT INTO collections (path, parent, props, "
+                            "modified, sync_id) VALUES (?, ?, ?, ?, ?)",
+                            (sane_path, posixpath.dirname(sane_path),
+                             json.dumps(props, sort_keys=True), modified,
+                             _new_sync_id()))
+                    else:
+                        connection.execute(
+                            "UPDATE collections SET props = ? WHERE path = ''",
+                            (json.dumps(props, sort_keys=True),))
+                    row = self._collection_row(connection, sane_path)
+                    assert row is not None
+                    target = Collection(self, row)
+                    for item in items:
+                        assert item.href
+                        try:
+                            item_modified = parsedate_to_datetime(
+                                item.last_modified or "").timestamp()
+                        except (ValueError, TypeError, NotImplementedError):
+                            item_modified = modified
+                        target._insert_item(connection, item.href, item,
+                                            item_modified)
+                        target._log_change(connection, item.href, item.etag,
+                                           modified)
+                logger.info("Migrated collection %r (items: %d)",
+                            sane_path, len(items))
+            except Exception as e:
+                errors += 1
+                logger.error("Failed to migrate collection %r: %s",
+                             sane_path, e, exc_info=True)
+        return errors == 0
+
+    @types.contextmanager
+    def acquire_lock(self, mode: str, user: str = "", *args, **kwargs
+                     ) -> Iterator[None]:
+        with self._lock.acquire(mode):
+            yield
+
+    def verify(self) -> bool:
+        connection = self._connection()
+        result = connection.execute("PRAGMA integrity_check").fetchone()[0]
+        if result != "ok":
+            logger.error("Invalid storage database: %s", result)
+            return False
+        item_errors = 0
+        for row in connection.execute(
+                "SELECT id, path, props, modified FROM collections "
+                "ORDER BY path"):
+            collection = Collection(self, row)
+            logger.info("Verifying   path %r", collection.path)
+            try:
+                collection.get_meta()
+            except RuntimeError as e:
+                logger.error("Invalid collection %r: %s", collection.path, e)
+                item_errors += 1
+                continue
+            uids: Set[str] = set()
+            count = 0
+            for item in collection.get_all():
+                try:
+                    vobject_items = radicale_item.read_components(
+                        item.serialize())
+                    radicale_item.check_and_sanitize_items(
+                        vobject_items, tag=collection.tag)
+                except Exception as e:
+                    item_errors += 1
+                    logger.error("Invalid item %r in %r: %s", item.href,
+                                 collection.path, e)
+                    continue
+                if item.uid in uids:
+                    item_errors += 1
+                    logger.error("Invalid item %r in %r: UID conflict %r",
+                                 item.href, collection.path, item.uid)
+                    continue
+                uids.add(item.uid)
+                count += 1
+            if collection.tag:
+                logger.info("Verified collect %r (items: %d)",
+                            collection.path, count)
+        return item_errors == 0
@@ -24,16 +24,35 @@ Tests for storage backends.
 import json
 import logging
 import os
+import pickle
 import re
 import shutil
 import tempfile
-from typing import ClassVar, cast
+import threading
+import time
+import wsgiref.util
+import zlib
+from typing import Any, ClassVar, Dict, Iterator, List, Tuple, cast
 
 import pytest
 
+import radicale.item as radicale_item
 import radicale.tests.custom.storage_simple_sync
-from radicale import logger, pathutils
-from radicale.tests import BaseTest
+from radicale import httputils, logger, pathutils
+from radicale.item import scanner as item_scanner
+from radicale.storage import events as storage_events
+from radicale.storage import multifilesystem, sqlite
+from radicale.storage.multifilesystem import cache_format, history_store
+from radicale.storage.multifilesystem.cache import CacheContent
+from radicale.storage.multifilesystem.cache_pack import ItemCachePack
+from radicale.storage.multifilesystem.changelog import (COMPACT_MIN_RECORDS,
+                                                        ChangeLog)
+from radicale.storage.multifilesystem.hook_executor import HookExecutor
+from radicale.storage.multifilesystem.item_index import IndexEntry, ItemIndex
+from radicale.storage.multifilesystem.memory_cache import (ENTRY_OVERHEAD,
+                                                           STATS_LOG_INTERVAL,
+                                                           ItemMemoryCache)
+from radicale.tests import RESPONSES, BaseTest
 from radicale.tests.helpers import get_file_content
 from radicale.tests.test_base import TestBaseRequests as _TestBaseRequests
 
@@ -62,6 +81,21 @@ class TestMultiFileSystem(BaseTest):
         self.configure({"storage": {"_filesystem_fsync": "True"}})
         self.mkcalendar("/calendar.ics/")
 
+    def test_fsync_upload_all(self) -> None:
+        """Upload a whole calendar with syncing enabled."""
+        self.configure({"storage": {"_filesystem_fsync": "True"}})
+        self.put("/calendar.ics/", get_file_content("event_multiple.ics"))
+        _, answer = self.get("/calendar.ics/")
+        assert "\r\nUID:event\r\n" in answer and "\r\nUID:todo\r\n" in answer
+
+    def test_group_fsync_error(self) -> None:
+        """Report files that fail to sync after all files are written."""
+        storage = cast(multifilesystem.Storage, self.application._storage)
+        storage._filesystem_fsync = True
+        with pytest.raises(RuntimeError, match="missing"):
+            with storage._group_fsync() as fsync:
+                fsync(os.path.join(self.colpath, "missing"))
+
     def test_hook(self) -> None:
         """Run hook."""
         self.configure({"storage": {"hook": "mkdir %s" % os.path.join(
@@ -96,6 +130,161 @@ class TestMultiFileSystem(BaseTest):
         self.configure({"storage": {"hook": "exit 1"}})
         self.mkcalendar("/calendar.ics/", check=201)
 
+    def test_hook_async(self) -> None:
+        """Run hook in the background."""
+        self.configure({"storage": {"hook": "mkdir %s" % os.path.join(
+            "collection-root", "created_by_hook"), "hook_async": "True"}})
+        self.mkcalendar("/calendar.ics/")
+        storage = cast(multifilesystem.Storage, self.application._storage)
+        assert storage._hook_executor is not None
+        assert storage._hook_executor.flush(10)
+        self.propfind("/created_by_hook/")
+
+    @pytest.mark.skipif(not shutil.which("flock"), reason="flock command not found")
+    def test_hook_async_storage_unlocked(self) -> None:
+        """Verify that the storage is not locked when the hook runs in the
+        background."""
+        self.configure({"storage": {"hook": "flock -n .Radicale.lock true",
+                                    "hook_async": "True"}})
+        self.mkcalendar("/calendar.ics/")
+        storage = cast(multifilesystem.Storage, self.application._storage)
+        assert storage._hook_executor is not None
+        assert storage._hook_executor.flush(10)
+        assert storage._hook_executor.stats()["failed"] == 0
+
+    def test_hook_executor(self) -> None:
+        """Coalesce queued commands, count failures and drop queued
+        commands on shutdown if requested."""
+        started = threading.Event()
+        release = threading.Event()
+        ran = []
+
+        def run(command: str) -> bool:
+            ran.append(command)
+            started.set()
+            release.wait(10)
+            return command != "fail"
+
+        executor = HookExecutor(run, 1, 64, flush_on_shutdown=True)
+        executor.submit("first")
+        assert started.wait(10)
+        # "first" is running, further identical commands are coalesced
+        for command in ("first", "fail", "fail", "fail"):
+            executor.submit(command)
+        release.set()
+        assert executor.flush(10)
+        assert ran == ["first", "first", "fail"]
+        assert executor.stats() == {
+            "submitted": 5, "coalesced": 2, "succeeded": 2, "failed": 1,
+            "pending": 0, "running": 0}
+        executor.shutdown()
+
+        started.clear()
+        release.clear()
+        ran.clear()
+        executor = HookExecutor(run, 1, 64, flush_on_shutdown=False)
+        executor.submit("first")
+        assert started.wait(10)
+        executor.submit("second")
+        shutdown = threading.Thread(target=executor.shutdown)
+        shutdown.start()
+        # "second" is dropped while "first" is still running
+        while executor.stats()["pending"]:
+            time.sleep(0.01)
+        release.set()
+        shutdown.join(10)
+        assert ran == ["first"]
+
+    def test_principal_locks(self) -> None:
+        """Lock the principal collection of requests inside of it and the
+        whole storage otherwise."""
+        self.configure({"storage": {"use_principal_locks": "True"}})
+        storage = cast(multifilesystem.Storage, self.application._storage)
+        assert storage._lock_principal(
+            "w", path="/user1/calendar.ics/event1.ics", request="PUT") == "user1"
+        assert storage._lock_principal("r", path="/user1/", request="GET") == "user1"
+        assert storage._lock_principal("w", path="/user1/", request="MKCOL") is None
+        assert storage._lock_principal("r", path="/", request="PROPFIND") is None
+        assert storage._lock_principal("w", path="/user1/calendar.ics/") is None
+        assert storage._lock_principal(
+            "w", path="/user1/a.ics/event1.ics", request="MOVE",
+            to_path="/user1/b.ics/event1.ics") == "user1"
+        assert storage._lock_principal(
+            "w", path="/user1/a.ics/event1.ics", request="MOVE",
+            to_path="/user2/b.ics/event1.ics") is None
+        with storage.acquire_lock("w", "user1", path="/user1/calendar.ics/",
+                                  request="PUT"):
+            assert storage._lock.locked == "r"
+            # The write mode is tracked per thread
+            assert storage._write_locked
+            other_thread: List[bool] = []
+            thread = threading.Thread(target=lambda: other_thread.append(
+                storage._write_locked))
+            thread.start()
+            thread.join()
+            assert other_thread == [False]
+            # Writes of other users don't wait
+            with storage.acquire_lock("w", "user2", path="/user2/calendar.ics/",
+                                      request="PUT"):
+                pass
+            assert storage._write_locked
+        assert not storage._write_locked
+        with storage.acquire_lock("r", "user1", path="/user1/", request="GET"):
+            assert not storage._write_locked
+        with storage.acquire_lock("w", "user1", path="/", request="MKCOL"):
+            assert storage._lock.locked == "w"
+            assert storage._write_locked
+
+    def test_cache_format(self) -> None:
+        """Read binary and pickle cache files."""
+        content = ("uid", "etag", "text \u00e9", "name", "VEVENT", -1, 2 ** 40)
+        data = cache_format.dump_item("hash", content)
+        assert cache_format.is_binary(data)
+        assert cache_format.load_item(data, "hash") == content
+        assert cache_format.load_item(data, "other") is None
+        with pytest.raises(ValueError):
+            cache_format.load_item(data[:-1], "hash")
+        assert cache_format.load_item(
+            pickle.dumps(("hash", *content)), "hash") == content
+        assert cache_format.load_history(
+            cache_format.dump_history("etag", "history")) == ("etag", "history")
+        assert cache_format.load_history(
+            pickle.dumps(["etag", "history"])) == ("etag", "history")
+        state = {"a.ics": "1", "b.ics": "2"}
+        assert cache_format.load_sync_state(
+            cache_format.dump_sync_state(state)) == state
+        assert cache_format.load_sync_state(pickle.dumps(state)) == state
+        with pytest.raises(ValueError, match="kind"):
+            cache_format.load_history(cache_format.dump_sync_state(state))
+        assert cache_format.load_sync_token(
+            cache_format.dump_sync_state(state)) == ("", state, [])
+        assert cache_format.load_sync_token(
+            pickle.dumps(state)) == ("", state, [])
+        delta = ("base", {"a.ics": "3"}, ["b.ics"])
+        assert cache_format.load_sync_token(
+            cache_format.dump_sync_delta(*delta)) == delta
+        assert cache_format.load_sync_token(pickle.dumps(delta)) == delta
+        with pytest.raises(ValueError, match="kind"):
+            cache_format.load_sync_state(cache_format.dump_sync_delta(*delta))
+
+    def test_binary_cache_migration(self) -> None:
+        """Rewrite item cache files of the pickle format."""
+        self.mkcalendar("/calendar.ics/")
+        event = get_file_content("event1.ics")
+        self.put("/calendar.ics/event1.ics", event)
+        cache_path = os.path.join(self.colpath, "collection-root",
+                                  "calendar.ics", ".Radicale.cache", "item",
+                                  "event1.ics")
+        with open(cache_path, "rb") as f:
+            assert not cache_format.is_binary(f.read())
+        self.configure({"storage": {"use_binary_cache": "True"}})
+        _, answer = self.get("/calendar.ics/event1.ics")
+        assert "UID:event1" in answer
+        with open(cache_path, "rb") as f:
+            assert cache_format.is_binary(f.read())
+        _, answer = self.get("/calendar.ics/event1.ics")
+        assert "UID:event1" in answer
+
     def test_item_cache_rebuild(self) -> None:
         """Delete the item cache and verify that it is rebuild."""
         self.mkcalendar("/calendar.ics/")
@@ -143,6 +332,838 @@ class TestMultiFileSystem(BaseTest):
         assert answer1 == answer2
         assert os.path.exists(os.path.join(cache_folder, "event1.ics"))
 
+    def test_get_all_stat_once(self, monkeypatch: pytest.MonkeyPatch
+                               ) -> None:
+        """Load items with the stat results of the directory scan."""
+        self.configure({"storage": {
+            "use_mtime_and_size_for_item_cache": "True"}})
+        self.mkcalendar("/calendar.ics/")
+        self.put("/calendar.ics/event1.ics", get_file_content("event1.ics"))
+        self.put("/calendar.ics/event2.ics", get_file_content("event2.ics"))
+        storage = cast(multifilesystem.Storage, self.application._storage)
+        collection = next(storage.discover("/calendar.ics/"))
+        assert isinstance(collection, multifilesystem.Collection)
+        # Fill the item cache
+        assert len(list(collection.get_all())) == 2
+        folder = os.path.join(self.colpath, "collection-root", "calendar.ics")
+        calls = []
+        for name in ("stat", "lstat", "access"):
+            def wrapper(path, *args, wrapped=getattr(os, name), **kwargs):
+                if os.path.dirname(str(path)) == folder:
+                    calls.append(path)
+                return wrapped(path, *args, **kwargs)
+            monkeypatch.setattr(os, name, wrapper)
+        assert len(list(collection.get_all())) == 2
+        items = dict(collection.get_multi(["event1.ics", "missing.ics"]))
+        monkeypatch.undo()
+        assert calls == []
+        assert items["missing.ics"] is None
+        item = items["event1.ics"]
+        assert item is not None
+        assert item.last_modified == time.strftime(
+            "%a, %d %b %Y %H:%M:%S GMT", time.gmtime(os.path.getmtime(
+                os.path.join(folder, "event1.ics"))))
+
+    def test_get_collection_streamed(self, monkeypatch: pytest.MonkeyPatch
+                                     ) -> None:
+        """Export a calendar to a temporary file and release the storage
+        lock before the response is sent."""
+        self.mkcalendar("/calendar.ics/")
+        self.put("/calendar.ics/event1.ics", get_file_content("event1.ics"))
+        self.put("/calendar.ics/event2.ics", get_file_content("event2.ics"))
+        storage = cast(multifilesystem.Storage, self.application._storage)
+        with storage.acquire_lock("r"):
+            collection = next(storage.discover("/calendar.ics/"))
+            assert isinstance(collection, multifilesystem.Collection)
+            # The items are read once
+            get_all = collection.get_all
+            calls: List[None] = []
+
+            def counting_get_all() -> Iterator[radicale_item.Item]:
+                calls.append(None)
+                return get_all()
+            monkeypatch.setattr(collection, "get_all", counting_get_all)
+            expected = collection.serialize()
+            assert len(calls) == 1
+        environ = {"REQUEST_METHOD": "GET", "PATH_INFO": "/calendar.ics/",
+                   "HTTP_ACCEPT_ENCODING": "gzip"}
+        wsgiref.util.setup_testing_defaults(environ)
+        headers: Dict[str, str] = {}
+
+        def start_response(status: str, headers_: list) -> None:
+            assert status.startswith("200 ")
+            headers.update(headers_)
+        answers = self.application(environ, start_response)
+        assert headers["Content-Encoding"] == "gzip"
+        assert "Content-Length" not in headers
+        # The storage isn't locked while the response is sent
+        assert storage._lock.locked == ""
+        answer = zlib.decompress(b"".join(answers), wbits=16 + zlib.MAX_WBITS)
+        assert answer.decode() == expected
+        assert expected.count("BEGIN:VTIMEZONE") == 1
+        assert expected.count("BEGIN:VEVENT") == 3
+        # Large exports are spooled to disk
+        monkeypatch.setattr(httputils, "SPOOL_MAX_MEMORY_SIZE", 16)
+        answers = self.application(environ, start_response)
+        assert isinstance(answers, httputils.StreamingAnswer)
+        assert zlib.decompress(b"".join(answers),
+                               wbits=16 + zlib.MAX_WBITS) == answer
+
+    def test_rebuild_cache(self) -> None:
+        """Build the caches of all collections in advance."""
+        self.configure({"storage": {"use_item_index": "True"}})
+        self.mkcalendar("/calendar.ics/")
+        self.put("/calendar.ics/event1.ics", get_file_content("event1.ics"))
+        self.put("/calendar.ics/event2.ics", get_file_content("event2.ics"))
+        collection_folder = os.path.join(self.colpath, "collection-root",
+                                         "calendar.ics")
+        with open(os.path.join(collection_folder, "broken.ics"), "w") as f:
+            f.write("BEGIN:VCALENDAR\r\n")
+        cache_folder = os.path.join(collection_folder, ".Radicale.cache")
+        shutil.rmtree(cache_folder)
+        storage = cast(multifilesystem.Storage, self.application._storage)
+        assert not storage.rebuild_cache(workers=2)
+        for ns in ("item", "history"):
+            assert sorted(name for name in os.listdir(
+                os.path.join(cache_folder, ns)) if not name.startswith(".")
+            ) == ["event1.ics", "event2.ics"]
+        assert os.path.exists(os.path.join(cache_folder, "item",
+                                           ".Radicale.item-index"))
+        os.remove(os.path.join(collection_folder, "broken.ics"))
+        item_cache = os.path.join(cache_folder, "item", "event1.ics")
+        mtime_ns = os.stat(item_cache).st_mtime_ns
+        time.sleep(0.01)
+        assert storage.rebuild_cache(workers=2, skip_unchanged=True)
+        assert os.stat(item_cache).st_mtime_ns == mtime_ns
+        assert storage.rebuild_cache(workers=2)
+        assert os.stat(item_cache).st_mtime_ns != mtime_ns
+
+    def test_verify_incremental(self) -> None:
+        """Skip unchanged items and report the results of the collections."""
+        self.mkcalendar("/calendar.ics/")
+        self.put("/calendar.ics/event1.ics", get_file_content("event1.ics"))
+        self.put("/calendar.ics/event2.ics", get_file_content("event2.ics"))
+        storage = cast(multifilesystem.Storage, self.application._storage)
+        report_path = os.path.join(self.colpath, "report.json")
+
+        def verify() -> Tuple[bool, dict]:
+            with storage.acquire_lock("r"):
+                result = storage.verify(workers=2, incremental=True,
+                                        report=report_path)
+            with open(report_path) as f:
+                report = json.load(f)
+            return result, {collection["path"]: collection
+                            for collection in report["collections"]}
+
+        result, collections = verify()
+        assert result
+        assert collections[""]["status"] == "skipped"
+        assert collections["calendar.ics"]["status"] == "valid"
+        assert collections["calendar.ics"]["items"] == 2
+        assert collections["calendar.ics"]["parsed"] == 2
+        result, collections = verify()
+        assert result
+        assert collections["calendar.ics"]["parsed"] == 0
+        assert collections["calendar.ics"]["skipped"] == 2
+        with open(os.path.join(self.colpath, "collection-root", "calendar.ics",
+                               "event1.ics"), "w") as f:
+            f.write("BEGIN:VCALENDAR\r\n")
+        result, collections = verify()
+        assert not result
+        assert collections["calendar.ics"]["status"] == "invalid"
+        assert collections["calendar.ics"]["parsed"] == 1
+        assert collections["calendar.ics"]["errors"] == 1
+
+    def test_verify_report_seconds(self, monkeypatch) -> None:
+        """Don't count the time a collection is queued in its timing."""
+        self.mkcalendar("/calendar1.ics/")
+        self.mkcalendar("/calendar2.ics/")
+        storage = cast(multifilesystem.Storage, self.application._storage)
+        report_path = os.path.join(self.colpath, "report.json")
+        start_verification = storage._start_verification
+
+        def slow_start_verification(sane_path: str, *args: Any) -> Any:
+            verification = start_verification(sane_path, *args)
+            if sane_path == "calendar2.ics":
+                # calendar1.ics is queued in the meantime
+                time.sleep(0.5)
+            return verification
+
+        monkeypatch.setattr(storage, "_start_verification",
+                            slow_start_verification)
+        with storage.acquire_lock("r"):
+            assert storage.verify(workers=1, report=report_path)
+        with open(report_path) as f:
+            report = json.load(f)
+        seconds = {collection["path"]: collection["seconds"]
+                   for collection in report["collections"]}
+        assert seconds["calendar1.ics"] < 0.5
+        assert report["seconds"] >= 0.5
+
+    def test_item_cache_rebuild_packed(self) -> None:
+        """Delete the packed item cache and verify that it is rebuild."""
+        self.configure({"storage": {"use_packed_item_cache": "True"}})
+        self.mkcalendar("/calendar.ics/")
+        event = get_file_content("event1.ics")
+        path = "/calendar.ics/event1.ics"
+        self.put(path, event)
+        _, answer1 = self.get(path)
+        cache_folder = os.path.join(self.colpath, "collection-root",
+                                    "calendar.ics", ".Radicale.cache", "item")
+        assert os.path.exists(os.path.join(cache_folder, ".Radicale.pack"))
+        assert not os.path.exists(os.path.join(cache_folder, "event1.ics"))
+        shutil.rmtree(cache_folder)
+        _, answer2 = self.get(path)
+        assert answer1 == answer2
+        assert os.path.exists(os.path.join(cache_folder, ".Radicale.pack"))
+
+    def test_item_cache_packed_clean(self) -> None:
+        """Remove the unpacked item cache when the pack is created and
+        remove entries of deleted items without rewriting the pack."""
+        self.mkcalendar("/calendar.ics/")
+        event = get_file_content("event1.ics")
+        for i in range(3):
+            self.put("/calendar.ics/event%d.ics" % i,
+                     event.replace("UID:event1", "UID:event%d" % i))
+        collection_folder = os.path.join(self.colpath, "collection-root",
+                                         "calendar.ics")
+        cache_folder = os.path.join(collection_folder, ".Radicale.cache",
+                                    "item")
+        assert os.path.exists(os.path.join(cache_folder, "event0.ics"))
+        self.configure({"storage": {"use_packed_item_cache": "True"}})
+        self.get("/calendar.ics/")
+        assert not [name for name in os.listdir(cache_folder)
+                    if not name.startswith(".Radicale")]
+        data_files = [name for name in os.listdir(cache_folder)
+                      if name.startswith(".Radicale.pack.data-")]
+        # Changed by other means, the item cache is cleaned on the miss
+        os.remove(os.path.join(collection_folder, "event0.ics"))
+        with open(os.path.join(collection_folder, "event1.ics"), "a") as f:
+            f.write("\r\n")
+        self.get("/calendar.ics/")
+        storage = cast(multifilesystem.Storage, self.application._storage)
+        pack = ItemCachePack(storage, cache_folder)
+        assert sorted(pack.hrefs()) == ["event1.ics", "event2.ics"]
+        assert [name for name in os.listdir(cache_folder)
+                if name.startswith(".Radicale.pack.data-")] == data_files
+
+    def test_item_cache_packed(self) -> None:
+        """Store, supersede, remove and compact packed item cache entries."""
+        self.configure({"storage": {"use_packed_item_cache": "True"}})
+        folder = os.path.join(self.colpath, "pack")
+        storage = cast(multifilesystem.Storage, self.application._storage)
+        pack = ItemCachePack(storage, folder)
+        pack.store([("a.ics", "hash-a", ("a", "etag", "text-a")),
+                    ("b.ics", "hash-b", ("b", "etag", "text-b"))])
+        pack.store([("a.ics", "hash-a2", ("a", "etag2", "text-a2"))])
+        pack.remove(["b.ics"])
+
+        # Another instance (e.g. of another process) reads the same state
+        other = ItemCachePack(storage, folder)
+        assert other.load("a.ics", "hash-a2") == ("hash-a2", ["a", "etag2", "text-a2"])
+        assert other.load("b.ics", "hash-b") is None
+        assert sorted(other.hrefs()) == ["a.ics"]
+
+        # Appended records are picked up, a broken tail is ignored
+        pack.store([("c.ics", "hash-c", ("c", "etag", "text-c"))])
+        with open(os.path.join(folder, ".Radicale.pack"), "ab") as f:
+            f.write(b"\x05\x00broken")
+        assert other.load("c.ics", "hash-c") == ("hash-c", ["c", "etag", "text-c"])
+
+        data_files = [name for name in os.listdir(folder) if name.startswith(".Radicale.pack.data-")]
+        pack.compact(keep=lambda href: href != "c.ics")
+        assert sorted(pack.hrefs()) == ["a.ics"]
+        assert not any(os.path.exists(os.path.join(folder, name)) for name in data_files)
+        assert sorted(other.hrefs()) == ["a.ics"]
+        assert other.load("a.ics", "hash-a2") == ("hash-a2", ["a", "etag2", "text-a2"])
+
+    def _collection_etag(self, path: str) -> str:
+        _, responses = self.propfind(path, """\
+<?xml version="1.0" encoding="utf-8"?>
+<propfind xmlns="DAV:"><prop><getetag/></prop></propfind>""")
+        response = responses[path]
+        assert not isinstance(response, int)
+        status, prop = response["D:getetag"]
+        assert status == 200 and prop.text
+        return prop.text
+
+    def test_collection_manifest(self) -> None:
+        """Update the collection manifest and compare it with a rebuild."""
+        self.configure({"storage": {"use_collection_manifest": "True"}})
+        self.mkcalendar("/calendar.ics/")
+        manifest_path = os.path.join(self.colpath, "collection-root",
+                                     "calendar.ics", ".Radicale.cache",
+                                     "item", ".Radicale.manifest")
+        etags = {self._collection_etag("/calendar.ics/")}
+        assert os.path.exists(manifest_path)
+        self.put("/calendar.ics/event1.ics", get_file_content("event1.ics"))
+        etags.add(self._collection_etag("/calendar.ics/"))
+        self.put("/calendar.ics/event2.ics", get_file_content("event2.ics"))
+        etags.add(self._collection_etag("/calendar.ics/"))
+        self.delete("/calendar.ics/event1.ics")
+        etags.add(self._collection_etag("/calendar.ics/"))
+        self.proppatch("/calendar.ics/", get_file_content(
+            "proppatch_set_calendar_color.xml"))
+        etag = self._collection_etag("/calendar.ics/")
+        etags.add(etag)
+        assert len(etags) == 5
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        assert manifest["item_count"] == 1
+        # The rebuilt manifest matches the updated one
+        os.remove(manifest_path)
+        assert self._collection_etag("/calendar.ics/") == etag
+        with open(manifest_path) as f:
+            assert json.load(f) == manifest
+        # Changes by other means are detected
+        shutil.copy(os.path.join(self.colpath, "collection-root",
+                                 "calendar.ics", "event2.ics"),
+                    os.path.join(self.colpath, "collection-root",
+                                 "calendar.ics", "event3.ics"))
+        assert self._collection_etag("/calendar.ics/") != etag
+        with open(manifest_path) as f:
+            assert json.load(f)["item_count"] == 2
+
+    def test_collection_manifest_cache_subfolder(self) -> None:
+        """Store the manifest with the item cache."""
+        self.configure({"storage": {"use_collection_manifest": "True",
+                                    "use_cache_subfolder_for_item": "True"}})
+        self.mkcalendar("/calendar.ics/")
+        self.put("/calendar.ics/event1.ics", get_file_content("event1.ics"))
+        etag = self._collection_etag("/calendar.ics/")
+        assert os.path.exists(os.path.join(
+            self.colpath, "collection-cache", "calendar.ics",
+            ".Radicale.cache", "item", ".Radicale.manifest"))
+        assert not os.path.exists(os.path.join(
+            self.colpath, "collection-root", "calendar.ics",
+            ".Radicale.cache", "item", ".Radicale.manifest"))
+        # Changes in place are only picked up by rebuilding the caches
+        path = os.path.join(self.colpath, "collection-root", "calendar.ics",
+                            "event1.ics")
+        folder_stat = os.stat(os.path.dirname(path))
+        with open(path) as f:
+            content = f.read()
+        with open(path, "w") as f:
+            f.write(content.replace("SUMMARY:Event", "SUMMARY:Changed"))
+        os.utime(os.path.dirname(path),
+                 ns=(folder_stat.st_atime_ns, folder_stat.st_mtime_ns))
+        assert self._collection_etag("/calendar.ics/") == etag
+        storage = cast(multifilesystem.Storage, self.application._storage)
+        assert storage.rebuild_cache()
+        assert self._collection_etag("/calendar.ics/") != etag
+
+    def test_sync_change_log(self) -> None:
+        """Answer sync-collection from the change log."""
+        def report(sync_token: str = "") -> Tuple[str, RESPONSES]:
+            return _TestBaseRequests._report_sync_token(
+                cast(_TestBaseRequests, self), "/calendar.ics/", sync_token)
+
+        self.configure({"storage": {"use_sync_change_log": "True"}})
+        self.mkcalendar("/calendar.ics/")
+        collection_folder = os.path.join(self.colpath, "collection-root",
+                                         "calendar.ics")
+        log_path = os.path.join(collection_folder, ".Radicale.cache",
+                                "sync-token", ".Radicale.changelog")
+        self.put("/calendar.ics/event1.ics", get_file_content("event1.ics"))
+        self.put("/calendar.ics/event2.ics", get_file_content("event2.ics"))
+        token1, responses = report()
+        assert set(responses) == {"/calendar.ics/event1.ics",
+                                  "/calendar.ics/event2.ics"}
+        assert token1.endswith("%032x" % 2)
+        # Changes by Radicale are appended without reading all items
+        self.delete("/calendar.ics/event1.ics")
+        with open(log_path) as f:
+            lines = [json.loads(line) for line in f]
+        assert lines[-2][:4] == ["C", 3, "event1.ics", ""]
+        assert lines[-1] == ["M", os.stat(collection_folder).st_mtime_ns]
+        token2, responses = report(token1)
+        assert responses == {"/calendar.ics/event1.ics": 404}
+        # Changes by other means are detected
+        shutil.copy(os.path.join(collection_folder, "event2.ics"),
+                    os.path.join(collection_folder, "event3.ics"))
+        token3, responses = report(token2)
+        assert responses == {"/calendar.ics/event3.ics": 200}
+        _, responses = report(token3)
+        assert not responses
+        # Tokens of a recreated log are invalid
+        os.remove(log_path)
+        token4, _ = report(token3)
+        assert not token4
+
+    def test_sync_change_log_compact(self) -> None:
+        """Compact the change log keeping its id and sequence numbers."""
+        storage = cast(multifilesystem.Storage, self.application._storage)
+        path = os.path.join(self.colpath, ".Radicale.changelog")
+        log = ChangeLog(storage, path)
+        log.create([("a.ics", "etag-a"), ("b.ics", "etag-b")], 0)
+        for i in range(COMPACT_MIN_RECORDS):
+            log.append([("a.ics", "etag-a%d" % i)])
+        log.append([("b.ics", "")])
+        log_id, seq = log.log_id, log.seq
+        # Expire all deleted items
+        log.compact(max_age=-1)
+        with open(path) as f:
+            assert len(f.readlines()) == 3
+        other = ChangeLog(storage, path)
+        other.refresh()
+        for instance in (log, other):
+            assert (instance.log_id, instance.seq) == (log_id, seq)
+            assert instance.floor == seq
+            assert list(instance.hrefs()) == ["a.ics"]
+            assert instance.changes_since(seq - 2) == {"a.ics"}
+
+    def test_sync_token_deltas(self) -> None:
+        """Store the states of sync tokens as deltas to a complete base."""
+        def report(sync_token: str = "") -> Tuple[str, RESPONSES]:
+            return _TestBaseRequests._report_sync_token(
+                cast(_TestBaseRequests, self), "/calendar.ics/", sync_token)
+
+        def load(token: str) -> cache_format.SyncTokenState:
+            with open(os.path.join(token_folder, token.rsplit("/", 1)[-1]),
+                      "rb") as f:
+                return cache_format.load_sync_token(f.read())
+
+        self.configure({"storage": {"use_sync_token_deltas": "True"}})
+        self.mkcalendar("/calendar.ics/")
+        token_folder = os.path.join(self.colpath, "collection-root",
+                                    "calendar.ics", ".Radicale.cache",
+                                    "sync-token")
+        event = get_file_content("event1.ics")
+        for i in range(10):
+            self.put("/calendar.ics/event%d.ics" % i,
+                     event.replace("UID:event1", "UID:event%d" % i))
+        token1, _ = report()
+        base_name, state, removed = load(token1)
+        assert not base_name and len(state) == 10 and not removed
+        self.delete("/calendar.ics/event0.ics")
+        token2, responses = report(token1)
+        assert responses == {"/calendar.ics/event0.ics": 404}
+        base_name, changed, removed = load(token2)
+        assert token1.endswith("/" + base_name)
+        assert list(changed) == ["event0.ics"] and not removed
+        # Deltas always refer to a complete state
+        self.put("/calendar.ics/event10.ics",
+                 event.replace("UID:event1", "UID:event10"))
+        token3, responses = report(token2)
+        assert responses == {"/calendar.ics/event10.ics": 200}
+        base_name, changed, removed = load(token3)
+        assert token1.endswith("/" + base_name)
+        assert set(changed) == {"event0.ics", "event10.ics"}
+        _, responses = report(token1)
+        assert set(responses) == {"/calendar.ics/event0.ics",
+                                  "/calendar.ics/event10.ics"}
+        # A new base is started if the delta gets too large
+        for i in range(1, 7):
+            self.delete("/calendar.ics/event%d.ics" % i)
+        token4, responses = report(token3)
+        assert len(responses) == 6
+        base_name, state, _ = load(token4)
+        assert not base_name and len(state) == 11
+        # Tokens with a missing base are rejected
+        os.remove(os.path.join(token_folder, token1.rsplit("/", 1)[-1]))
+        token5, _ = report(token3)
+        assert not token5
+
+    def test_sync_token_deltas_age(self) -> None:
+        """Keep the base at least as long as the deltas referring to it."""
+        def report(sync_token: str = "") -> Tuple[str, RESPONSES]:
+            return _TestBaseRequests._report_sync_token(
+                cast(_TestBaseRequests, self), "/calendar.ics/", sync_token)
+
+        def age(seconds: int) -> None:
+            for name in os.listdir(token_folder):
+                path = os.path.join(token_folder, name)
+                mtime = os.stat(path).st_mtime - seconds
+                os.utime(path, (mtime, mtime))
+
+        self.configure({"storage": {"use_sync_token_deltas": "True",
+                                    "max_sync_token_age": "100"}})
+        self.mkcalendar("/calendar.ics/")
+        token_folder = os.path.join(self.colpath, "collection-root",
+                                    "calendar.ics", ".Radicale.cache",
+                                    "sync-token")
+        event = get_file_content("event1.ics")
+        for i in range(4):
+            self.put("/calendar.ics/event%d.ics" % i,
+                     event.replace("UID:event1", "UID:event%d" % i))
+        token1, _ = report()
+        age(90)
+        self.delete("/calendar.ics/event0.ics")
+        # The delta is written against the complete state of token1
+        token2, _ = report(token1)
+        age(20)
+        # Clean up the sync tokens without loading token2
+        self.delete("/calendar.ics/event1.ics")
+        report()
+        _, responses = report(token2)
+        assert responses == {"/calendar.ics/event1.ics": 404}
+
+    def test_history_store(self) -> None:
+        """Keep the history in one file, sync tokens of the per-item
+        history files stay valid."""
+        def report(sync_token: str = "") -> Tuple[str, RESPONSES]:
+            return _TestBaseRequests._report_sync_token(
+                cast(_TestBaseRequests, self), "/calendar.ics/", sync_token)
+
+        self.mkcalendar("/calendar.ics/")
+        history_folder = os.path.join(self.colpath, "collection-root",
+                                      "calendar.ics", ".Radicale.cache",
+                                      "history")
+        self.put("/calendar.ics/event1.ics", get_file_content("event1.ics"))
+        self.put("/calendar.ics/event2.ics", get_file_content("event2.ics"))
+        token1, _ = report()
+        assert sorted(os.listdir(history_folder)) == ["event1.ics",
+                                                      "event2.ics"]
+        self.configure({"storage": {"use_history_store": "True"}})
+        token2, responses = report(token1)
+        assert token2 == token1 and not responses
+        assert [name for name in os.listdir(history_folder)
+                if not name.startswith(".Radicale.lock")] == [
+                    ".Radicale.history"]
+        self.delete("/calendar.ics/event1.ics")
+        token3, responses = report(token1)
+        assert responses == {"/calendar.ics/event1.ics": 404}
+        # Changes by other means are detected
+        collection_folder = os.path.dirname(os.path.dirname(history_folder))
+        os.remove(os.path.join(collection_folder, "event2.ics"))
+        _, responses = report(token3)
+        assert responses == {"/calendar.ics/event2.ics": 404}
+        self.put("/calendar.ics/event1.ics", get_file_content("event1.ics"))
+        _, responses = report(token3)
+        assert responses == {"/calendar.ics/event1.ics": 200,
+                             "/calendar.ics/event2.ics": 404}
+
+    def test_history_store_compact(self) -> None:
+        """Apply batches completely or not at all and drop expired
+        entries of deleted items."""
+        storage = cast(multifilesystem.Storage, self.application._storage)
+        entry = history_store.HistoryEntry
+        now = int(time.time())
+        store = history_store.HistoryStore(storage, self.colpath)
+        store.refresh()
+        store.update([("a.ics", entry("etag-a", "history-a", 0)),
+                      ("b.ics", entry("", "history-b", 0))])
+        for i in range(history_store.COMPACT_MIN_RECORDS):
+            store.update([("c.ics", entry("etag-c", "history-c%d" % i, now))])
+        # Superseded records are compacted away
+        assert os.path.getsize(store.path) < 1024
+        # A partially written batch is ignored
+        with open(store.path, "ab") as f:
+            f.write(b"\x10\x00\x00\x00\x00")
+        other = history_store.HistoryStore(storage, self.colpath)
+        other.refresh()
+        assert dict(other.items()) == dict(store.items())
+        store.update([("d.ics", entry("", "history-d", now))])
+        other.refresh()
+        assert other.get("d.ics") == entry("", "history-d", now)
+        # Only the expired entry of a deleted item is dropped
+        store.clean(3600)
+        other.refresh()
+        assert sorted(other.hrefs()) == ["a.ics", "c.ics", "d.ics"]
+        assert other.get("c.ics") == entry(
+            "etag-c", "history-c%d" % (history_store.COMPACT_MIN_RECORDS - 1),
+            now)
+
+    def test_item_index_query(self) -> None:
+        """Query the item index and compare with checking all entries."""
+        entries = [IndexEntry(start, start + length, "%d-%d-%s.ics" % (start, length, tag),
+                              tag, "%d-%d-%s" % (start, length, tag))
+                   for start in range(0, 100, 7) for length in (0, 1, 5, 60)
+                   for tag in ("VEVENT", "VTODO")]
+        index = ItemIndex({}, reversed(entries))
+        for tag in (None, "VEVENT", "VTODO"):
+            for start, end in ((0, 1), (10, 20), (50, 51), (99, 200), (-10, 0)):
+                assert sorted(index.query(tag, start, end)) == sorted(
+                    entry.href for entry in entries
+                    if entry.start < end and entry.end > start and
+                    tag in (None, entry.tag))
+        assert index.query("VJOURNAL", 0, 100) == []
+        assert index.href_of_uid("7-60-VTODO") == "7-60-VTODO.ics"
+        index = index.replace(["7-60-VTODO.ics"], [])
+        assert "7-60-VTODO.ics" not in index.query(None, 50, 60)
+        assert "7-60-VTODO.ics" not in index.query("VTODO", 50, 60)
+        assert index.href_of_uid("7-60-VTODO") is None
+
+    def test_item_index(self) -> None:
+        """Keep the item index up to date on changes."""
+        self.configure({"storage": {"use_item_index": "True"}})
+        self.mkcalendar("/calendar.ics/")
+        for i in range(1, 6):
+            self.put("/calendar.ics/event%d.ics" % i,
+                     get_file_content("event%d.ics" % i))
+        index_path = os.path.join(self.colpath, "collection-root",
+                                  "calendar.ics", ".Radicale.cache", "item",
+                                  ".Radicale.item-index")
+        report = """\
+<?xml version="1.0" encoding="utf-8" ?>
+<C:calendar-query xmlns:C="urn:ietf:params:xml:ns:caldav">
+    <D:prop xmlns:D="DAV:"><D:getetag/></D:prop>
+    <C:filter><C:comp-filter name="VCALENDAR"><C:comp-filter name="VEVENT">
+        <C:time-range start="20130801T000000Z" end="20131001T000000Z"/>
+    </C:comp-filter></C:comp-filter></C:filter>
+</C:calendar-query>"""
+        _, responses = self.report("/calendar.ics/", report)
+        assert len(responses) == 5
+        assert os.path.exists(index_path)
+        self.delete("/calendar.ics/event1.ics")
+        with open(index_path, "rb") as f:
+            _, _, entries = pickle.load(f)
+        assert len(entries) == 4
+        _, responses = self.report("/calendar.ics/", report)
+        assert "/calendar.ics/event1.ics" not in responses
+        assert len(responses) == 4
+        # Items changed in place are checked by modification time and size
+        path = os.path.join(self.colpath, "collection-root", "calendar.ics",
+                            "event2.ics")
+        folder_stat = os.stat(os.path.dirname(path))
+        with open(path) as f:
+            content = f.read()
+        with open(path, "w") as f:
+            f.write(content.replace("20130", "20140"))
+        os.utime(os.path.dirname(path),
+                 ns=(folder_stat.st_atime_ns, folder_stat.st_mtime_ns))
+        _, responses = self.report("/calendar.ics/", report)
+        assert "/calendar.ics/event2.ics" not in responses
+        assert len(responses) == 3
+
+    def test_item_prefetch(self) -> None:
+        """Read items in advance and return them in the requested order."""
+        self.configure({"storage": {"item_prefetch_workers": "2"}})
+        self.mkcalendar("/calendar.ics/")
+        event = get_file_content("event1.ics")
+        hrefs = []
+        for i in range(20):
+            href = "event%d.ics" % i
+            self.put("/calendar.ics/" + href,
+                     event.replace("UID:event1", "UID:event%d" % i))
+            hrefs.append(href)
+        storage = cast(multifilesystem.Storage, self.application._storage)
+        assert storage._item_prefetch_executor is not None
+        # Remove an item cache entry
+        cache_folder = os.path.join(self.colpath, "collection-root",
+                                    "calendar.ics", ".Radicale.cache", "item")
+        os.remove(os.path.join(cache_folder, "event3.ics"))
+        requested = hrefs[::-1] + ["missing.ics", "../event0.ics"]
+        requested.insert(5, "missing2.ics")
+        with storage.acquire_lock("r"):
+            collection = next(storage.discover("/calendar.ics/"))
+            assert isinstance(collection, multifilesystem.Collection)
+            result = list(collection.get_multi(requested))
+            assert [href for href, _ in result] == requested
+            for href, item in result:
+                assert (item is None) == href.startswith(("missing", ".."))
+                assert item is None or item.uid == href[:-len(".ics")]
+            assert sorted(item.href for item in collection.get_all()
+                          if item.href) == sorted(hrefs)
+            # The consumer stops early
+            assert next(collection.get_all()) is not None
+        if storage._item_memory_cache is None:
+            assert os.path.exists(os.path.join(cache_folder, "event3.ics"))
+
+    def test_item_scanner(self) -> None:
+        """Extract the metadata of simple events without vobject, like
+        ``find_time_range``."""
+        event = ("BEGIN:VCALENDAR\r\nVERSION:2.0\r\nPRODID:-//Test//EN\r\n"
+                 "BEGIN:VEVENT\r\nUID:event\r\nDTSTAMP:20240101T000000Z\r\n"
+                 "SUMMARY:%s\r\n%s\r\nEND:VEVENT\r\nEND:VCALENDAR\r\n")
+        alarm = ("BEGIN:VALARM\r\nACTION:DISPLAY\r\nDESCRIPTION:Alarm\r\n"
+                 "TRIGGER:-PT15M\r\nEND:VALARM")
+        scanned = [
+            "DTSTART:20240101T100000Z\r\nDTEND:20240101T113000Z",
+            "DTSTART:20240101T100000\r\nDTEND:20240101T113000",
+            "DTSTART;VALUE=DATE:20240101\r\nDTEND;VALUE=DATE:20240103",
+            "DTSTART;VALUE=DATE:20240101",
+            "DTSTART:20240101T100000",
+            "DTSTART:20240101T100000Z\r\nDURATION:PT1H30M",
+            "DTSTART;VALUE=DATE:20240101\r\nDURATION:P2D",
+            "DTSTART:20240101T100000Z\r\nDURATION:-PT1H",
+            "DTSTART:20240101T100000Z\r\nDTEND:20240101T090000Z",
+            "DTSTART:20240101T100000Z\r\n" + alarm]
+        fallback = [
+            "DTSTART:20240101T100000Z\r\nRRULE:FREQ=DAILY;COUNT=3",
+            "DTSTART:20240101T100000\r\nDTEND:20240101T113000Z",
+            "DTSTART;VALUE=DATE:20240101\r\nDTEND:20240101T113000Z",
+            "DTEND:20240101T113000Z"]
+        for summary in ["Event", "Événement, long " * 10]:
+            for properties in scanned + fallback:
+                text = event % (summary, properties)
+                try:
+                    vobject_item, = radicale_item.read_components(text)
+                except Exception:
+                    vobject_item = None
+                if vobject_item is not None:
+                    # Form written by Radicale
+                    text = vobject_item.serialize()
+                    item = radicale_item.Item(collection_path="calendar.ics",
+                                              vobject_item=vobject_item)
+                result = item_scanner.scan_calendar_item(text, "VCALENDAR")
+                if properties in fallback:
+                    assert result is None
+                    continue
+                assert vobject_item is not None
+                assert result == (item.uid, item.component_name,
+                                  item.time_range)
+                # Not in the form written by Radicale
+                assert item_scanner.scan_calendar_item(
+                    text.replace("\r\n", "\n"), "VCALENDAR") is None
+                assert item_scanner.scan_calendar_item(
+                    text, "VADDRESSBOOK") is None
+        for name in ["event1.ics", "todo1.ics", "journal1.ics"]:
+            vobject_item, = radicale_item.read_components(
+                get_file_content(name))
+            assert item_scanner.scan_calendar_item(
+                vobject_item.serialize(), "VCALENDAR") is None
+        # The item cache is the same after a miss
+        self.mkcalendar("/calendar.ics/")
+        self.put("/calendar.ics/event.ics",
+                 event % ("Event", scanned[0]))
+        cache_folder = os.path.join(self.colpath, "collection-root",
+                                    "calendar.ics", ".Radicale.cache")
+        storage = cast(multifilesystem.Storage, self.application._storage)
+        with storage.acquire_lock("r"):
+            collection = next(storage.discover("/calendar.ics/"))
+            assert isinstance(collection, multifilesystem.Collection)
+            stored = next(collection.get_multi(["event.ics"]))[1]
+            assert stored
+            expected = (stored.etag, stored.serialize(), stored.time_range)
+        shutil.rmtree(cache_folder)
+        with storage.acquire_lock("r"):
+            collection = next(storage.discover("/calendar.ics/"))
+            assert isinstance(collection, multifilesystem.Collection)
+            stored = next(collection.get_multi(["event.ics"]))[1]
+            assert stored
+            assert (stored.etag, stored.serialize(),
+                    stored.time_range) == expected
+
+    def test_storage_events(self) -> None:
+        """Emit change events to synchronous and asynchronous
+        subscribers."""
+        storage = self.application._storage
+        events: List[storage_events.Event] = []
+        async_events: List[storage_events.Event] = []
+        storage.events.subscribe(events.append)
+        storage.events.subscribe(async_events.append, asynchronous=True)
+        meta_events: List[storage_events.Event] = []
+        storage.events.subscribe(meta_events.append,
+                                 (storage_events.MetaEvent,))
+        self.mkcalendar("/calendar.ics/")
+        event = get_file_content("event1.ics")
+        self.put("/calendar.ics/event1.ics", event)
+        self.put("/calendar.ics/event1.ics",
+                 event.replace("SUMMARY:Event", "SUMMARY:Changed"), check=204)
+        self.proppatch("/calendar.ics/", """\
+<?xml version="1.0" encoding="utf-8"?>
+<propertyupdate xmlns="DAV:" xmlns:ICAL="http://apple.com/ns/ical/">
+  <set><prop><ICAL:calendar-color>#BADA55</ICAL:calendar-color></prop></set>
+</propertyupdate>""")
+        self.mkcalendar("/other.ics/")
+        self.put("/other.ics/event1.ics", event)
+        self.request("MOVE", "/calendar.ics/event1.ics", check=201,
+                     HTTP_DESTINATION="http://127.0.0.1/calendar.ics/moved.ics")
+        self.request("MOVE", "/calendar.ics/moved.ics", check=204,
+                     HTTP_DESTINATION="http://127.0.0.1/other.ics/event1.ics",
+                     HTTP_OVERWRITE="T")
+        self.delete("/other.ics/event1.ics")
+        self.put("/calendar.ics/", get_file_content("event_multiple.ics"))
+        self.delete("/calendar.ics/")
+        assert storage.events.flush(10)
+        assert async_events == events
+        assert all(isinstance(e, storage_events.MetaEvent)
+                   for e in meta_events)
+        assert len(meta_events) == 1
+        kinds = [type(e).__name__ for e in events]
+        assert kinds == ["CollectionEvent", "UpsertEvent", "UpsertEvent",
+                         "MetaEvent", "CollectionEvent", "UpsertEvent",
+                         "MoveEvent", "MoveEvent", "DeleteEvent",
+                         "CollectionEvent", "DeleteEvent"]
+        assert events[0] == storage_events.CollectionEvent(
+            "calendar.ics", {"tag": "VCALENDAR"}, False)
+        created, replaced = events[1], events[2]
+        assert isinstance(created, storage_events.UpsertEvent)
+        assert isinstance(replaced, storage_events.UpsertEvent)
+        assert created.path == "calendar.ics" and created.old_item is None
+        assert replaced.href == "event1.ics"
+        assert replaced.old_item is not None
+        assert "SUMMARY:Changed" in replaced.item.serialize()
+        assert "SUMMARY:Changed" not in replaced.old_item.serialize()
+        meta = events[3]
+        assert isinstance(meta, storage_events.MetaEvent)
+        assert meta.props.get("ICAL:calendar-color") == "#BADA55"
+        moved, overwritten = events[6], events[7]
+        assert isinstance(moved, storage_events.MoveEvent)
+        assert (moved.from_href, moved.to_path, moved.to_href) == (
+            "event1.ics", "calendar.ics", "moved.ics")
+        assert moved.replaced_item is None
+        # The item at the destination is overwritten
+        assert isinstance(overwritten, storage_events.MoveEvent)
+        assert (overwritten.to_path, overwritten.to_href) == (
+            "other.ics", "event1.ics")
+        assert overwritten.replaced_item is not None
+        assert "SUMMARY:Changed" not in overwritten.replaced_item.serialize()
+        deleted = events[8]
+        assert isinstance(deleted, storage_events.DeleteEvent)
+        assert deleted.href == "event1.ics" and deleted.old_item is not None
+        # The collection is replaced, without an event for each item
+        replaced_collection = events[9]
+        assert isinstance(replaced_collection, storage_events.CollectionEvent)
+        assert replaced_collection.path == "calendar.ics"
+        assert replaced_collection.replaced
+        assert events[-1] == storage_events.DeleteEvent(
+            "calendar.ics", None, None)
+        storage.events.unsubscribe(events.append)
+        self.mkcalendar("/calendar2.ics/")
+        assert len(events) == 11
+
+    def test_item_memory_cache_lru(self) -> None:
+        """Validate, evict and invalidate entries of the item memory cache."""
+        content = CacheContent("uid", "etag", "", "", "VEVENT", 0, 1)
+        memory_cache = ItemMemoryCache(2 * (ENTRY_OVERHEAD + 13))
+        memory_cache.put("a", 1, 10, content)
+        memory_cache.put("b", 1, 10, content)
+        assert memory_cache.get("a", 1, 10) == content
+        assert memory_cache.get("a", 2, 10) is None
+        assert memory_cache.get("a", 1, 11) is None
+        memory_cache.put("c", 1, 10, content)
+        # "b" is the least recently used entry
+        assert memory_cache.get("b", 1, 10) is None
+        assert memory_cache.get("a", 1, 10) == content
+        memory_cache.invalidate("a")
+        assert memory_cache.get("a", 1, 10) is None
+        assert memory_cache.stats() == {
+            "hits": 2, "misses": 4, "evictions": 1, "entries": 1,
+            "size": ENTRY_OVERHEAD + 13}
+
+    def test_item_memory_cache_stats_log(self, caplog) -> None:
+        """Log the statistics of the item memory cache when it only hits."""
+        caplog.set_level(logging.INFO)
+        content = CacheContent("uid", "etag", "", "", "VEVENT", 0, 1)
+        memory_cache = ItemMemoryCache(ENTRY_OVERHEAD + 13)
+        memory_cache.put("a", 1, 10, content)
+        memory_cache._log_time -= STATS_LOG_INTERVAL
+        assert memory_cache.get("a", 1, 10) == content
+        assert any("100% hit ratio (1/1)" in message
+                   for message in caplog.messages)
+
+    def test_item_memory_cache(self) -> None:
+        """Serve repeated reads from the item memory cache and reload items
+        changed by other means."""
+        self.configure({"storage": {"item_memory_cache_size": "1000000"}})
+        self.mkcalendar("/calendar.ics/")
+        event = get_file_content("event1.ics")
+        self.put("/calendar.ics/event1.ics", event)
+        storage = cast(multifilesystem.Storage, self.application._storage)
+        assert storage._item_memory_cache is not None
+        self.get("/calendar.ics/event1.ics")
+        hits = storage._item_memory_cache.stats()["hits"]
+        self.get("/calendar.ics/event1.ics")
+        assert storage._item_memory_cache.stats()["hits"] > hits
+        path = os.path.join(self.colpath, "collection-root", "calendar.ics",
+                            "event1.ics")
+        with open(path, "w", newline="") as f:
+            f.write(event.replace("Event", "Changed event"))
+        _, answer = self.get("/calendar.ics/event1.ics")
+        assert "Changed event" in answer
+
     def test_put_items_multiple(self) -> None:
         """Upload 2 items to calendar, check that collection inode number stays."""
         self.configure({"logging": {"response_content_on_debug": "False",
@@ -609,6 +1630,147 @@ class TestMultiFileSystemNoLock(BaseTest):
     test_item_cache_rebuild = TestMultiFileSystem.test_item_cache_rebuild
 
 
+class TestMultiFileSystemOptions(BaseTest):
+    """Tests for multifilesystem with optional features enabled."""
+
+    # Storage options, the same request tests run with each of them
+    STORAGE_OPTIONS: ClassVar[List[Dict[str, str]]] = [
+        {"use_packed_item_cache": "True"},
+        {"use_collection_manifest": "True"},
+        {"use_item_index": "True"},
+        {"item_memory_cache_size": "1000000"},
+        {"item_prefetch_workers": "2", "item_memory_cache_size": "1000000"},
+        {"use_principal_locks": "True"},
+        {"use_binary_cache": "True"},
+        {"use_sync_change_log": "True"},
+        {"use_sync_token_deltas": "True", "use_binary_cache": "True"},
+        {"use_history_store": "True"}]
+
+    def setup_method(self) -> None:
+        _TestBaseRequests.setup_method(cast(_TestBaseRequests, self))
+
+    @pytest.fixture(autouse=True, params=STORAGE_OPTIONS,
+                    ids=lambda options: ",".join(options))
+    def storage_options(self, request: Any) -> None:
+        self.configure({"storage": {"type": "multifilesystem",
+                                    **request.param}})
+
+    full_sync_token_support: ClassVar[bool] = True
+
+    _report_sync_token = _TestBaseRequests._report_sync_token
+    _test_filter = _TestBaseRequests._test_filter
+    test_add_event = _TestBaseRequests.test_add_event
+    test_add_event_duplicate_uid = _TestBaseRequests.test_add_event_duplicate_uid
+    test_update_event = _TestBaseRequests.test_update_event
+    test_update_event_uid_event = _TestBaseRequests.test_update_event_uid_event
+    test_get_vcard_exceed_size = _TestBaseRequests.test_get_vcard_exceed_size
+    test_put_whole_calendar = _TestBaseRequests.test_put_whole_calendar
+    test_put_whole_calendar_case_sensitive_uids = _TestBaseRequests.test_put_whole_calendar_case_sensitive_uids
+    test_put_whole_addressbook = _TestBaseRequests.test_put_whole_addressbook
+    test_delete = _TestBaseRequests.test_delete
+    test_move = _TestBaseRequests.test_move
+    test_move_between_collections = _TestBaseRequests.test_move_between_collections
+    test_propfind = _TestBaseRequests.test_propfind
+    test_proppatch = _TestBaseRequests.test_proppatch
+    test_principal_collection_creation = _TestBaseRequests.test_principal_collection_creation
+    # include tests related to filters and sync token
+    s: str = ""
+    for s in dir(_TestBaseRequests):
+        if s.startswith("test_") and {"filter", "sync"} & set(s.split("_")):
+            locals()[s] = getattr(_TestBaseRequests, s)
+    del s
+
+
+class TestSQLiteStorage(BaseTest):
+    """Tests for the sqlite storage backend."""
+
+    def setup_method(self) -> None:
+        _TestBaseRequests.setup_method(cast(_TestBaseRequests, self))
+        self.configure({"storage": {"type": "sqlite"}})
+
+    full_sync_token_support: ClassVar[bool] = True
+
+    _report_sync_token = _TestBaseRequests._report_sync_token
+    _test_filter = _TestBaseRequests._test_filter
+    s: str = ""
+    for s in dir(_TestBaseRequests):
+        if s.startswith("test_"):
+            locals()[s] = getattr(_TestBaseRequests, s)
+    del s
+
+    test_storage_events = TestMultiFileSystem.test_storage_events
+
+    def test_migrate(self) -> None:
+        """Copy collections, properties and items from the filesystem."""
+        self.configure({"storage": {"type": "multifilesystem"}})
+        self.mkcalendar("/calendar.ics/")
+        self.proppatch("/calendar.ics/", """\
+<?xml version="1.0" encoding="utf-8"?>
+<propertyupdate xmlns="DAV:" xmlns:ICAL="http://apple.com/ns/ical/">
+  <set><prop><ICAL:calendar-color>#BADA55</ICAL:calendar-color></prop></set>
+</propertyupdate>""")
+        event = get_file_content("event1.ics")
+        self.put("/calendar.ics/event1.ics", event)
+        self.put("/calendar.ics/renamed.ics",
+                 get_file_content("event2.ics"))
+        _, responses = self.propfind("/calendar.ics/", """\
+<?xml version="1.0" encoding="utf-8"?>
+<propfind xmlns="DAV:"><prop><getetag/></prop></propfind>""", HTTP_DEPTH="1")
+        source = self.application._storage
+        self.configure({"storage": {"type": "sqlite"}})
+        storage = cast(sqlite.Storage, self.application._storage)
+        with source.acquire_lock("r"), storage.acquire_lock("w"):
+            assert storage.migrate(source)
+        _, answer = self.get("/calendar.ics/event1.ics")
+        assert "Event" in answer
+        _, migrated = self.propfind("/calendar.ics/", """\
+<?xml version="1.0" encoding="utf-8"?>
+<propfind xmlns="DAV:"><prop><getetag/></prop></propfind>""", HTTP_DEPTH="1")
+        assert set(migrated) == set(responses)
+        for path in ("/calendar.ics/event1.ics", "/calendar.ics/renamed.ics"):
+            response = migrated[path]
+            assert not isinstance(response, int)
+            expected = responses[path]
+            assert not isinstance(expected, int)
+            assert response["D:getetag"][1].text == (
+                expected["D:getetag"][1].text)
+        collection = next(storage.discover("/calendar.ics/"))
+        assert isinstance(collection, sqlite.Collection)
+        assert collection.get_meta("ICAL:calendar-color") == "#BADA55"
+        assert storage.verify()
+
+    def test_sync_token_expired(self) -> None:
+        """Reject sync tokens older than the purged history."""
+        self.configure({"storage": {"max_sync_token_age": "0"}})
+        self.mkcalendar("/calendar.ics/")
+        self.put("/calendar.ics/event1.ics", get_file_content("event1.ics"))
+        storage = cast(sqlite.Storage, self.application._storage)
+        collection = next(storage.discover("/calendar.ics/"))
+        assert isinstance(collection, sqlite.Collection)
+        token, hrefs = collection.sync()
+        assert list(hrefs) == ["event1.ics"]
+        self.delete("/calendar.ics/event1.ics")
+        time.sleep(0.01)
+        new_token, _ = collection.sync()
+        assert new_token != token
+        with pytest.raises(ValueError, match="Token not found"):
+            collection.sync(token)
+        assert list(collection.sync(new_token)[1]) == []
+
+    def test_size_limit(self) -> None:
+        """Treat items larger than the size limit as missing."""
+        self.mkcalendar("/calendar.ics/")
+        self.put("/calendar.ics/event1.ics", get_file_content("event1.ics"))
+        storage = cast(sqlite.Storage, self.application._storage)
+        collection = next(storage.discover("/calendar.ics/"))
+        assert isinstance(collection, sqlite.Collection)
+        storage._max_resource_size = 10
+        assert list(collection.get_multi(["event1.ics", "missing.ics"])) == [
+            ("event1.ics", None), ("missing.ics", None)]
+        assert collection._get("event1.ics") is None
+        assert list(collection.get_all()) == []
+
+
 class TestCustomStorageSystem(BaseTest):
     """Test custom backend loading."""
 
@@ -16,12 +16,17 @@
 # along with Radicale.  If not, see <http://www.gnu.org/licenses/>.
 
 import contextlib
-from typing import (Any, Callable, ContextManager, Iterator, List, Mapping,
-                    MutableMapping, Protocol, Sequence, Tuple, TypeVar, Union,
-                    runtime_checkable)
+from typing import (TYPE_CHECKING, Any, Callable, ContextManager, Iterator,
+                    List, Mapping, MutableMapping, Protocol, Sequence, Tuple,
+                    TypeVar, Union, runtime_checkable)
+
+if TYPE_CHECKING:
+    from radicale import httputils
 
 WSGIResponseHeaders = Union[Mapping[str, str], Sequence[Tuple[str, str]]]
-WSGIResponse = Tuple[int, WSGIResponseHeaders, Union[None, str, bytes], Union[None, str]]
+WSGIResponse = Tuple[int, WSGIResponseHeaders,
+                     Union[None, str, bytes, "httputils.StreamingAnswer"],
+                     Union[None, str]]
 WSGIEnviron = Mapping[str, Any]
 WSGIStartResponse = Callable[[str, List[Tuple[str, str]]], Any]
 
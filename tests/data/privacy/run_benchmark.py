@@ -0,0 +1,368 @@
+#!/usr/bin/env python3
+"""Benchmarks for the privacy subsystem.
+
+Generates a synthetic storage with N address book owners of M cards each and
+a pool of users with privacy settings, then measures the privacy operations
+in-process (no server required):
+
+- building the identity index
+- find_identity_occurrences() per user
+- enforce_privacy() and a complete upload per PUT, enforce_privacy_bulk()
+  per whole-collection PUT
+- get_matching_cards() per disclosure template
+- reprocess_cards() per user
+
+The data is derived from a seed, so runs with the same parameters operate on
+the same data. Results are written as JSON and can be compared against an
+earlier run with --compare to detect regressions.
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+import vobject
+from generate_vcf_data import create_vcard
+
+import radicale
+from radicale import config, storage
+from radicale.item import Item
+from radicale.privacy.core import PrivacyCore
+from radicale.privacy.enforcement import PrivacyEnforcement
+from radicale.privacy.scanner import PrivacyScanner
+from radicale.privacy.templates import VALID_TEMPLATES
+from radicale.privacy.vcard_properties import PRIVACY_TO_VCARD_MAP
+
+# Version of the JSON result format
+RESULT_FORMAT_VERSION = 1
+
+PHOTO = ("data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAIAAACQd1PeAAAAD0lE"
+         "QVQIHQEEAPv/AP///wX+Av4DfRnGAAAAAElFTkSuQmCC")
+
+
+def user_email(index: int) -> str:
+    """Return the email of the privacy user with the given index."""
+    return f"user{index}@example.com"
+
+
+def user_phone(index: int) -> str:
+    """Return the phone number of the privacy user with the given index."""
+    return f"+4121{index:07d}"
+
+
+def generate_card_data(owner: int, number: int, users: int, overlap: float,
+                       rng: random.Random) -> Dict:
+    """Generate the data of one card (see generate_vcf_data.create_vcard()).
+
+    With probability ``overlap`` the card contains the identity of one of the
+    privacy users, otherwise an identity that only occurs in this card.
+    """
+    uid = f"owner{owner}-card{number}"
+    data: Dict[str, Any] = {
+        'uid': uid,
+        'name': f"Contact {owner}-{number}",
+        'company': f"Company {rng.randrange(100)}",
+        'title': rng.choice(["Engineer", "Manager", "Designer", "Director"]),
+        'birthday': f"19{rng.randrange(50, 99)}-0{rng.randrange(1, 9)}-1{rng.randrange(10)}",
+        'address': {
+            'street': f"{rng.randrange(1, 999)} Main St",
+            'city': "Lausanne",
+            'code': "1015",
+            'country': "Switzerland"
+        },
+    }
+    if rng.random() < overlap:
+        user = rng.randrange(users)
+        data['email'] = user_email(user)
+        if rng.random() < 0.5:
+            data['phone'] = user_phone(user)
+    else:
+        data['email'] = f"{uid}@example.org"
+    if rng.random() < 0.2:
+        data['photo'] = PHOTO
+        data['gender'] = rng.choice(["F", "M"])
+    return data
+
+
+def generate_settings(rng: random.Random) -> Dict[str, bool]:
+    """Generate random privacy settings."""
+    return {setting: rng.random() < 0.5 for setting in PRIVACY_TO_VCARD_MAP.keys()}
+
+
+def summarize(durations: List[float], units: int = 0) -> Dict[str, float]:
+    """Summarize a list of durations (in seconds).
+
+    Args:
+        durations: The measured durations
+        units: Number of units (e.g. cards) processed in total; adds the
+            throughput in units per second if set
+    """
+    ordered = sorted(durations)
+    total = sum(ordered)
+    result = {
+        "count": len(ordered),
+        "total": total,
+        "min": ordered[0],
+        "max": ordered[-1],
+        "mean": statistics.mean(ordered),
+        "median": statistics.median(ordered),
+        "p95": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+    }
+    if units:
+        result["units"] = units
+        result["units_per_second"] = units / total if total else 0.0
+    return result
+
+
+def measure(function: Callable[[], Any]) -> float:
+    """Return the duration of a call in seconds."""
+    start = time.perf_counter()
+    function()
+    return time.perf_counter() - start
+
+
+class PrivacyBenchmark:
+    """Runs the benchmarks on a synthetic storage in a temporary folder."""
+
+    def __init__(self, folder: str, users: int, owners: int, cards: int,
+                 overlap: float, seed: int, repeat: int) -> None:
+        self._users = users
+        self._owners = owners
+        self._cards = cards
+        self._overlap = overlap
+        self._repeat = repeat
+        self._rng = random.Random(seed)
+
+        collection_root = os.path.join(folder, "collection-root")
+        os.makedirs(collection_root, exist_ok=True)
+        self._configuration = config.load()
+        self._configuration.update({
+            "privacy": {
+                "database_path": os.path.join(folder, "privacy.db")
+            },
+            "storage": {
+                "type": "multifilesystem",
+                "filesystem_folder": folder
+            }
+        }, "benchmark")
+        self._storage = storage.load(self._configuration)
+        self._core = PrivacyCore(self._configuration)
+        self._core._privacy_db.init_db()
+        PrivacyScanner.reset()
+        self._core._scanner = PrivacyScanner(self._storage)
+
+    def populate(self) -> Dict[str, Any]:
+        """Create the privacy settings and upload the cards."""
+        for user in range(self._users):
+            success, result = self._core.create_settings(
+                user_email(user), generate_settings(self._rng))
+            if not success:
+                raise RuntimeError(f"Failed to create settings: {result}")
+
+        matching = 0
+        start = time.perf_counter()
+        for owner in range(self._owners):
+            collection, _, _ = self._storage.create_collection(
+                f"/owner{owner}/contacts", props={"tag": "VADDRESSBOOK"})
+            for number in range(self._cards):
+                data = generate_card_data(owner, number, self._users, self._overlap, self._rng)
+                if data['email'].endswith("@example.com"):
+                    matching += 1
+                item = Item(vobject_item=create_vcard(data),
+                            collection_path=f"owner{owner}/contacts")
+                collection.upload(f"{data['uid']}.vcf", item)
+        return {
+            "cards": self._owners * self._cards,
+            "cards_with_user_identity": matching,
+            "duration": time.perf_counter() - start,
+        }
+
+    def bench_index_build(self) -> Dict[str, float]:
+        scanner = self._core._scanner
+        return summarize([measure(scanner.refresh_index) for _ in range(self._repeat)],
+                         units=self._owners * self._cards * self._repeat)
+
+    def bench_find_identity_occurrences(self) -> Dict[str, float]:
+        scanner = self._core._scanner
+        durations = []
+        for _ in range(self._repeat):
+            for user in range(self._users):
+                durations.append(measure(lambda: scanner.find_identity_occurrences(user_email(user))))
+        return summarize(durations)
+
+    def bench_enforce_privacy(self) -> Dict[str, Dict[str, float]]:
+        enforcement = PrivacyEnforcement.get_instance(self._configuration)
+        collection, _, _ = self._storage.create_collection(
+            "/benchmark/contacts", props={"tag": "VADDRESSBOOK"})
+        enforce_durations = []
+        upload_durations = []
+        texts = []
+        for number in range(self._cards * self._repeat):
+            data = generate_card_data(self._owners, number, self._users, 1.0, self._rng)
+            text = create_vcard(data).serialize()
+            texts.append(text)
+            item = Item(vobject_item=vobject.readOne(text), collection_path="benchmark/contacts")
+            enforce_durations.append(measure(lambda: enforcement.enforce_privacy(item)))
+            item = Item(vobject_item=vobject.readOne(text), collection_path="benchmark/contacts")
+            upload_durations.append(measure(lambda: collection.upload(f"{data['uid']}.vcf", item)))
+        # Whole-collection PUT
+        bulk_durations = []
+        for _ in range(self._repeat):
+            items = [Item(vobject_item=vobject.readOne(text), collection_path="benchmark/contacts")
+                     for text in texts]
+            bulk_durations.append(measure(lambda: enforcement.enforce_privacy_bulk(items)))
+        return {
+            "enforce_privacy": summarize(enforce_durations),
+            "enforce_privacy_bulk": summarize(bulk_durations, units=len(texts) * self._repeat),
+            "upload": summarize(upload_durations),
+        }
+
+    def bench_get_matching_cards(self) -> Dict[str, Dict[str, float]]:
+        results = {}
+        for template in (None,) + VALID_TEMPLATES:
+            durations = []
+            for _ in range(self._repeat):
+                for user in range(self._users):
+                    durations.append(measure(
+                        lambda: self._core.get_matching_cards(user_email(user), template)))
+            results[template or "full"] = summarize(durations)
+        return results
+
+    def bench_reprocess(self) -> Dict[str, float]:
+        durations = []
+        cards = 0
+        for _ in range(self._repeat):
+            for user in range(self._users):
+                start = time.perf_counter()
+                success, result = self._core.reprocess_cards(user_email(user))
+                durations.append(time.perf_counter() - start)
+                if not success or not isinstance(result, dict):
+                    raise RuntimeError(f"Failed to reprocess cards: {result}")
+                reprocessed = result["reprocessed_cards"]
+                assert isinstance(reprocessed, int)
+                cards += reprocessed
+        return summarize(durations, units=cards)
+
+    def run(self) -> Dict[str, Any]:
+        """Run all benchmarks and return the results."""
+        results: Dict[str, Any] = {"populate": self.populate()}
+        results["index_build"] = self.bench_index_build()
+        results["find_identity_occurrences"] = self.bench_find_identity_occurrences()
+        results.update(self.bench_enforce_privacy())
+        results["get_matching_cards"] = self.bench_get_matching_cards()
+        # Last, as reprocessing rewrites the cards
+        results["reprocess_cards"] = self.bench_reprocess()
+        return results
+
+    def close(self) -> None:
+        PrivacyEnforcement.close_all()
+        self._core._privacy_db.close()
+        PrivacyScanner.reset()
+
+
+def flatten(results: Dict[str, Any], prefix: str = "") -> Dict[str, Dict[str, float]]:
+    """Map benchmark names (e.g. get_matching_cards.a) to their summaries."""
+    flat = {}
+    for name, value in results.items():
+        if not isinstance(value, dict):
+            continue
+        if "median" in value:
+            flat[prefix + name] = value
+        else:
+            flat.update(flatten(value, prefix + name + "."))
+    return flat
+
+
+def compare(baseline: Dict[str, Any], current: Dict[str, Any], threshold: float) -> List[str]:
+    """Return the benchmarks whose median got slower by more than threshold."""
+    old = flatten(baseline["results"])
+    new = flatten(current["results"])
+    regressions = []
+    for name, summary in sorted(new.items()):
+        if name not in old or not old[name]["median"]:
+            continue
+        ratio = summary["median"] / old[name]["median"]
+        if ratio > 1 + threshold:
+            regressions.append("%s: median %.6fs -> %.6fs (%+.0f%%)" % (
+                name, old[name]["median"], summary["median"], (ratio - 1) * 100))
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=20,
+                        help="number of users with privacy settings (default: %(default)s)")
+    parser.add_argument("--owners", type=int, default=5,
+                        help="number of address book owners (default: %(default)s)")
+    parser.add_argument("--cards", type=int, default=40,
+                        help="cards per address book (default: %(default)s)")
+    parser.add_argument("--overlap", type=float, default=0.3,
+                        help="fraction of cards containing the identity of a user "
+                        "(default: %(default)s)")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="repetitions of each measurement (default: %(default)s)")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="seed of the data generator (default: %(default)s)")
+    parser.add_argument("--output", help="write the results as JSON to this file "
+                        "(default: standard output)")
+    parser.add_argument("--compare", metavar="BASELINE",
+                        help="compare against the JSON results of an earlier run")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="relative slowdown of the median reported as regression "
+                        "(default: %(default)s)")
+    args = parser.parse_args(argv)
+    if min(args.users, args.owners, args.cards, args.repeat) < 1:
+        parser.error("--users, --owners, --cards and --repeat must be positive")
+    if not 0 <= args.overlap <= 1:
+        parser.error("--overlap must be between 0 and 1")
+
+    logging.basicConfig(level=logging.WARNING)
+    parameters = {name: getattr(args, name)
+                  for name in ("users", "owners", "cards", "overlap", "repeat", "seed")}
+    with tempfile.TemporaryDirectory() as folder:
+        benchmark = PrivacyBenchmark(folder, args.users, args.owners, args.cards,
+                                     args.overlap, args.seed, args.repeat)
+        try:
+            results = benchmark.run()
+        finally:
+            benchmark.close()
+
+    report = {
+        "format": RESULT_FORMAT_VERSION,
+        "radicale": radicale.VERSION,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "parameters": parameters,
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline.get("parameters") != parameters:
+            print("Warning: baseline was recorded with different parameters", file=sys.stderr)
+        regressions = compare(baseline, report, args.threshold)
+        for regression in regressions:
+            print("Regression: " + regression, file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
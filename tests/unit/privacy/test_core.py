@@ -2,16 +2,21 @@
 Tests for the privacy Core functionality.
 """
 
+import base64
+import logging
 import os
+import sys
 import tempfile
-from unittest.mock import patch
+from unittest.mock import PropertyMock, patch
 
 import pytest
 import vobject
 
 from radicale import config, storage
 from radicale.item import Item
+from radicale.privacy import photos
 from radicale.privacy.core import PrivacyCore, PrivacyScanner
+from radicale.privacy.photos import photo_id
 from radicale.privacy.templates import CD_FIELDS, shape_cards
 
 
@@ -523,6 +528,144 @@ def test_get_matching_cards_in_different_collections(core):
     assert len(matches) == 2  # Should find both cards
 
 
+def test_get_version_token(core):
+    """Test that the version token follows settings and card changes."""
+    assert core.get_version_token("invalid") is None
+
+    success, _ = core.get_settings("test@example.com")  # auto-creates settings
+    assert success
+    token = core.get_version_token("test@example.com")
+    assert token == core.get_version_token("test@example.com")
+    assert token != core.get_version_token("test@example.com", "cards/a")
+    assert token != core.get_version_token("other@example.com")
+
+    # Changing the settings changes the token
+    success, _ = core.update_settings("test@example.com", {"disallow_photo": True})
+    assert success
+    updated_token = core.get_version_token("test@example.com")
+    assert updated_token != token
+
+    # Uploading a card containing the identity changes the token
+    core.get_matching_cards("test@example.com")  # builds the identity index
+    vcard = vobject.vCard()
+    vcard.add('uid')
+    vcard.uid.value = "card1"
+    vcard.add('fn')
+    vcard.fn.value = "Test Contact"
+    vcard.add('email')
+    vcard.email.value = "test@example.com"
+    collection, _, _ = core._scanner._storage.create_collection("/user1/contacts")
+    other_token = core.get_version_token("other@example.com")
+    # As parsed from a PUT request, without component name
+    collection.upload("card1.vcf", Item(vobject_item=vcard, collection_path="user1/contacts"))
+    assert core.get_version_token("test@example.com") != updated_token
+    # Tokens of unrelated identities are unaffected
+    assert core.get_version_token("other@example.com") == other_token
+
+
+def test_get_version_token_external_change(core):
+    """Test that the version token follows changes made outside of the process."""
+    success, _ = core.get_settings("test@example.com")  # auto-creates settings
+    assert success
+    vcard = vobject.vCard()
+    vcard.add('uid')
+    vcard.uid.value = "card1"
+    vcard.add('fn')
+    vcard.fn.value = "Test Contact"
+    vcard.add('email')
+    vcard.email.value = "test@example.com"
+    collection, _, _ = core._scanner._storage.create_collection(
+        "/user1/contacts", props={"tag": "VADDRESSBOOK"})
+    collection.upload("card1.vcf", Item(vobject_item=vcard, collection_path="user1/contacts"))
+    success, result = core.get_matching_cards("test@example.com")
+    assert success
+    token = core.get_version_token("test@example.com")
+    assert token == core.get_version_token("test@example.com")
+
+    # Replace the card like another process, without invalidation
+    vcard.fn.value = "Changed Contact"
+    tmp_path = os.path.join(collection._filesystem_path, ".card1.vcf.tmp")
+    with open(tmp_path, "w", encoding="utf-8", newline="") as f:
+        f.write(vcard.serialize())
+    os.replace(tmp_path, os.path.join(collection._filesystem_path, "card1.vcf"))
+    # Don't depend on the resolution of the file system timestamps
+    folder_stat = os.stat(collection._filesystem_path)
+    os.utime(collection._filesystem_path,
+             ns=(folder_stat.st_atime_ns, folder_stat.st_mtime_ns + 10**9))
+    # The token is computed without loading any items
+    with patch.object(type(collection), "get_all", side_effect=AssertionError), \
+            patch.object(type(collection), "etag", new_callable=PropertyMock,
+                         side_effect=AssertionError):
+        updated_token = core.get_version_token("test@example.com")
+    assert updated_token != token
+    # The identity was rescanned, the token is stable again
+    success, result = core.get_matching_cards("test@example.com")
+    assert success
+    assert core.get_version_token("test@example.com") == updated_token
+
+
+def test_index_follows_storage_events(core):
+    """Test that the index follows the change events of subscribed storages."""
+    other_storage = storage.load(core._scanner._storage.configuration)
+    PrivacyScanner.subscribe(other_storage)
+    PrivacyScanner.subscribe(other_storage)  # subscribing again has no effect
+    assert len(other_storage.events._subscriptions) == 1
+    assert core._scanner.find_identity_occurrences("test@example.com") == []
+
+    vcard = vobject.vCard()
+    vcard.add('uid')
+    vcard.uid.value = "card1"
+    vcard.add('fn')
+    vcard.fn.value = "Test Contact"
+    vcard.add('email')
+    vcard.email.value = "test@example.com"
+    collection, _, _ = other_storage.create_collection(
+        "/user1/contacts", props={"tag": "VADDRESSBOOK"})
+    collection.upload("card1.vcf", Item(vobject_item=vcard, collection_path="user1/contacts"))
+    matches = core._scanner.find_identity_occurrences("test@example.com")
+    assert [match["href"] for match in matches] == ["card1.vcf"]
+
+    with other_storage.acquire_lock("w"):
+        other_storage.move(list(collection.get_multi(["card1.vcf"]))[0][1],
+                           collection, "card2.vcf")
+    matches = core._scanner.find_identity_occurrences("test@example.com")
+    assert [match["href"] for match in matches] == ["card2.vcf"]
+
+    # Moving over a card invalidates the identities of the replaced card
+    other_vcard = vobject.vCard()
+    other_vcard.add('uid')
+    other_vcard.uid.value = "card1"
+    other_vcard.add('fn')
+    other_vcard.fn.value = "Other Contact"
+    other_vcard.add('email')
+    other_vcard.email.value = "other@example.com"
+    other_collection, _, _ = other_storage.create_collection(
+        "/user2/contacts", props={"tag": "VADDRESSBOOK"})
+    other_collection.upload("card1.vcf", Item(vobject_item=other_vcard,
+                                              collection_path="user2/contacts"))
+    matches = core._scanner.find_identity_occurrences("other@example.com")
+    assert [match["href"] for match in matches] == ["card1.vcf"]
+    with other_storage.acquire_lock("w"):
+        other_storage.move(list(collection.get_multi(["card2.vcf"]))[0][1],
+                           other_collection, "card1.vcf")
+    assert core._scanner.find_identity_occurrences("other@example.com") == []
+    matches = core._scanner.find_identity_occurrences("test@example.com")
+    assert [match["collection_path"] for match in matches] == ["user2/contacts"]
+
+    # Replacing a whole collection invalidates the index
+    with other_storage.acquire_lock("w"):
+        other_storage.create_collection(
+            "/user1/contacts", [Item(vobject_item=vcard, collection_path="user1/contacts")],
+            props={"tag": "VADDRESSBOOK"})
+    matches = core._scanner.find_identity_occurrences("test@example.com")
+    assert sorted(match["collection_path"] for match in matches) == [
+        "user1/contacts", "user2/contacts"]
+
+    other_collection.delete("card1.vcf")
+    matches = core._scanner.find_identity_occurrences("test@example.com")
+    assert [match["collection_path"] for match in matches] == ["user1/contacts"]
+
+
 def test_reprocess_cards_not_found(core):
     """Test reprocessing cards for a non-existent user."""
     success, result = core.reprocess_cards("nonexistent@example.com")
@@ -807,7 +950,7 @@ def test_get_matching_cards_phone_formats(core):
 
 @pytest.mark.skipif(os.name == 'nt', reason="Problematic on Windows due to file locking")
 def test_get_matching_cards_with_photo(core):
-    """Test that photo field returns data URI string, not just True."""
+    """Test that an inline photo is returned as a reference, not inlined."""
     # Create privacy settings for the user
     settings = {
         "disallow_photo": False,
@@ -841,26 +984,46 @@ def test_get_matching_cards_with_photo(core):
     # Get matching cards
     success, result = core.get_matching_cards("photo@test.com")
 
-    # Verify photo contains actual value, not True
+    # Verify photo is a reference to the photo endpoint, not the image data
     assert success
     assert "matches" in result
     assert len(result["matches"]) == 1
     match = result["matches"][0]
     assert "photo" in match["fields"]
     assert isinstance(match["fields"]["photo"], str)
-    assert match["fields"]["photo"].startswith('data:image/')
-    assert match["fields"]["photo"] is not True
+    assert match["fields"]["photo"] == "/privacy/cards/photo@test.com/photo/" + photo_id(
+        "photouser/contacts", "test-photo-uid")
+
+    # The referenced photo is served decoded from the data URI
+    success, photo = core.get_card_photo("photo@test.com", photo_id("photouser/contacts", "test-photo-uid"))
+    assert success
+    assert photo.content_type == "image/png"
+    assert photo.data.startswith(b'\x89PNG')
+
+
+def test_decode_photo_content_type():
+    """Test that the content type of photos is detected from the data."""
+    svg = b'<svg xmlns="http://www.w3.org/2000/svg"><script>alert(1)</script></svg>'
+    vcard = vobject.vCard()
+    vcard.add('photo')
+    vcard.photo.value = 'data:image/svg+xml;base64,' + base64.b64encode(svg).decode()
+    assert photos.decode_photo(vcard.photo) == (svg, photos.UNKNOWN_CONTENT_TYPE)
+    # The claimed type is ignored for recognized images as well
+    webp = b'RIFF\x00\x00\x00\x00WEBPVP8 '
+    vcard.photo.value = 'data:image/svg+xml;base64,' + base64.b64encode(webp).decode()
+    assert photos.decode_photo(vcard.photo) == (webp, "image/webp")
+    vcard.photo.value = svg
+    vcard.photo.params['TYPE'] = ['SVG+XML']
+    assert photos.decode_photo(vcard.photo) == (svg, photos.UNKNOWN_CONTENT_TYPE)
 
 
 @pytest.mark.skipif(os.name == 'nt', reason="Prolematic on Windows due to file locking")
 def test_get_matching_cards_with_binary_photo(core):
-    """Test that a vCard 3.0 ENCODING=b photo is returned as a data URI.
+    """Test that a vCard 3.0 ENCODING=b photo is served by reference.
 
-    vobject decodes base64-encoded photos to bytes; the web UI needs a
-    data URI string to render them in <img src>.
+    vobject decodes base64-encoded photos to bytes; the bytes are served
+    by get_card_photo() instead of being inlined into the card listing.
     """
-    import base64
-
     # Create privacy settings for the user
     settings = {
         "disallow_photo": False,
@@ -899,15 +1062,68 @@ def test_get_matching_cards_with_binary_photo(core):
     # Get matching cards
     success, result = core.get_matching_cards("jpeg@test.com")
 
-    # Verify the photo is a renderable JPEG data URI, not a bytes repr
+    # Verify the photo is a reference, not a bytes repr
     assert success
     assert len(result["matches"]) == 1
     match = result["matches"][0]
-    photo = match["fields"]["photo"]
-    assert isinstance(photo, str)
-    assert photo.startswith('data:image/jpeg;base64,')
-    payload = photo[len('data:image/jpeg;base64,'):]
-    assert base64.b64decode(payload) == jpeg_bytes
+    reference = match["fields"]["photo"]
+    assert isinstance(reference, str)
+    assert reference.startswith('/privacy/cards/jpeg@test.com/photo/')
+
+    # The referenced photo is the JPEG (too small to be resized)
+    success, photo = core.get_card_photo("jpeg@test.com", reference.rsplit("/", 1)[1])
+    assert success
+    assert photo.content_type == "image/jpeg"
+    assert photo.data == jpeg_bytes
+    assert photo.etag.startswith('"') and photo.etag.endswith('"')
+
+    # Thumbnails are cached by card etag
+    success, cached = core.get_card_photo("jpeg@test.com", reference.rsplit("/", 1)[1])
+    assert cached is photo
+
+    # The ETag is known from the identity index without loading the card
+    with patch.object(core, '_find_card_item') as mock_find:
+        assert core.get_card_photo_etag("jpeg@test.com", reference.rsplit("/", 1)[1]) == photo.etag
+        mock_find.assert_not_called()
+    assert core.get_card_photo_etag("jpeg@test.com", "unknown") is None
+
+
+def test_make_thumbnail_without_pillow(caplog, monkeypatch):
+    """Test that the original image is served and the missing Pillow is logged once."""
+    monkeypatch.setitem(sys.modules, "PIL", None)
+    monkeypatch.setattr(photos, "_pillow_missing_logged", False)
+    with caplog.at_level(logging.WARNING):
+        for _ in range(2):
+            assert photos.make_thumbnail(b"data", "image/png", 64) == (b"data", "image/png")
+    assert sum("Pillow is not installed" in record.getMessage() for record in caplog.records) == 1
+
+
+@pytest.mark.skipif(os.name == 'nt', reason="Prolematic on Windows due to file locking")
+def test_get_card_photo_of_other_identity(core):
+    """Test that photos of cards not matching the identity are not served."""
+    vcard = vobject.vCard()
+    vcard.add('uid')
+    vcard.uid.value = "other-photo-uid"
+    vcard.add('fn')
+    vcard.fn.value = "Other"
+    vcard.add('email')
+    vcard.email.value = "owner@test.com"
+    vcard.add('photo')
+    vcard.photo.value = b'\x89PNG' + b'\x00' * 16
+    vcard.photo.params['ENCODING'] = ['b']
+
+    collection, _, _ = core._scanner._storage.create_collection("/otheruser/contacts")
+    item = Item(vobject_item=vcard, collection_path="otheruser/contacts", component_name="VCARD")
+    collection.upload("other-photo.vcf", item)
+
+    requested = photo_id("otheruser/contacts", "other-photo-uid")
+    success, photo = core.get_card_photo("intruder@test.com", requested)
+    assert success
+    assert photo is None
+
+    success, photo = core.get_card_photo("owner@test.com", requested)
+    assert success
+    assert photo is not None
 
 
 @pytest.mark.skipif(os.name == 'nt', reason="Prolematic on Windows due to file locking")
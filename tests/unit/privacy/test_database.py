@@ -76,6 +76,22 @@ def test_get_user_settings(db_manager):
     assert user_settings.disallow_photo is False
 
 
+def test_get_user_settings_bulk(db_manager, monkeypatch):
+    """Test retrieving the settings of many identifiers at once."""
+    monkeypatch.setattr("radicale.privacy.database.BULK_QUERY_SIZE", 2)
+    db_manager.create_user_settings("a@example.com", {"disallow_photo": True})
+    db_manager.create_user_settings("b@example.com", {"disallow_photo": False})
+    db_manager.create_user_settings("+41211234567", {"disallow_gender": True})
+
+    result = db_manager.get_user_settings_bulk(
+        iter(["a@example.com", "+41211234567", "unknown@example.com", "b@example.com"]))
+    assert set(result) == {"a@example.com", "b@example.com", "+41211234567"}
+    assert result["a@example.com"].disallow_photo is True
+    assert result["b@example.com"].disallow_photo is False
+    assert result["+41211234567"].disallow_gender is True
+    assert db_manager.get_user_settings_bulk([]) == {}
+
+
 def test_get_nonexistent_user_settings(db_manager):
     """Test retrieving settings for a non-existent user."""
     user_settings = db_manager.get_user_settings("nonexistent@example.com")
@@ -262,3 +262,78 @@ def test_privacy_violation_enforcement(privacy_enforcement, create_vcard, create
     assert 'photo' in modified_vcard.contents
     assert 'bday' in modified_vcard.contents
     assert 'adr' in modified_vcard.contents
+
+
+def test_bulk_enforcement(privacy_enforcement, create_vcard, create_item, mocker):
+    """Test that bulk enforcement resolves settings once and applies them per item."""
+    restricted = create_item(create_vcard(
+        name="John Doe",
+        email="john@example.com",
+        gender="M",
+        company="ACME Corp",
+        title="Developer",
+    ))
+    combined = create_item(create_vcard(
+        name="John Doe",
+        email="john@example.com",
+        phone="+1234567890",
+        photo="base64photo",
+        company="ACME Corp",
+    ))
+    unrestricted = create_item(create_vcard(
+        name="Jane Doe",
+        email="jane@example.com",
+        company="ACME Corp",
+    ))
+    unrestricted_text = unrestricted.serialize()
+    calendar_item = radicale_item.Item(
+        collection_path=pathutils.strip_path(pathutils.sanitize_path("/test/collection")),
+        text="BEGIN:VCALENDAR\r\nEND:VCALENDAR\r\n",
+        component_name="VCALENDAR",
+        name="VCALENDAR"
+    )
+
+    privacy_enforcement._privacy_db.get_user_settings_bulk.return_value = {
+        "john@example.com": mocker.Mock(
+            disallow_photo=False,
+            disallow_gender=True,
+            disallow_birthday=False,
+            disallow_address=False,
+            disallow_company=True,
+            disallow_title=False,
+            disallow_related=False,
+            disallow_nickname=False,
+        ),
+        "+1234567890": mocker.Mock(
+            disallow_photo=True,
+            disallow_gender=False,
+            disallow_birthday=False,
+            disallow_address=False,
+            disallow_company=False,
+            disallow_title=False,
+            disallow_related=False,
+            disallow_nickname=False,
+        ),
+    }
+
+    items = privacy_enforcement.enforce_privacy_bulk(
+        iter([restricted, combined, unrestricted, calendar_item]))
+
+    assert items == [restricted, combined, unrestricted, calendar_item]
+    privacy_enforcement._privacy_db.get_user_settings_bulk.assert_called_once()
+    (identifiers,), _ = privacy_enforcement._privacy_db.get_user_settings_bulk.call_args
+    assert set(identifiers) == {"john@example.com", "jane@example.com", "+1234567890"}
+    privacy_enforcement._privacy_db.get_user_settings.assert_not_called()
+
+    assert 'gender' not in restricted.vobject_item.contents
+    assert 'org' not in restricted.vobject_item.contents
+    assert 'title' in restricted.vobject_item.contents
+    assert "ORG" not in restricted.serialize()
+
+    # Most restrictive settings of all identifiers of the item
+    assert 'org' not in combined.vobject_item.contents
+    assert 'photo' not in combined.vobject_item.contents
+
+    # Items without restrictions are not serialized again
+    assert 'org' in unrestricted.vobject_item.contents
+    assert unrestricted.serialize() is unrestricted_text
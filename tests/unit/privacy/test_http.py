@@ -13,6 +13,7 @@ import pytest
 
 from radicale import config
 from radicale.privacy.http import PrivacyHTTP
+from radicale.privacy.photos import Photo
 
 
 @pytest.fixture
@@ -227,6 +228,39 @@ def test_get_matching_cards_success(http_app):
         assert data["matches"][0]["vcard_uid"] == "card1"
 
 
+@pytest.mark.skipif(os.name == 'nt', reason="Prolematic on Windows due to file locking")
+def test_get_matching_cards_not_modified(http_app):
+    """Test conditional GET requests for matching cards."""
+    with patch.object(http_app._privacy_core, 'get_version_token') as mock_token, \
+            patch.object(http_app._privacy_core, 'get_matching_cards') as mock_get:
+        mock_token.return_value = '"v1"'
+        mock_get.return_value = (True, {"matches": []})
+
+        environ = {
+            "REQUEST_METHOD": "GET",
+            "PATH_INFO": "/privacy/cards/test@example.com",
+            "HTTP_AUTHORIZATION": f"Bearer {http_app._test_token}"
+        }
+        status, headers, _, _ = http_app.do_GET(environ, "/privacy/cards/test@example.com")
+        assert status == client.OK
+        assert headers["ETag"] == '"v1"'
+
+        environ["HTTP_IF_NONE_MATCH"] = '"v1"'
+        status, headers, body, _ = http_app.do_GET(environ, "/privacy/cards/test@example.com")
+        assert status == client.NOT_MODIFIED
+        assert headers["ETag"] == '"v1"'
+        assert body is None
+        mock_get.assert_called_once()
+
+        # A changed token yields the full response again
+        mock_token.return_value = '"v2"'
+        status, headers, _, _ = http_app.do_GET(environ, "/privacy/cards/test@example.com")
+        assert status == client.OK
+        assert headers["ETag"] == '"v2"'
+        # The token is computed once per request
+        assert mock_token.call_count == 3
+
+
 @pytest.mark.skipif(os.name == 'nt', reason="Prolematic on Windows due to file locking")
 def test_create_settings_success(http_app):
     """Test successful POST request for creating settings."""
@@ -469,3 +503,76 @@ def test_get_matching_cards_invalid_template_param(http_app):
         assert status == client.BAD_REQUEST
         assert "error" in json.loads(body)
         mock_get.assert_not_called()
+
+
+@pytest.mark.skipif(os.name == 'nt', reason="Prolematic on Windows due to file locking")
+def test_get_card_photo(http_app):
+    """Test that a photo is served with a strong ETag and revalidated with 304."""
+    photo = Photo(b"\x89PNG-data", "image/png", '"abc123"')
+    with patch.object(http_app._privacy_core, 'get_card_photo') as mock_get:
+        mock_get.return_value = (True, photo)
+
+        environ = {
+            "REQUEST_METHOD": "GET",
+            "PATH_INFO": "/privacy/cards/test@example.com/photo/0123abcd",
+            "QUERY_STRING": "size=64",
+            "HTTP_AUTHORIZATION": f"Bearer {http_app._test_token}"
+        }
+
+        status, headers, body, _ = http_app.do_GET(environ, environ["PATH_INFO"])
+
+        assert status == client.OK
+        assert headers["Content-Type"] == "image/png"
+        assert headers["ETag"] == '"abc123"'
+        assert headers["X-Content-Type-Options"] == "nosniff"
+        assert headers["Content-Security-Policy"] == "default-src 'none'"
+        assert body == b"\x89PNG-data"
+        mock_get.assert_called_once_with("test@example.com", "0123abcd", 64)
+
+        environ["HTTP_IF_NONE_MATCH"] = '"other", "abc123"'
+        status, headers, body, _ = http_app.do_GET(environ, environ["PATH_INFO"])
+
+        assert status == client.NOT_MODIFIED
+        assert headers["ETag"] == '"abc123"'
+        assert body is None
+
+
+@pytest.mark.skipif(os.name == 'nt', reason="Prolematic on Windows due to file locking")
+def test_get_card_photo_revalidated_without_loading(http_app):
+    """Test that a revalidation with a known ETag doesn't load the photo."""
+    with patch.object(http_app._privacy_core, 'get_card_photo_etag') as mock_etag, \
+            patch.object(http_app._privacy_core, 'get_card_photo') as mock_get:
+        mock_etag.return_value = '"abc123"'
+
+        environ = {
+            "REQUEST_METHOD": "GET",
+            "PATH_INFO": "/privacy/cards/test@example.com/photo/0123abcd",
+            "HTTP_IF_NONE_MATCH": '"abc123"',
+            "HTTP_AUTHORIZATION": f"Bearer {http_app._test_token}"
+        }
+
+        status, headers, body, _ = http_app.do_GET(environ, environ["PATH_INFO"])
+
+        assert status == client.NOT_MODIFIED
+        assert headers["ETag"] == '"abc123"'
+        assert body is None
+        mock_etag.assert_called_once_with("test@example.com", "0123abcd", None)
+        mock_get.assert_not_called()
+
+
+@pytest.mark.skipif(os.name == 'nt', reason="Prolematic on Windows due to file locking")
+def test_get_card_photo_not_found(http_app):
+    """Test that an unknown photo is answered with 404."""
+    with patch.object(http_app._privacy_core, 'get_card_photo') as mock_get:
+        mock_get.return_value = (True, None)
+
+        environ = {
+            "REQUEST_METHOD": "GET",
+            "PATH_INFO": "/privacy/cards/test@example.com/photo/0123abcd",
+            "HTTP_AUTHORIZATION": f"Bearer {http_app._test_token}"
+        }
+
+        status, headers, body, _ = http_app.do_GET(environ, environ["PATH_INFO"])
+
+        assert status == client.NOT_FOUND
+        assert "error" in json.loads(body)
@@ -1,13 +1,15 @@
 """Unit tests for the privacy scanner module."""
 
+import logging
 import os
 from typing import Optional
 
 import pytest
 import vobject
 
+from radicale import config
 from radicale.item import Item
-from radicale.privacy.scanner import PrivacyScanner
+from radicale.privacy.scanner import INDEX_KEY_SIZE, PrivacyScanner
 from radicale.storage.multifilesystem.get import CollectionPartGet
 
 
@@ -233,6 +235,50 @@ def test_find_identity_occurrences(scanner, create_test_vcard, storage, mocker):
     collection2.get_all.assert_not_called()
 
 
+def test_hashed_index(create_test_vcard, mocker, caplog):
+    """Test that the hashed index mode stores and logs no identities in clear text."""
+    configuration = config.load()
+    configuration.update({"privacy": {"index_hashing": "True"}}, "test")
+    storage = mocker.MagicMock()
+    storage.configuration = configuration
+    collection = mocker.MagicMock(spec=CollectionPartGet)
+    collection.path = "user1/contacts"
+    collection.get_all.return_value = [
+        create_test_vcard("test1", "test@example.com", "+41 21 123 45 67"),
+        create_test_vcard("test2", "other@example.com")
+    ]
+    storage.discover.return_value = [collection]
+
+    PrivacyScanner.reset()
+    scanner = PrivacyScanner(storage)
+    with caplog.at_level(logging.DEBUG, logger="radicale.privacy.scanner"):
+        matches = scanner.find_identity_occurrences("test@example.com")
+    assert [match["vcard_uid"] for match in matches] == ["test1"]
+    assert "email" not in matches[0]
+    assert "Starting scan for identity" in caplog.text
+    assert "example.com" not in caplog.text
+    assert "+41" not in caplog.text
+
+    # Only fixed-width keys, no identities in the index
+    assert len(scanner._index) == 3
+    assert all(isinstance(key, bytes) and len(key) == INDEX_KEY_SIZE for key in scanner._index)
+    assert "example.com" not in repr(scanner._index)
+    assert "+41211234567" not in repr(scanner._index)
+
+    # Phone numbers are normalized before hashing
+    collection.get_all.reset_mock()
+    matches = scanner.find_identity_occurrences("+41211234567")
+    assert [match["vcard_uid"] for match in matches] == ["test1"]
+    assert scanner.find_identity_occurrences("+41 21 123 45 67") == matches
+    collection.get_all.assert_not_called()
+
+    # Invalidation and generations use the same keys
+    generation = scanner.generation("test@example.com")
+    scanner.invalidate(["test@example.com"])
+    assert scanner.generation("test@example.com") != generation
+    assert len(scanner._index) == 2
+
+
 def test_error_handling(scanner, storage, mocker):
     """Test error handling during scanning."""
     # Create a mock collection that raises an exception
@@ -83,6 +83,29 @@ export async function downloadUserCards(user: string): Promise<Response> {
   });
 }
 
+/**
+ * Fetch the thumbnail of a card photo referenced by the card listing.
+ * Forwards If-None-Match so unchanged photos are answered with 304.
+ */
+export async function getUserCardPhoto(
+  user: string,
+  photoId: string,
+  ifNoneMatch?: string | null
+): Promise<Response> {
+  const token = process.env.RADICALE_TOKEN;
+  if (!token) throw new Error('RADICALE_TOKEN is not configured');
+
+  return fetch(
+    buildUrl(`/privacy/cards/${encodeURIComponent(user)}/photo/${encodeURIComponent(photoId)}`),
+    {
+      headers: {
+        Authorization: `Bearer ${token}`,
+        ...(ifNoneMatch ? { 'If-None-Match': ifNoneMatch } : {}),
+      },
+    }
+  );
+}
+
 export type CardMatch = {
   vcard_uid: string;
   collection_path: string;
@@ -46,11 +46,15 @@ export type TemplateCardsResponse =
 
 /**
  * Return the photo value only if it is a renderable image source
- * (data URI or http(s) URL), otherwise null. Guards against malformed
- * values ending up in <img src>, where a relative URL containing an
- * invalid percent-encoding can crash the dev server (URI malformed).
+ * (data URI or http(s) URL), otherwise null. Photo references returned by
+ * radicale (/privacy/cards/<user>/photo/<id>) are mapped to the photo proxy
+ * route. Guards against malformed values ending up in <img src>, where a
+ * relative URL containing an invalid percent-encoding can crash the dev
+ * server (URI malformed).
  */
 export function getPhotoSrc(photo: unknown): string | null {
   if (typeof photo !== 'string') return null;
+  const reference = /^\/privacy\/cards\/[^/]+\/photo\/([0-9a-f]+)$/.exec(photo);
+  if (reference) return `/api/user/photo/${reference[1]}`;
   return /^(data:image\/|https?:\/\/)/.test(photo) ? photo : null;
 }
@@ -18,6 +18,7 @@ export default [
   route('/api/user/preferences', 'routes/api.user.preferences.tsx'),
   // API routes for user cards
   route('/api/user/cards', 'routes/api.user.cards.tsx'),
+  route('/api/user/photo/:id', 'routes/api.user.photo.tsx'),
   // API routes for data download
   route('/api/user/download', 'routes/api.user.download.tsx'),
 ] satisfies RouteConfig;
@@ -0,0 +1,64 @@
+import { verifyAuth } from '~/lib/auth';
+import { getUserCardPhoto } from '~/api/radicale';
+
+// Loader function for GET requests: serve the thumbnail of a card photo.
+// Proxies the Radicale photo endpoint, which only serves photos of cards
+// containing the authenticated user's identity, and passes ETag based
+// revalidation through to the browser.
+export async function loader({ request, params }: { request: Request; params: { id?: string } }) {
+  try {
+    const env = process.env;
+    const isDevelopment = import.meta.env.DEV;
+    const JWT_SECRET =
+      env.JWT_SECRET || (isDevelopment ? 'dev-jwt-secret-key-for-testing-only' : undefined);
+
+    if (!JWT_SECRET) {
+      return new Response(
+        JSON.stringify({ error: 'Server configuration error: JWT_SECRET is not configured.' }),
+        { status: 500, headers: { 'Content-Type': 'application/json' } }
+      );
+    }
+
+    const user = await verifyAuth(request, JWT_SECRET);
+    if (!user) {
+      return new Response(JSON.stringify({ error: 'Unauthorized' }), {
+        status: 401,
+        headers: { 'Content-Type': 'application/json' },
+      });
+    }
+
+    if (!params.id || !/^[0-9a-f]+$/.test(params.id)) {
+      return new Response(JSON.stringify({ error: 'Photo not found' }), {
+        status: 404,
+        headers: { 'Content-Type': 'application/json' },
+      });
+    }
+
+    const resp = await getUserCardPhoto(
+      user.contact,
+      params.id,
+      request.headers.get('If-None-Match')
+    );
+    const headers = new Headers({ 'Cache-Control': 'private, no-cache' });
+    const etag = resp.headers.get('ETag');
+    if (etag) headers.set('ETag', etag);
+
+    if (resp.status === 304) {
+      return new Response(null, { status: 304, headers });
+    }
+    if (!resp.ok) {
+      return new Response(JSON.stringify({ error: 'Photo not found' }), {
+        status: resp.status === 404 ? 404 : 502,
+        headers: { 'Content-Type': 'application/json' },
+      });
+    }
+
+    headers.set('Content-Type', resp.headers.get('Content-Type') || 'application/octet-stream');
+    return new Response(await resp.arrayBuffer(), { status: 200, headers });
+  } catch {
+    return new Response(JSON.stringify({ error: 'Internal server error' }), {
+      status: 500,
+      headers: { 'Content-Type': 'application/json' },
+    });
+  }
+}